@@ -7,11 +7,14 @@ import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 os.environ['OMP_NUM_THREADS'] = '1'
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import numpy as np
 from PIL import Image
+import base64
+import hashlib
 import io
+import time
 
 app = Flask(__name__)
 
@@ -29,11 +32,184 @@ CORS(app, resources={
 
 # Load model at startup
 print("Loading TensorFlow model...")
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing.image import img_to_array
+from model_reload import ModelReloader, ServedModel, load_canaries
 
-model = load_model("best_model.h5", compile=False)
-print("Model loaded successfully!")
+MODEL_PATH = os.environ.get("MODEL_PATH", "best_model.h5")
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+# Backbone / head split, for features that need the pooled embedding
+NEEDS_SPLIT = bool(os.environ.get("NEIGHBOR_INDEX") or os.environ.get("FEEDBACK_DIR"))
+COMPARE_PATHS = [p.strip() for p in os.environ.get("COMPARE_MODELS", "").split(",") if p.strip()]
+
+def load_served(path):
+    """ServedModel for path, with the comparison heads when COMPARE_MODELS is set."""
+    served = ServedModel(path, split=NEEDS_SPLIT)
+    if COMPARE_PATHS:
+        # Side-by-side comparison of several models (multi_head.py); heads on the
+        # same frozen backbone share one backbone pass
+        from multi_head import MultiHeadModel
+        served.extras['compare'] = MultiHeadModel(
+            {p: (served.model if p == served.path else p) for p in [served.path] + COMPARE_PATHS})
+    return served
+
+def on_model_swap(old, new):
+    global updater
+    if updater is not None:
+        if new.fingerprint == updater.fingerprint:
+            updater.adopt(get_head_weights(new.model))
+        else:
+            updater.stop()
+            updater = None
+            print("[WARN] New model has a different backbone; stored feedback embeddings no longer match, "
+                  "so online head updates are off until restart")
+    if neighbor_index is not None and neighbor_index.meta.get("backbone_fingerprint") not in (None, new.fingerprint):
+        print(f"[WARN] {os.environ['NEIGHBOR_INDEX']} was built with a different backbone than {new.path}; "
+              "rebuild it with embedding_index.py")
+
+# Canary images gate hot swaps (model_reload.py)
+reloader = ModelReloader(
+    MODEL_PATH, load_served,
+    canaries=load_canaries(os.environ.get("CANARY_DIR", "data/water images/test"),
+                           int(os.environ.get("CANARY_COUNT", 8))),
+    min_agreement=float(os.environ.get("RELOAD_MIN_AGREEMENT", 0.0)),
+    min_accuracy=float(os.environ.get("RELOAD_MIN_ACCURACY", 0.0)),
+    on_swap=on_model_swap)
+print(f"Model loaded successfully! ({MODEL_PATH}, input {reloader.current.img_size[0]}x{reloader.current.img_size[1]}, "
+      f"{len(reloader.canary_images)} canary images)")
+
+def cnn_probability(img, served=None):
+    """P(Dirty) from the CNN for an RGB PIL image."""
+    served = served or reloader.current
+    if updater is not None:
+        return cnn_embedding_and_probability(img, served)[1]
+    return float(served.probabilities([img])[0])
+
+def cnn_embedding_and_probability(img, served=None):
+    """(pooled embedding [D], P(Dirty)) with one backbone pass."""
+    served = served or reloader.current
+    features = served.extractor.predict_on_batch(served.to_array([img]))
+    if updater is not None:
+        return features[0], float(updater.predict(features)[0])
+    return features[0], float(served.head.predict_on_batch(features)[0][0])
+
+def cnn_batch_probabilities(batch, served=None):
+    """P(Dirty) [N] for a preprocessed float batch, through the live feedback head when there is one."""
+    served = served or reloader.current
+    if updater is not None:
+        return updater.predict(served.extractor.predict_on_batch(batch))
+    return served.model.predict_on_batch(batch).ravel()
+
+# Optional color-statistics pre-classifier (color_cascade.py); confident cases skip the CNN
+cascade = None
+if os.environ.get("CASCADE_MODEL"):
+    from color_cascade import Cascade, load_linear
+    cascade = Cascade(load_linear(os.environ["CASCADE_MODEL"]), cnn_probability,
+                      threshold=float(os.environ.get("CASCADE_THRESHOLD", 0.9)))
+    print(f"Cascade enabled ({os.environ['CASCADE_MODEL']}, threshold {cascade.threshold})")
+
+if COMPARE_PATHS:
+    compare = reloader.current.extras['compare']
+    print(f"Comparing {compare.names}; backbone groups {compare.describe()}")
+
+# High-resolution tiled analysis (tiled_inference.py); POST /predict?tiled=1
+# (&tiles=N&overlap=F&aggregate=max|mean|map override these defaults)
+TILE_COUNT = int(os.environ.get("TILE_COUNT", 4))
+TILE_OVERLAP = float(os.environ.get("TILE_OVERLAP", 0.25))
+TILE_AGGREGATE = os.environ.get("TILE_AGGREGATE", "max")
+TILE_MAX_COUNT = int(os.environ.get("TILE_MAX_COUNT", 8))
+
+# Optional similar-image lookup (embedding_index.py); POST /predict?neighbors=5
+neighbor_index = None
+if os.environ.get("NEIGHBOR_INDEX"):
+    from embedding_index import EmbeddingIndex
+    neighbor_index = EmbeddingIndex(os.environ["NEIGHBOR_INDEX"])
+    if neighbor_index.meta.get("backbone_fingerprint") not in (None, reloader.current.fingerprint):
+        print(f"[WARN] {os.environ['NEIGHBOR_INDEX']} was built with a different backbone than {MODEL_PATH}; "
+              "neighbors will not be meaningful until it is rebuilt")
+    print(f"Neighbor index loaded ({len(neighbor_index)} images, {neighbor_index.meta['kind']})")
+
+# Optional online head updates from operator corrections (feedback_learner.py)
+updater = None
+if os.environ.get("FEEDBACK_DIR"):
+    from embeddings import get_head_weights, compute_embeddings
+    from feedback_learner import CLASS_NAMES, FeedbackStore, HeadUpdater, head_version, load_head
+    from shard_dataset import collect_split_files
+    served = reloader.current
+    store = FeedbackStore(os.environ["FEEDBACK_DIR"])
+    live_head = load_head(store.dir / "head.npz", served.fingerprint)
+    live_version = head_version(store.dir / "head.npz") if live_head is not None else 0
+    live_head = live_head or get_head_weights(served.model)
+    base_X = base_y = None
+    data_dir = os.environ.get("FEEDBACK_DATA_DIR", "data/water images")
+    if os.path.isdir(data_dir):
+        base_X, base_y, _ = compute_embeddings(served.extractor, collect_split_files("train", data_dir))
+    else:
+        print(f"[WARN] {data_dir} not found; head updates will use the corrections only")
+    updater = HeadUpdater(live_head, store, base_X, base_y, served.fingerprint,
+                          interval=float(os.environ.get("FEEDBACK_INTERVAL", 300)),
+                          min_new=int(os.environ.get("FEEDBACK_MIN_NEW", 5)),
+                          feedback_weight=float(os.environ.get("FEEDBACK_WEIGHT", 5.0)),
+                          version=live_version).start()
+    print(f"Feedback learning enabled ({store.path}, {len(store)} corrections so far)")
+
+# Optional shadow evaluation of a candidate model on sampled traffic (shadow_eval.py)
+shadow = None
+if os.environ.get("SHADOW_MODEL"):
+    from shadow_eval import ShadowEvaluator
+    candidate = ServedModel(os.environ["SHADOW_MODEL"])
+    candidate.warm()
+    shadow = ShadowEvaluator(candidate, sample_rate=float(os.environ.get("SHADOW_SAMPLE_RATE", 0.1)),
+                             queue_size=int(os.environ.get("SHADOW_QUEUE", 32)),
+                             max_age=float(os.environ.get("SHADOW_MAX_AGE", 5.0)),
+                             log_path=os.environ.get("SHADOW_LOG"))
+    print(f"Shadowing {candidate.path} on {shadow.sample_rate:.0%} of requests")
+
+# Write-behind audit log of every /predict (prediction_log.py); PREDICTION_LOG= disables it
+prediction_log = None
+if os.environ.get("PREDICTION_LOG", "logs/requests.jsonl"):
+    from prediction_log import PredictionLogger
+    prediction_log = PredictionLogger(os.environ.get("PREDICTION_LOG", "logs/requests.jsonl"),
+                                      max_queue=int(os.environ.get("PREDICTION_LOG_QUEUE", 10000)),
+                                      batch_records=int(os.environ.get("PREDICTION_LOG_BATCH", 500)),
+                                      flush_seconds=float(os.environ.get("PREDICTION_LOG_FLUSH_S", 2.0)))
+    print(f"Logging predictions to {prediction_log.path}")
+
+# Optional drift monitoring against the train split (drift_monitor.py)
+drift = None
+if os.environ.get("DRIFT_BASELINE"):
+    import json
+    from drift_monitor import DriftMonitor, build_baseline
+    if os.path.exists(os.environ["DRIFT_BASELINE"]):
+        with open(os.environ["DRIFT_BASELINE"]) as f:
+            baseline = json.load(f)
+    else:
+        from shard_dataset import collect_split_files
+        print(f"Building drift baseline {os.environ['DRIFT_BASELINE']} from the train split...")
+        baseline = build_baseline(reloader.current, collect_split_files(
+            "train", os.environ.get("DRIFT_DATA_DIR", "data/water images")))
+        with open(os.environ["DRIFT_BASELINE"], "w") as f:
+            json.dump(baseline, f)
+    drift = DriftMonitor(baseline, window_seconds=float(os.environ.get("DRIFT_WINDOW_S", 3600)),
+                         windows=int(os.environ.get("DRIFT_WINDOWS", 24)),
+                         min_samples=int(os.environ.get("DRIFT_MIN_SAMPLES", 100)))
+    print(f"Drift monitoring enabled ({len(drift.features)} features, baseline of {baseline['images']} images)")
+
+# Optional asynchronous batch jobs (batch_jobs.py), persisted in SQLite under JOB_DIR
+job_store = job_runner = None
+JOB_DIR = os.environ.get("JOB_DIR")
+JOB_ROOT = os.path.realpath(os.environ.get("JOB_ROOT", "."))
+if JOB_DIR:
+    from batch_jobs import JobRunner, JobStore, job_events, zip_image_members
+    os.makedirs(JOB_DIR, exist_ok=True)
+    job_store = JobStore(os.path.join(JOB_DIR, "jobs.sqlite"))
+    job_runner = JobRunner(job_store, lambda: reloader.current,
+                           workers=int(os.environ.get("JOB_WORKERS", 1)),
+                           batch_size=int(os.environ.get("JOB_BATCH_SIZE", 32)),
+                           lease=float(os.environ.get("JOB_LEASE_S", 300)))
+    print(f"Batch jobs enabled ({job_store.db_path}, {len(job_runner.threads)} workers)")
+
+# Started last: a swap calls on_model_swap, which needs every global above
+if os.environ.get("MODEL_WATCH_INTERVAL"):
+    reloader.start_watching(float(os.environ["MODEL_WATCH_INTERVAL"]))
 
 @app.route('/')
 def home():
@@ -45,13 +221,34 @@ def home():
         'endpoints': {
             '/': 'API info',
             '/health': 'Health check',
-            '/predict': 'POST - Predict water quality from image'
+            '/predict': 'POST - Predict water quality from image (?neighbors=k for similar labeled images, '
+                        '?tiled=1 for overlapping high-resolution tiles)',
+            '/compare': 'POST - Predictions of every model in COMPARE_MODELS',
+            '/explain': 'POST - Grad-CAM heatmap overlays for one or more images (?format=png for one)',
+            '/feedback': 'POST - Correct label for an image (FEEDBACK_DIR)',
+            '/admin/reload': 'POST - Load, validate and swap in a new model (ADMIN_TOKEN)',
+            '/admin/model': 'Served model and last reload result',
+            '/shadow': 'Shadow model agreement, deltas and latency (SHADOW_MODEL)',
+            '/jobs': 'POST - Batch job from a zip (archive) or server paths; GET - recent jobs (JOB_DIR)',
+            '/jobs/<id>': 'Job progress and throughput (/results, /events for SSE)',
+            '/drift': 'Drift scores of recent traffic against the train split (DRIFT_BASELINE)'
         }
     })
 
 @app.route('/health')
 def health():
-    return jsonify({'status': 'healthy', 'model_loaded': model is not None})
+    status = {'status': 'healthy', 'model_loaded': reloader.current is not None, 'model_version': reloader.version}
+    if cascade is not None:
+        status['cascade'] = cascade.stats()
+    if updater is not None:
+        status['feedback'] = updater.status()
+    if shadow is not None:
+        status['shadow'] = shadow.stats()
+    if prediction_log is not None:
+        status['prediction_log'] = prediction_log.stats()
+    if drift is not None:
+        status['drift'] = drift.report()['status']
+    return jsonify(status)
 
 @app.route('/predict', methods=['POST'])
 def predict():
@@ -66,17 +263,48 @@ def predict():
             return jsonify({'error': 'No image selected'}), 400
         
         # Read and process image
+        received = time.perf_counter()
         image_bytes = file.read()
-        img = Image.open(io.BytesIO(image_bytes))
-        img = img.convert('RGB').resize((224, 224))
-        
-        # Convert to array and normalize
-        img_array = img_to_array(img) / 255.0
-        img_array = np.expand_dims(img_array, axis=0)
+        img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
         
         # Make prediction
-        prediction = model.predict(img_array, verbose=0)
-        probability = float(prediction[0][0])
+        k = request.args.get('neighbors', 0, type=int)
+        if k and neighbor_index is None:
+            return jsonify({'error': 'Set NEIGHBOR_INDEX to enable neighbor lookups', 'success': False}), 404
+        tiled = request.args.get('tiled', 0, type=int)
+        if tiled and k:
+            return jsonify({'error': 'tiled and neighbors cannot be combined', 'success': False}), 400
+        stage = 'cnn'
+        neighbors = embedding = tiles = None
+        served, head = reloader.current, updater
+        start = time.perf_counter()
+        if k:
+            embedding, probability = cnn_embedding_and_probability(img, served)
+            neighbors = neighbor_index.neighbors(embedding, k=min(k, 50))
+        elif tiled:
+            from tiled_inference import AGGREGATES, tiled_predict
+            overlap = request.args.get('overlap', TILE_OVERLAP, type=float)
+            aggregate = request.args.get('aggregate', TILE_AGGREGATE)
+            if aggregate not in AGGREGATES or not 0.0 <= overlap < 1.0:
+                return jsonify({'error': f'aggregate must be one of {AGGREGATES}, overlap in [0, 1)',
+                                'success': False}), 400
+            tiles = tiled_predict(lambda batch: cnn_batch_probabilities(batch, served), img,
+                                  tile=served.img_size[1],
+                                  tiles=min(request.args.get('tiles', TILE_COUNT, type=int), TILE_MAX_COUNT),
+                                  overlap=overlap, aggregate=aggregate)
+            probability, stage = tiles.pop('probability'), 'tiled'
+        elif cascade is not None:
+            probability, stage = cascade.predict(img)
+        else:
+            probability = cnn_probability(img, served)
+        model_ms = (time.perf_counter() - start) * 1000
+        if drift is not None:
+            # The baseline's probability histogram is the plain CNN's; cascade and
+            # tiled probabilities would show up as drift that is not there
+            drift.update(img, probability if stage == 'cnn' else None, embedding)
+        if shadow is not None and stage == 'cnn':
+            # Only plain CNN answers are comparable with the candidate's single pass
+            shadow.submit(img, probability, model_ms, stage)
         
         # Determine label and confidence
         if probability >= 0.5:
@@ -88,13 +316,29 @@ def predict():
             confidence = (1 - probability) * 100
             message = "✓ Safe to drink"
         
-        return jsonify({
+        response = {
             'label': label,
             'confidence': confidence,
             'probability': probability,
             'message': message,
+            'stage': stage,
             'success': True
-        })
+        }
+        if neighbors is not None:
+            response['neighbors'] = neighbors
+        if tiles is not None:
+            response['tiles'] = tiles
+        if prediction_log is not None:
+            prediction_log.log({
+                'ts': time.time(), 'sha1': hashlib.sha1(image_bytes).hexdigest(),
+                'probability': probability, 'label': label, 'stage': stage,
+                'model': served.path, 'model_id': served.model_id,
+                # Online feedback head that produced the probability (0: the model's own head)
+                'head_version': head.version if head is not None and stage != 'color' else 0,
+                'timings_ms': {'decode': (start - received) * 1000, 'model': model_ms,
+                               'total': (time.perf_counter() - received) * 1000}
+            })
+        return jsonify(response)
     
     except Exception as e:
         print(f"Error during prediction: {str(e)}")
@@ -103,6 +347,197 @@ def predict():
             'success': False
         }), 500
 
+@app.route('/compare', methods=['POST'])
+def compare_models():
+    served = reloader.current
+    compare = served.extras.get('compare')
+    if compare is None:
+        return jsonify({'error': 'Set COMPARE_MODELS to enable comparisons', 'success': False}), 404
+    if 'image' not in request.files or request.files['image'].filename == '':
+        return jsonify({'error': 'No image provided'}), 400
+    try:
+        img = Image.open(io.BytesIO(request.files['image'].read())).convert('RGB')
+        predictions = {}
+        for name, prob in compare.predict(served.to_array([img])).items():
+            probability = float(prob[0])
+            predictions[name] = {'label': 'Dirty' if probability >= 0.5 else 'Clean', 'probability': probability}
+        return jsonify({
+            'predictions': predictions,
+            'agree': len({p['label'] for p in predictions.values()}) == 1,
+            'backbone_passes': len(compare.groups),
+            'success': True
+        })
+    except Exception as e:
+        print(f"Error during comparison: {str(e)}")
+        return jsonify({'error': str(e), 'success': False}), 500
+
+@app.route('/explain', methods=['POST'])
+def explain():
+    files = [f for f in request.files.getlist('image') if f.filename != '']
+    if not files:
+        return jsonify({'error': 'No image provided'}), 400
+    try:
+        from grad_cam import GradCAM, overlay, to_png
+        served = reloader.current
+        # Built once per served model; a reload gets a fresh one
+        explainer = served.extras.get('gradcam')
+        if explainer is None:
+            explainer = served.extras['gradcam'] = GradCAM(served.model)
+        images = [Image.open(io.BytesIO(f.read())).convert('RGB') for f in files]
+        batch = explainer.to_array(images)
+        heatmaps, probs = explainer.explain(batch)
+        if updater is not None:
+            # The heatmap comes from the model's own head; the verdict must match /predict
+            probs = cnn_batch_probabilities(batch, served)
+        if request.args.get('format') == 'png':
+            if len(images) != 1:
+                return jsonify({'error': 'format=png takes exactly one image', 'success': False}), 400
+            return Response(to_png(overlay(images[0], heatmaps[0])), mimetype='image/png')
+        results = []
+        for img, heatmap, prob in zip(images, heatmaps, probs):
+            probability = float(prob)
+            results.append({
+                'label': 'Dirty' if probability >= 0.5 else 'Clean',
+                'probability': probability,
+                'heatmap': 'data:image/png;base64,' + base64.b64encode(to_png(overlay(img, heatmap))).decode('ascii')
+            })
+        return jsonify({'results': results, 'success': True})
+    except Exception as e:
+        print(f"Error during explanation: {str(e)}")
+        return jsonify({'error': str(e), 'success': False}), 500
+
+@app.route('/feedback', methods=['POST'])
+def feedback():
+    if updater is None:
+        return jsonify({'error': 'Set FEEDBACK_DIR to enable feedback', 'success': False}), 404
+    if 'image' not in request.files or request.files['image'].filename == '':
+        return jsonify({'error': 'No image provided'}), 400
+    label = request.form.get('label', '').strip().capitalize()
+    if label not in CLASS_NAMES:
+        return jsonify({'error': f'label must be one of {CLASS_NAMES}'}), 400
+    try:
+        img = Image.open(io.BytesIO(request.files['image'].read())).convert('RGB')
+        embedding, probability = cnn_embedding_and_probability(img)
+        store.add(embedding, CLASS_NAMES.index(label), predicted=probability)
+        return jsonify({
+            'stored': True,
+            'label': label,
+            'probability': probability,
+            'pending': len(store) - updater.trained_on,
+            'head_version': updater.version,
+            'success': True
+        })
+    except Exception as e:
+        print(f"Error storing feedback: {str(e)}")
+        return jsonify({'error': str(e), 'success': False}), 500
+
+@app.route('/feedback/status')
+def feedback_status():
+    if updater is None:
+        return jsonify({'error': 'Set FEEDBACK_DIR to enable feedback', 'success': False}), 404
+    return jsonify(updater.status())
+
+def _is_admin():
+    import hmac
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN)
+
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    if not _is_admin():
+        return jsonify({'error': 'Set ADMIN_TOKEN and send it as X-Admin-Token', 'success': False}), 403
+    body = request.get_json(silent=True) or {}
+    path = request.values.get('path') or body.get('path')
+    # Keep watching MODEL_PATH unless asked to follow the new file
+    watch = str(request.values.get('watch') or body.get('watch') or '').lower() in ('1', 'true', 'yes')
+    if path and not os.path.isfile(path):
+        return jsonify({'error': f'{path} not found', 'success': False}), 400
+    if not reloader.reload(path, watch=watch):
+        return jsonify({'error': 'A reload is already in progress', 'success': False}), 409
+    return jsonify({'started': True, 'path': path or reloader.path, 'watch': watch, 'success': True}), 202
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    if job_store is None:
+        return jsonify({'error': 'Set JOB_DIR to enable batch jobs', 'success': False}), 404
+    try:
+        if 'archive' in request.files:
+            upload = request.files['archive']
+            archive = os.path.join(JOB_DIR, f"upload-{time.time_ns()}.zip")
+            upload.save(archive)
+            try:
+                names = zip_image_members(archive)
+            except Exception:
+                os.remove(archive)
+                return jsonify({'error': 'archive is not a readable zip', 'success': False}), 400
+            kind = 'zip'
+        else:
+            paths = (request.get_json(silent=True) or {}).get('paths') or request.form.getlist('paths')
+            if not paths:
+                return jsonify({'error': 'Send a zip as "archive" or a JSON list of "paths"', 'success': False}), 400
+            names = [os.path.realpath(p) for p in paths]
+            outside = [p for p, n in zip(paths, names) if os.path.commonpath([JOB_ROOT, n]) != JOB_ROOT]
+            if outside:
+                return jsonify({'error': f'paths must be under JOB_ROOT: {outside[:3]}', 'success': False}), 400
+            archive, kind = None, 'paths'
+        if not names:
+            return jsonify({'error': 'No images found', 'success': False}), 400
+        job_id = job_store.create(kind, names, archive)
+        job_runner.submit(job_id)
+        return jsonify({'job_id': job_id, 'total': len(names), 'status': 'queued', 'success': True}), 202
+    except Exception as e:
+        print(f"Error creating job: {str(e)}")
+        return jsonify({'error': str(e), 'success': False}), 500
+
+@app.route('/jobs')
+def list_jobs():
+    if job_store is None:
+        return jsonify({'error': 'Set JOB_DIR to enable batch jobs', 'success': False}), 404
+    return jsonify({'jobs': job_store.list(request.args.get('limit', 50, type=int))})
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    if job_store is None:
+        return jsonify({'error': 'Set JOB_DIR to enable batch jobs', 'success': False}), 404
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job', 'success': False}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/results')
+def job_results(job_id):
+    if job_store is None:
+        return jsonify({'error': 'Set JOB_DIR to enable batch jobs', 'success': False}), 404
+    if job_store.get(job_id) is None:
+        return jsonify({'error': 'Unknown job', 'success': False}), 404
+    offset = request.args.get('offset', 0, type=int)
+    limit = min(request.args.get('limit', 1000, type=int), 10000)
+    return jsonify({'results': job_store.results(job_id, after=offset - 1, limit=limit)})
+
+@app.route('/jobs/<job_id>/events')
+def job_stream(job_id):
+    if job_store is None:
+        return jsonify({'error': 'Set JOB_DIR to enable batch jobs', 'success': False}), 404
+    if job_store.get(job_id) is None:
+        return jsonify({'error': 'Unknown job', 'success': False}), 404
+    return Response(stream_with_context(job_events(job_store, job_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/drift')
+def drift_report():
+    if drift is None:
+        return jsonify({'error': 'Set DRIFT_BASELINE to enable drift monitoring', 'success': False}), 404
+    return jsonify(drift.report())
+
+@app.route('/shadow')
+def shadow_stats():
+    if shadow is None:
+        return jsonify({'error': 'Set SHADOW_MODEL to enable shadow evaluation', 'success': False}), 404
+    return jsonify(shadow.stats())
+
+@app.route('/admin/model')
+def admin_model():
+    return jsonify(reloader.status())
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5555))
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,241 @@
+"""
+batch_jobs.py
+-------------
+Asynchronous batch-inference jobs for api_server.py, persisted in SQLite.
+
+Usage:
+    JOB_DIR=jobs JOB_WORKERS=2 JOB_BATCH_SIZE=32 python api_server.py   # jobs are off without JOB_DIR
+    curl -F archive=@survey.zip localhost:5555/jobs                      # -> {"job_id": ...}
+    curl -H "Content-Type: application/json" -d '{"paths": ["data/site7/a.jpg", ...]}' localhost:5555/jobs
+    curl localhost:5555/jobs/<id>                                        # progress + throughput
+    curl localhost:5555/jobs/<id>/results?offset=0&limit=500
+    curl -N localhost:5555/jobs/<id>/events                              # Server-Sent Events
+
+How it works:
+ - A job is a list of items: members of an uploaded zip (saved as
+   <JOB_DIR>/upload-*.zip and read member by member, never extracted) or image
+   paths under JOB_ROOT. Jobs and one row per item live in <JOB_DIR>/jobs.sqlite
+   (WAL mode)
+ - JOB_WORKERS threads take queued jobs. A worker first claims the job with
+   one conditional UPDATE (queued -> running), so when several server
+   processes share JOB_DIR (gunicorn -w N) each job still runs exactly once.
+   It then decodes JOB_BATCH_SIZE images, runs one batched predict on the
+   model that was current when the job started, and writes the batch's
+   results, the job's progress and a heartbeat in a single transaction
+ - A running job whose heartbeat is older than JOB_LEASE_S seconds (its
+   process died) is put back to queued, at startup and whenever a worker is
+   idle, and continues from its first unprocessed item, so a crash loses at
+   most one batch of work
+ - Per job: elapsed time, images/s and the split between decoding and
+   inference time
+"""
+import json
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+from pathlib import Path
+from PIL import Image
+from dataset_manifest import IMAGE_EXTENSIONS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY, status TEXT NOT NULL, kind TEXT NOT NULL, archive TEXT, model TEXT,
+    total INTEGER NOT NULL, done INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL, started REAL, finished REAL,
+    decode_seconds REAL NOT NULL DEFAULT 0, infer_seconds REAL NOT NULL DEFAULT 0, error TEXT, heartbeat REAL
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL, idx INTEGER NOT NULL, name TEXT NOT NULL,
+    processed INTEGER NOT NULL DEFAULT 0, probability REAL, label TEXT, error TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+"""
+
+def zip_image_members(path):
+    with zipfile.ZipFile(path) as zf:
+        return sorted(i.filename for i in zf.infolist() if not i.is_dir()
+                      and Path(i.filename).suffix.lower() in IMAGE_EXTENSIONS
+                      and not Path(i.filename).name.startswith("._") and not i.filename.startswith("__MACOSX/"))
+
+class JobStore:
+    """SQLite job/result store; one connection per thread."""
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+            if "heartbeat" not in {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}:
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")  # stores from before leases
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def create(self, kind, names, archive=None):
+        job_id = uuid.uuid4().hex[:12]
+        with self._conn() as conn:
+            conn.execute("INSERT INTO jobs (id, status, kind, archive, total, created) VALUES (?, 'queued', ?, ?, ?, ?)",
+                         (job_id, kind, archive, len(names), time.time()))
+            conn.executemany("INSERT INTO items (job_id, idx, name) VALUES (?, ?, ?)",
+                             [(job_id, i, n) for i, n in enumerate(names)])
+        return job_id
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if row is None else _job_dict(row)
+
+    def list(self, limit=50):
+        rows = self._conn().execute("SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+        return [_job_dict(r) for r in rows]
+
+    def pending_items(self, job_id):
+        return self._conn().execute("SELECT idx, name FROM items WHERE job_id = ? AND processed = 0 ORDER BY idx",
+                                    (job_id,)).fetchall()
+
+    def results(self, job_id, after=-1, limit=1000):
+        rows = self._conn().execute(
+            "SELECT idx, name, probability, label, error FROM items WHERE job_id = ? AND processed = 1 AND idx > ? "
+            "ORDER BY idx LIMIT ?", (job_id, after, limit)).fetchall()
+        return [dict(r) for r in rows]
+
+    def queued(self):
+        return [r["id"] for r in self._conn().execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created")]
+
+    def requeue_stale(self, lease):
+        """Put running jobs with no heartbeat for `lease` seconds back to queued."""
+        with self._conn() as conn:
+            conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running' "
+                         "AND COALESCE(heartbeat, started, created) < ?", (time.time() - lease,))
+
+    def claim(self, job_id, model):
+        """queued -> running for exactly one caller across threads and processes."""
+        now = time.time()
+        with self._conn() as conn:
+            cursor = conn.execute("UPDATE jobs SET status = 'running', model = ?, started = COALESCE(started, ?), "
+                                  "heartbeat = ? WHERE id = ? AND status = 'queued'", (model, now, now, job_id))
+        return cursor.rowcount == 1
+
+    def set_status(self, job_id, status, **fields):
+        fields["status"] = status
+        with self._conn() as conn:
+            conn.execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                         (*fields.values(), job_id))
+
+    def record_batch(self, job_id, results, decode_seconds, infer_seconds):
+        """results: [(idx, probability, label, error)] -> items + job counters in one transaction."""
+        failed = sum(r[3] is not None for r in results)
+        with self._conn() as conn:
+            conn.executemany("UPDATE items SET processed = 1, probability = ?, label = ?, error = ? "
+                             "WHERE job_id = ? AND idx = ?", [(p, l, e, job_id, i) for i, p, l, e in results])
+            conn.execute("UPDATE jobs SET done = done + ?, failed = failed + ?, decode_seconds = decode_seconds + ?, "
+                         "infer_seconds = infer_seconds + ?, heartbeat = ? WHERE id = ?",
+                         (len(results), failed, decode_seconds, infer_seconds, time.time(), job_id))
+
+def _job_dict(row):
+    job = dict(row)
+    end = job["finished"] or time.time()
+    job["elapsed_seconds"] = end - job["started"] if job["started"] else 0.0
+    job["images_per_s"] = job["done"] / job["elapsed_seconds"] if job["elapsed_seconds"] else None
+    job["progress"] = job["done"] / job["total"] if job["total"] else 1.0
+    return job
+
+class JobRunner:
+    """Worker threads that run queued jobs with get_served() -> model_reload.ServedModel."""
+
+    def __init__(self, store, get_served, workers=1, batch_size=32, lease=300.0):
+        self.store = store
+        self.get_served = get_served
+        self.batch_size = batch_size
+        self.lease = lease
+        self._queue = queue.Queue()
+        self._requeue()
+        self.threads = [threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True) for i in range(workers)]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, job_id):
+        self._queue.put(job_id)
+
+    def _requeue(self):
+        # Every process may enqueue the same ids; claim() lets only one run each
+        self.store.requeue_stale(self.lease)
+        for job_id in self.store.queued():
+            self._queue.put(job_id)
+
+    def _run(self):
+        while True:
+            try:
+                job_id = self._queue.get(timeout=self.lease)
+            except queue.Empty:
+                self._requeue()
+                continue
+            try:
+                self.run_job(job_id)
+            except Exception as e:
+                print(f"[WARN] Job {job_id} failed: {e}")
+                self.store.set_status(job_id, "failed", error=str(e), finished=time.time())
+
+    def run_job(self, job_id):
+        served = self.get_served()
+        if not self.store.claim(job_id, served.path):
+            return  # finished, or claimed by another worker or process
+        job = self.store.get(job_id)
+        items = self.store.pending_items(job_id)
+        archive = zipfile.ZipFile(job["archive"]) if job["kind"] == "zip" else None
+        try:
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start:start + self.batch_size]
+                t0 = time.perf_counter()
+                images, results = [], {}
+                for item in batch:
+                    try:
+                        source = archive.open(item["name"]) if archive else open(item["name"], "rb")
+                        with source, Image.open(source) as im:
+                            images.append((item["idx"], im.convert("RGB")))
+                    except Exception as e:
+                        results[item["idx"]] = (item["idx"], None, None, f"unreadable image: {e}")
+                t1 = time.perf_counter()
+                if images:
+                    probs = served.probabilities([im for _, im in images])
+                    for (idx, _), p in zip(images, probs):
+                        results[idx] = (idx, float(p), "Dirty" if p >= 0.5 else "Clean", None)
+                t2 = time.perf_counter()
+                self.store.record_batch(job_id, [results[item["idx"]] for item in batch], t1 - t0, t2 - t1)
+        finally:
+            if archive is not None:
+                archive.close()
+        self.store.set_status(job_id, "done", finished=time.time())
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def job_events(store, job_id, poll=0.5):
+    """Server-Sent Events stream: "result" per finished item, "progress" on change, then "done"."""
+    last_idx, last_done = -1, None
+    while True:
+        job = store.get(job_id)
+        # Page through everything processed so far before looking at the status,
+        # so "done" never comes ahead of results
+        while True:
+            rows = store.results(job_id, after=last_idx)
+            for row in rows:
+                last_idx = row["idx"]
+                yield sse("result", row)
+            if not rows:
+                break
+        if job["done"] != last_done:
+            last_done = job["done"]
+            yield sse("progress", {k: job[k] for k in ("status", "done", "failed", "total", "progress", "images_per_s")})
+        if job["status"] in ("done", "failed"):
+            yield sse("done", job)
+            return
+        time.sleep(poll)
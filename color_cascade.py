@@ -0,0 +1,222 @@
+"""
+color_cascade.py
+----------------
+Two-stage cascade: a color-statistics linear model answers the obvious images,
+and only low-confidence ones go on to the CNN.
+
+Usage:
+    python color_cascade.py --data_dir "data/water images" --model best_model.h5
+    python color_cascade.py --threshold 0.95 --out color_model.json
+
+    CASCADE_MODEL=color_model.json CASCADE_THRESHOLD=0.9 python api_server.py
+
+This script:
+ - Extracts per-image features from a 64x64 thumbnail with vectorized NumPy:
+   8-bin RGB histograms, HSV mean/std, saturation-weighted hue, the fractions
+   of brown/green/blue, washed-out and dark pixels (turbidity cues),
+   colorfulness and contrast
+ - Fits an L2-regularised logistic regression (Newton's method, NumPy only,
+   so serving needs nothing beyond numpy and Pillow) on the train split and
+   saves it as JSON
+ - On the test split, reports color-only, CNN-only and cascade accuracy, the
+   fraction of images short-circuited and the estimated CPU time per image,
+   for --threshold and a sweep of thresholds -> cascade_report.json
+
+An image is short-circuited when the color model's confidence
+max(p, 1 - p) is at least the threshold; otherwise the CNN decides.
+"""
+import argparse
+import json
+import threading
+import time
+import numpy as np
+from PIL import Image
+
+THUMB = (64, 64)
+HIST_BINS = 8
+THRESHOLDS = (0.6, 0.7, 0.8, 0.9, 0.95, 0.99)
+# Hue ranges on PIL's 0-255 HSV scale
+BROWN_HUE = (10, 36)    # ~15-50 degrees
+GREEN_HUE = (50, 120)   # ~70-170 degrees
+BLUE_HUE = (128, 180)   # ~180-255 degrees
+FEATURE_NAMES = (
+    [f"hist_{c}{b}" for c in "rgb" for b in range(HIST_BINS)]
+    + ["h_cos", "h_sin", "s_mean", "s_std", "v_mean", "v_std",
+       "brown_frac", "green_frac", "blue_frac", "washed_frac", "dark_frac", "colorfulness", "contrast"]
+)
+
+def color_features(images):
+    """[N, F] float32 features for a PIL image or a list of them."""
+    if isinstance(images, Image.Image):
+        images = [images]
+    thumbs = [im.convert("RGB").resize(THUMB, Image.BILINEAR) for im in images]
+    rgb8 = np.stack([np.asarray(t) for t in thumbs]).reshape(len(thumbs), -1, 3)
+    hsv = np.stack([np.asarray(t.convert("HSV")) for t in thumbs]).reshape(len(thumbs), -1, 3).astype(np.float32)
+    n, pixels = rgb8.shape[:2]
+
+    # One bincount for every (image, channel, bin)
+    bins = (rgb8 >> (8 - int(np.log2(HIST_BINS)))).astype(np.int64)
+    flat = bins + HIST_BINS * np.arange(3) + 3 * HIST_BINS * np.arange(n)[:, None, None]
+    hist = np.bincount(flat.ravel(), minlength=n * 3 * HIST_BINS).reshape(n, -1) / pixels
+
+    h, s, v = hsv[..., 0], hsv[..., 1] / 255.0, hsv[..., 2] / 255.0
+    angle = h / 255.0 * 2 * np.pi
+    weight = s / (s.sum(axis=1, keepdims=True) + 1e-6)
+    colored = (s > 0.25) & (v > 0.15)
+
+    def frac(lo, hi):
+        return ((h >= lo) & (h < hi) & colored).mean(axis=1)
+
+    rgb = rgb8.astype(np.float32) / 255.0
+    rg = rgb[..., 0] - rgb[..., 1]
+    yb = 0.5 * (rgb[..., 0] + rgb[..., 1]) - rgb[..., 2]
+    colorfulness = np.sqrt(rg.std(axis=1) ** 2 + yb.std(axis=1) ** 2) + \
+        0.3 * np.sqrt(rg.mean(axis=1) ** 2 + yb.mean(axis=1) ** 2)
+    gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    stats = np.stack([
+        (weight * np.cos(angle)).sum(axis=1), (weight * np.sin(angle)).sum(axis=1),
+        s.mean(axis=1), s.std(axis=1), v.mean(axis=1), v.std(axis=1),
+        frac(*BROWN_HUE), frac(*GREEN_HUE), frac(*BLUE_HUE),
+        ((s < 0.15) & (v > 0.5)).mean(axis=1), (v < 0.2).mean(axis=1),
+        colorfulness, gray.std(axis=1),
+    ], axis=1)
+    return np.hstack([hist, stats]).astype(np.float32)
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -40, 40)))
+
+def fit_linear(X, y, l2=1.0, iters=25):
+    """L2-regularised logistic regression on standardised features (Newton's method)."""
+    mean, scale = X.mean(axis=0), X.std(axis=0) + 1e-6
+    Z = np.hstack([(X - mean) / scale, np.ones((len(X), 1))])
+    reg = np.full(Z.shape[1], l2)
+    reg[-1] = 0.0  # no penalty on the intercept
+    w = np.zeros(Z.shape[1])
+    for _ in range(iters):
+        p = _sigmoid(Z @ w)
+        grad = Z.T @ (p - y) + reg * w
+        hess = (Z * (p * (1 - p))[:, None]).T @ Z + np.diag(reg)
+        step = np.linalg.solve(hess, grad)
+        w -= step
+        if np.abs(step).max() < 1e-8:
+            break
+    return {"features": FEATURE_NAMES, "mean": mean.tolist(), "scale": scale.tolist(),
+            "coef": w[:-1].tolist(), "intercept": float(w[-1])}
+
+def predict_linear(model, X):
+    """P(Dirty) for feature rows X."""
+    z = ((X - np.asarray(model["mean"])) / np.asarray(model["scale"])) @ np.asarray(model["coef"]) + model["intercept"]
+    return _sigmoid(z)
+
+def save_linear(model, path):
+    with open(path, "w") as f:
+        json.dump(model, f, indent=2)
+
+def load_linear(path):
+    with open(path) as f:
+        model = json.load(f)
+    if model["features"] != FEATURE_NAMES:
+        raise ValueError(f"{path} was trained on a different feature set; re-run color_cascade.py")
+    return model
+
+class Cascade:
+    """Color model first; cnn_predict(pil_image) -> P(Dirty) only when it is unsure.
+    Counts how many requests each stage answered (thread-safe, for the Flask server)."""
+
+    def __init__(self, color_model, cnn_predict, threshold=0.9):
+        self.color_model = color_model
+        self.cnn_predict = cnn_predict
+        self.threshold = threshold
+        self.counts = {"color": 0, "cnn": 0}
+        self._lock = threading.Lock()
+
+    def predict(self, image):
+        """(P(Dirty), stage) for one PIL image; stage is "color" or "cnn"."""
+        p = float(predict_linear(self.color_model, color_features(image))[0])
+        stage = "color" if max(p, 1 - p) >= self.threshold else "cnn"
+        if stage == "cnn":
+            p = float(self.cnn_predict(image))
+        with self._lock:
+            self.counts[stage] += 1
+        return p, stage
+
+    def stats(self):
+        with self._lock:
+            total = sum(self.counts.values())
+            return {"threshold": self.threshold, "requests": total, "short_circuited": self.counts["color"],
+                    "short_circuit_fraction": self.counts["color"] / total if total else 0.0}
+
+def load_files(files):
+    images = []
+    for path, _ in files:
+        with Image.open(path) as im:
+            images.append(im.convert("RGB"))
+    return images
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", default="data/water images")
+    parser.add_argument("--manifest", default=None, help="dataset_manifest.py output to read the file lists from")
+    parser.add_argument("--model", default="best_model.h5", help="CNN the cascade falls through to")
+    parser.add_argument("--out", default="color_model.json")
+    parser.add_argument("--threshold", type=float, default=0.9, help="Color-model confidence needed to skip the CNN")
+    parser.add_argument("--l2", type=float, default=1.0)
+    args = parser.parse_args()
+
+    from shard_dataset import collect_split_files
+    train_files = collect_split_files("train", args.data_dir, args.manifest)
+    test_files = collect_split_files("test", args.data_dir, args.manifest)
+    class_names = sorted({c for _, c in train_files})
+    y_train = np.array([class_names.index(c) for _, c in train_files])
+    y_test = np.array([class_names.index(c) for _, c in test_files])
+
+    color_model = fit_linear(color_features(load_files(train_files)), y_train, l2=args.l2)
+    save_linear(color_model, args.out)
+    print(f"[INFO] Saved {args.out} ({len(FEATURE_NAMES)} features, trained on {len(train_files)} images)")
+
+    test_images = load_files(test_files)
+    start = time.perf_counter()
+    p_color = predict_linear(color_model, color_features(test_images))
+    color_ms = (time.perf_counter() - start) * 1000 / len(test_images)
+
+    from tensorflow.keras.models import load_model
+    cnn = load_model(args.model, compile=False)
+    size = (cnn.input_shape[2], cnn.input_shape[1])
+    # Same preprocessing as api_server.py
+    batch = np.stack([np.asarray(im.resize(size), dtype=np.float32) / 255.0 for im in test_images])
+    cnn.predict_on_batch(batch[:1])
+    start = time.perf_counter()
+    p_cnn = np.array([float(cnn.predict_on_batch(batch[i:i + 1])[0, 0]) for i in range(len(batch))])
+    cnn_ms = (time.perf_counter() - start) * 1000 / len(batch)
+
+    def accuracy(p):
+        return float(((p >= 0.5) == y_test).mean())
+
+    rows = []
+    for t in sorted(set(THRESHOLDS) | {args.threshold}):
+        short = np.maximum(p_color, 1 - p_color) >= t
+        p = np.where(short, p_color, p_cnn)
+        rows.append({"threshold": t, "short_circuit_fraction": float(short.mean()), "accuracy": accuracy(p),
+                     "accuracy_delta": accuracy(p) - accuracy(p_cnn),
+                     "est_ms_per_image": color_ms + (1 - short.mean()) * cnn_ms})
+    report = {"config": vars(args), "test_images": len(test_files), "color_only_accuracy": accuracy(p_color),
+              "cnn_only_accuracy": accuracy(p_cnn), "color_ms_per_image": color_ms, "cnn_ms_per_image": cnn_ms,
+              "thresholds": rows}
+    with open("cascade_report.json", "w") as f:
+        json.dump(report, f, indent=2)
+
+    print("\n" + "=" * 66)
+    print("CASCADE REPORT (test split)")
+    print("=" * 66)
+    print(f"Color-only accuracy: {report['color_only_accuracy']:.3f} ({color_ms:.2f} ms/image)")
+    print(f"CNN-only accuracy:   {report['cnn_only_accuracy']:.3f} ({cnn_ms:.2f} ms/image)")
+    print(f"\n{'threshold':>9} {'short-circuited':>16} {'accuracy':>9} {'vs CNN':>8} {'est ms/img':>11}")
+    for r in rows:
+        mark = "  <-" if r["threshold"] == args.threshold else ""
+        print(f"{r['threshold']:>9.2f} {r['short_circuit_fraction'] * 100:>15.1f}% {r['accuracy']:>9.3f} "
+              f"{r['accuracy_delta']:>+8.3f} {r['est_ms_per_image']:>11.2f}{mark}")
+    print("=" * 66)
+    print("Saved cascade_report.json")
+
+if __name__ == "__main__":
+    main()
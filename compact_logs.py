@@ -0,0 +1,357 @@
+"""
+compact_logs.py
+---------------
+Compacts rotated prediction logs (prediction_log.py) into a date-partitioned
+columnar store with hourly rollups, and answers aggregate queries from it.
+
+Usage:
+    python compact_logs.py compact --logs logs/requests.jsonl --store log_store
+    python compact_logs.py query --store log_store --group day,model_id --metrics count,dirty_rate
+    python compact_logs.py query --store log_store --group hour --metrics total_ms_p95 --since 2026-10-01 --model best_model.h5
+    python compact_logs.py hourly --store log_store --date 2026-10-19
+
+Layout (same idea as shard_dataset.py: one .npy per column, opened with mmap_mode="r"):
+    log_store/compacted.json                        rotated files already compacted
+    log_store/date=YYYY-MM-DD/part-<source>/        one part per (rotated file, UTC day)
+        ts.npy float64, probability.npy float32, dirty.npy uint8, head_version.npy int32,
+        decode_ms.npy / model_ms.npy / total_ms.npy float32, sha1.npy S40,
+        stage.npy / model.npy / model_id.npy uint16 codes into meta.json "dictionaries"
+        meta.json                                   rows, ts range, dictionaries
+    log_store/rollups/hourly-YYYY-MM-DD.json        per (hour, model, model_id, head_version, stage):
+                                                    count, dirty, probability sum, latency percentiles
+
+Queries read only the partitions in --since/--until, skip parts whose
+dictionary does not contain --model, and load only the columns they need.
+count / dirty_rate / mean_probability grouped by day, hour, model, model_id,
+head_version or stage are summed from the hourly rollups without opening any
+part. Latency percentiles need the raw column and always scan it.
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+from prediction_log import rotated_files
+
+NUMERIC = {"ts": np.float64, "probability": np.float32, "dirty": np.uint8, "head_version": np.int32,
+           "decode_ms": np.float32, "model_ms": np.float32, "total_ms": np.float32}
+DICTIONARY = ("stage", "model", "model_id")
+GROUPS = ("day", "hour", "model", "model_id", "head_version", "stage")
+ADDITIVE = ("count", "dirty_rate", "mean_probability")
+PERCENTILES = {"p50": 50, "p95": 95, "p99": 99}
+LATENCIES = ("decode_ms", "model_ms", "total_ms")
+
+def _day(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+
+def read_records(path):
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line of a crashed writer
+
+def to_columns(records):
+    """Records -> ({column: array}, {dictionary column: [values]})."""
+    n = len(records)
+    cols = {name: np.empty(n, dtype) for name, dtype in NUMERIC.items()}
+    cols["sha1"] = np.empty(n, "S40")
+    dictionaries = {name: [] for name in DICTIONARY}
+    lookup = {name: {} for name in DICTIONARY}
+    for name in DICTIONARY:
+        cols[name] = np.empty(n, np.uint16)
+    for i, r in enumerate(records):
+        timings = r.get("timings_ms") or {}
+        cols["ts"][i] = r.get("ts", np.nan)
+        cols["probability"][i] = r.get("probability", np.nan)
+        cols["dirty"][i] = r.get("label") == "Dirty"
+        cols["head_version"][i] = r.get("head_version") or 0
+        for t in LATENCIES:
+            cols[t][i] = timings.get(t.replace("_ms", ""), np.nan)
+        cols["sha1"][i] = (r.get("sha1") or "").encode()
+        for name in DICTIONARY:
+            value = str(r.get(name) or "")
+            code = lookup[name].get(value)
+            if code is None:
+                code = lookup[name][value] = len(dictionaries[name])
+                dictionaries[name].append(value)
+            cols[name][i] = code
+    return cols, dictionaries
+
+def write_part(part_dir, cols, dictionaries):
+    """Write a part atomically (tmp dir + rename), replacing an earlier attempt."""
+    tmp = part_dir.with_name(part_dir.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for name, values in cols.items():
+        np.save(tmp / f"{name}.npy", values)
+    meta = {"rows": int(len(cols["ts"])), "ts_min": float(cols["ts"].min()), "ts_max": float(cols["ts"].max()),
+            "dictionaries": dictionaries}
+    with open(tmp / "meta.json", "w") as f:
+        json.dump(meta, f)
+    shutil.rmtree(part_dir, ignore_errors=True)
+    os.replace(tmp, part_dir)
+
+def compact(log_path, store):
+    """Compact every rotated file of log_path not compacted yet. Returns the touched days."""
+    store = Path(store)
+    store.mkdir(parents=True, exist_ok=True)
+    done_file = store / "compacted.json"
+    done = set(json.loads(done_file.read_text())) if done_file.exists() else set()
+    touched = set()
+    for source in rotated_files(log_path):
+        if source.name in done:
+            continue
+        start = time.perf_counter()
+        by_day = defaultdict(list)
+        for r in read_records(source):
+            if "ts" in r:
+                by_day[_day(r["ts"])].append(r)
+        for day, records in sorted(by_day.items()):
+            records.sort(key=lambda r: r["ts"])
+            cols, dictionaries = to_columns(records)
+            write_part(store / f"date={day}" / f"part-{source.name.split('.jsonl')[0]}", cols, dictionaries)
+        # Rollups before the bookkeeping, so an interrupted run redoes both
+        for day in by_day:
+            build_hourly_rollup(store, day)
+        touched |= set(by_day)
+        done.add(source.name)
+        done_file.write_text(json.dumps(sorted(done)))
+        print(f"[INFO] Compacted {source.name}: {sum(map(len, by_day.values()))} records "
+              f"in {time.perf_counter() - start:.1f}s")
+    return sorted(touched)
+
+def iter_parts(store, since=None, until=None, model=None):
+    """(part_dir, meta) for parts in the date range that may contain `model`."""
+    for day_dir in sorted(Path(store).glob("date=*")):
+        day = day_dir.name[5:]
+        if (since and day < since) or (until and day > until):
+            continue
+        for part in sorted(day_dir.glob("part-*")):
+            if part.name.endswith(".tmp"):
+                continue
+            with open(part / "meta.json") as f:
+                meta = json.load(f)
+            if model and not any(_model_matches(m, model) for m in meta["dictionaries"]["model"]):
+                continue
+            yield part, meta
+
+def _model_matches(value, wanted):
+    return value == wanted or Path(value).name == wanted
+
+def load_columns(store, columns, since=None, until=None, model=None):
+    """Concatenate only `columns` (memmapped) across the selected parts. Dictionary
+    columns come back as codes into the returned merged dictionaries."""
+    needed = set(columns) | ({"model"} if model else set())
+    parts, merged = [], {name: [] for name in DICTIONARY}
+    for part, meta in iter_parts(store, since, until, model):
+        data = {}
+        for name in needed:
+            values = np.load(part / f"{name}.npy", mmap_mode="r")
+            if name in DICTIONARY:
+                remap = np.array([_merge_code(merged[name], v) for v in meta["dictionaries"][name]], np.int64)
+                values = remap[values]
+            data[name] = values
+        parts.append(data)
+    if not parts:
+        return {name: np.zeros(0) for name in needed}, merged, 0
+    cols = {name: np.concatenate([np.asarray(p[name]) for p in parts]) for name in needed}
+    if model:
+        keep = np.isin(cols["model"], [i for i, m in enumerate(merged["model"]) if _model_matches(m, model)])
+        cols = {k: v[keep] for k, v in cols.items()}
+    return cols, merged, len(parts)
+
+def _merge_code(values, value):
+    if value not in values:
+        values.append(value)
+    return values.index(value)
+
+def group_codes(cols, group):
+    """Integer key per row for each group column."""
+    keys = []
+    for g in group:
+        if g == "day":
+            keys.append((cols["ts"] // 86400).astype(np.int64))
+        elif g == "hour":
+            keys.append((cols["ts"] // 3600).astype(np.int64))
+        else:
+            keys.append(np.asarray(cols[g], dtype=np.int64))
+    return keys
+
+def group_percentile(inverse, values, n_groups, q):
+    """Per-group q-th percentile (linear interpolation, NaNs ignored)."""
+    ok = ~np.isnan(values)
+    inverse, values = inverse[ok], values[ok]
+    order = np.lexsort((values, inverse))
+    inverse, values = inverse[order], values[order]
+    counts = np.bincount(inverse, minlength=n_groups)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    out = np.full(n_groups, np.nan)
+    has = counts > 0
+    pos = starts[has] + (counts[has] - 1) * q / 100.0
+    lo, hi = np.floor(pos).astype(np.int64), np.ceil(pos).astype(np.int64)
+    out[has] = values[lo] + (values[hi] - values[lo]) * (pos - lo)
+    return out
+
+def aggregate(cols, dictionaries, group, metrics):
+    """Rows of {group..., metric...} from raw columns."""
+    n = len(cols["ts"]) if "ts" in cols else len(next(iter(cols.values())))
+    if group:
+        keys, inverse = np.unique(np.stack(group_codes(cols, group), axis=1), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+    else:
+        keys, inverse = np.zeros((1, 0), np.int64), np.zeros(n, np.int64)
+    n_groups = len(keys)
+    count = np.bincount(inverse, minlength=n_groups)
+    values = {"count": count}
+    if "dirty_rate" in metrics:
+        values["dirty_rate"] = np.bincount(inverse, cols["dirty"].astype(np.float64), n_groups) / np.maximum(count, 1)
+    if "mean_probability" in metrics:
+        values["mean_probability"] = np.bincount(inverse, cols["probability"].astype(np.float64), n_groups) / np.maximum(count, 1)
+    for m in metrics:
+        if m.rsplit("_", 1)[-1] in PERCENTILES:
+            column, q = m.rsplit("_", 1)
+            values[m] = group_percentile(inverse, cols[column].astype(np.float64), n_groups, PERCENTILES[q])
+    return _rows(keys, group, dictionaries, values, ["count"] + [m for m in metrics if m != "count"])
+
+def _rows(keys, group, dictionaries, values, metrics):
+    rows = []
+    for i, key in enumerate(keys):
+        row = {}
+        for g, k in zip(group, key):
+            if g == "day":
+                row[g] = _day(int(k) * 86400)
+            elif g == "hour":
+                row[g] = datetime.fromtimestamp(int(k) * 3600, timezone.utc).strftime("%Y-%m-%d %H:00")
+            elif g in DICTIONARY:
+                row[g] = dictionaries[g][int(k)]
+            else:
+                row[g] = int(k)
+        for m in metrics:
+            v = values[m][i]
+            row[m] = int(v) if m == "count" else (None if np.isnan(v) else float(v))
+        rows.append(row)
+    return rows
+
+def build_hourly_rollup(store, day):
+    """Per (hour, model, model_id, head_version, stage) counts and latency percentiles for one day."""
+    group = ["hour", "model", "model_id", "head_version", "stage"]
+    metrics = ["count", "dirty_rate", "mean_probability"] + \
+        [f"{t}_{q}" for t in ("model_ms", "total_ms") for q in PERCENTILES]
+    cols, dictionaries, _ = load_columns(store, ["ts", "model", "model_id", "head_version", "stage", "dirty",
+                                                 "probability", "model_ms", "total_ms"], since=day, until=day)
+    rows = aggregate(cols, dictionaries, group, metrics) if len(cols["ts"]) else []
+    for r in rows:
+        # Sums, so rollup rows can be merged into coarser groups exactly
+        r["dirty"] = round(r.pop("dirty_rate") * r["count"])
+        r["probability_sum"] = r.pop("mean_probability") * r["count"]
+    out = Path(store) / "rollups" / f"hourly-{day}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(rows, f, indent=1)
+    return rows
+
+def query_rollups(store, group, metrics, since=None, until=None, model=None):
+    """count / dirty_rate / mean_probability merged from the hourly rollups."""
+    sums = defaultdict(lambda: [0, 0, 0.0])
+    for path in sorted((Path(store) / "rollups").glob("hourly-*.json")):
+        day = path.stem[len("hourly-"):]
+        if (since and day < since) or (until and day > until):
+            continue
+        with open(path) as f:
+            for r in json.load(f):
+                if model and not _model_matches(r["model"], model):
+                    continue
+                r["day"] = r["hour"][:10]
+                s = sums[tuple(r[g] for g in group)]
+                s[0] += r["count"]; s[1] += r["dirty"]; s[2] += r["probability_sum"]
+    rows = []
+    for key, (count, dirty, prob) in sorted(sums.items()):
+        row = dict(zip(group, key), count=count)
+        if "dirty_rate" in metrics:
+            row["dirty_rate"] = dirty / count
+        if "mean_probability" in metrics:
+            row["mean_probability"] = prob / count
+        rows.append(row)
+    return rows
+
+def query(store, group=(), metrics=("count",), since=None, until=None, model=None, use_rollups=True):
+    """(rows, how) where how describes what was read."""
+    group, metrics = list(group), list(metrics)
+    if use_rollups and set(metrics) <= set(ADDITIVE) and (Path(store) / "rollups").is_dir():
+        return query_rollups(store, group, metrics, since, until, model), "hourly rollups"
+    needed = {"ts"} | {g for g in group if g in DICTIONARY or g == "head_version"}
+    needed |= {"dirty"} if "dirty_rate" in metrics else set()
+    needed |= {"probability"} if "mean_probability" in metrics else set()
+    needed |= {m.rsplit("_", 1)[0] for m in metrics if m.rsplit("_", 1)[-1] in PERCENTILES}
+    cols, dictionaries, n_parts = load_columns(store, sorted(needed), since, until, model)
+    rows = aggregate(cols, dictionaries, group, metrics) if len(cols["ts"]) else []
+    return rows, f"{n_parts} parts, columns {sorted(needed | ({'model'} if model else set()))}"
+
+def print_rows(rows):
+    if not rows:
+        print("(no rows)")
+        return
+    headers = list(rows[0])
+    widths = [max(len(h), *(len(_fmt(r[h])) for r in rows)) for h in headers]
+    print("  ".join(h.rjust(w) for h, w in zip(headers, widths)))
+    for r in rows:
+        print("  ".join(_fmt(r[h]).rjust(w) for h, w in zip(headers, widths)))
+
+def _fmt(v):
+    return f"{v:.4f}" if isinstance(v, float) else str(v)
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("compact", help="Compact rotated logs into the store")
+    p.add_argument("--logs", default="logs/requests.jsonl", help="Active log path; its rotated .gz files are compacted")
+    p.add_argument("--store", default="log_store")
+    p = sub.add_parser("query", help="Aggregate over the store")
+    p.add_argument("--store", default="log_store")
+    p.add_argument("--group", default="day", help=f"Comma-separated, from {', '.join(GROUPS)} (empty for totals)")
+    p.add_argument("--metrics", default="count,dirty_rate",
+                   help="count, dirty_rate, mean_probability, <decode|model|total>_ms_<p50|p95|p99>")
+    p.add_argument("--since", default=None, help="First UTC day, YYYY-MM-DD")
+    p.add_argument("--until", default=None, help="Last UTC day, YYYY-MM-DD")
+    p.add_argument("--model", default=None, help="Only this model (path or file name)")
+    p.add_argument("--no_rollups", action="store_true", help="Always scan the columns")
+    p.add_argument("--json", action="store_true")
+    p = sub.add_parser("hourly", help="Print one day's hourly rollup")
+    p.add_argument("--store", default="log_store")
+    p.add_argument("--date", required=True)
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        days = compact(args.logs, args.store)
+        print(f"[INFO] Updated {len(days)} day(s) in {args.store}: {', '.join(days) or 'nothing new'}")
+    elif args.command == "query":
+        group = [g for g in args.group.split(",") if g]
+        metrics = [m for m in args.metrics.split(",") if m]
+        bad = [g for g in group if g not in GROUPS]
+        bad += [m for m in metrics if m not in ADDITIVE and not (m.rsplit("_", 1)[-1] in PERCENTILES
+                                                                  and m.rsplit("_", 1)[0] in LATENCIES)]
+        if bad:
+            parser.error(f"unknown group/metric: {bad}")
+        start = time.perf_counter()
+        rows, how = query(args.store, group, metrics, args.since, args.until, args.model, not args.no_rollups)
+        if args.json:
+            print(json.dumps(rows, indent=2))
+        else:
+            print_rows(rows)
+            print(f"[INFO] {len(rows)} rows in {(time.perf_counter() - start) * 1000:.0f} ms from {how}")
+    else:
+        path = Path(args.store) / "rollups" / f"hourly-{args.date}.json"
+        with open(path) as f:
+            print_rows(json.load(f))
+
+if __name__ == "__main__":
+    main()
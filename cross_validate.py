@@ -0,0 +1,139 @@
+"""
+cross_validate.py
+-----------------
+k-fold / repeated k-fold evaluation of the classification head on cached
+backbone embeddings, for less noisy model selection than a single
+validation_split.
+
+Usage:
+    python cross_validate.py --data_dir "data/water images" --folds 5 --repeats 10
+    python cross_validate.py --manifest dataset_manifest.sqlite --model best_model.h5 --units 64 --dropout 0.5
+
+This script:
+ - Computes pooled MobileNetV2 embeddings for the train split once
+   (embeddings.py; cached in embedding_cache/), using the backbone of --model
+   or a fresh ImageNet backbone
+ - Trains the Dense head for every fold in parallel worker processes; the
+   embeddings are shared with the workers through a memory-mapped .npy file
+ - Reports mean, variance and std of accuracy, precision, recall, F1, ROC AUC
+   and log loss across all folds, plus the spread of per-repeat means
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import sklearn.metrics as skm
+from sklearn.model_selection import RepeatedStratifiedKFold, StratifiedKFold
+from embeddings import fit_head, predict_head
+
+METRICS = ["accuracy", "precision", "recall", "f1", "roc_auc", "log_loss"]
+_shared = {}
+
+def _init_worker(x_path, y_path):
+    _shared["X"] = np.load(x_path, mmap_mode="r")
+    _shared["y"] = np.load(y_path)
+
+def score(y_true, prob):
+    y_pred = (prob >= 0.5).astype(int)
+    both = len(np.unique(y_true)) > 1
+    return {
+        "accuracy": float((y_pred == y_true).mean()),
+        "precision": float(skm.precision_score(y_true, y_pred, zero_division=0)),
+        "recall": float(skm.recall_score(y_true, y_pred, zero_division=0)),
+        "f1": float(skm.f1_score(y_true, y_pred, zero_division=0)),
+        "roc_auc": float(skm.roc_auc_score(y_true, prob)) if both else float("nan"),
+        "log_loss": float(skm.log_loss(y_true, np.clip(prob, 1e-7, 1 - 1e-7), labels=[0, 1])),
+    }
+
+def run_fold(task):
+    repeat, fold, train_idx, test_idx, head_kwargs = task
+    X, y = _shared["X"], _shared["y"]
+    weights = fit_head(np.asarray(X[train_idx]), y[train_idx], seed=repeat * 1000 + fold, **head_kwargs)
+    result = score(y[test_idx], predict_head(weights, np.asarray(X[test_idx])))
+    result.update(repeat=repeat, fold=fold)
+    return result
+
+def summarize(results, repeats):
+    summary = {}
+    for m in METRICS:
+        vals = np.array([r[m] for r in results], dtype=np.float64)
+        per_repeat = np.array([np.nanmean([r[m] for r in results if r["repeat"] == k]) for k in range(repeats)])
+        summary[m] = {
+            "mean": float(np.nanmean(vals)),
+            "var": float(np.nanvar(vals)),
+            "std": float(np.nanstd(vals)),
+            "repeat_mean_std": float(np.nanstd(per_repeat)),
+        }
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", default="data/water images")
+    parser.add_argument("--manifest", default=None, help="dataset_manifest.py output to read the train file list from")
+    parser.add_argument("--model", default=None, help="Use this model's backbone instead of a fresh ImageNet one")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=1, help=">1 for repeated k-fold")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--units", type=int, default=128)
+    parser.add_argument("--dropout", type=float, default=0.3)
+    parser.add_argument("--dense_dropout", type=float, default=0.2)
+    parser.add_argument("--epochs", type=int, default=150)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="cv_results.json")
+    args = parser.parse_args()
+
+    from shard_dataset import collect_split_files
+    from embeddings import compute_embeddings, feature_extractor
+    files = collect_split_files("train", args.data_dir, args.manifest)
+    start = time.perf_counter()
+    model = None
+    if args.model:
+        from tensorflow.keras.models import load_model
+        model = load_model(args.model, compile=False)
+    extractor, _ = feature_extractor(model)
+    X, y, class_names = compute_embeddings(extractor, files)
+    embed_seconds = time.perf_counter() - start
+    print(f"Embeddings: {X.shape} for classes {class_names} ({embed_seconds:.1f}s, cached for next runs)")
+
+    if args.repeats > 1:
+        splitter = RepeatedStratifiedKFold(n_splits=args.folds, n_repeats=args.repeats, random_state=args.seed)
+    else:
+        splitter = StratifiedKFold(n_splits=args.folds, shuffle=True, random_state=args.seed)
+    head_kwargs = dict(units=args.units, dropout=args.dropout, dense_dropout=args.dense_dropout,
+                       epochs=args.epochs, lr=args.lr)
+    tasks = [(i // args.folds, i % args.folds, tr, te, head_kwargs) for i, (tr, te) in enumerate(splitter.split(X, y))]
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        x_path, y_path = os.path.join(tmp, "X.npy"), os.path.join(tmp, "y.npy")
+        np.save(x_path, X)
+        np.save(y_path, y)
+        # Spawned, not forked: this process already runs TensorFlow's thread pools.
+        # Workers inherit the environment, so BLAS is single-threaded before they import numpy
+        for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ[var] = "1"
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(x_path, y_path)) as pool:
+            results = list(pool.map(run_fold, tasks))
+    cv_seconds = time.perf_counter() - start
+    summary = summarize(results, args.repeats)
+
+    print("\n" + "=" * 60)
+    print(f"{args.repeats}x{args.folds}-FOLD CROSS-VALIDATION ({len(results)} fits in {cv_seconds:.1f}s)")
+    print("=" * 60)
+    print(f"{'metric':<10} {'mean':>8} {'std':>8} {'var':>9} {'repeat std':>11}")
+    for m, s in summary.items():
+        print(f"{m:<10} {s['mean']:>8.4f} {s['std']:>8.4f} {s['var']:>9.5f} {s['repeat_mean_std']:>11.4f}")
+    print("=" * 60)
+    with open(args.out, "w") as f:
+        json.dump({"config": vars(args), "embedding_seconds": embed_seconds, "cv_seconds": cv_seconds,
+                   "summary": summary, "folds": results}, f, indent=2)
+    print("Saved", args.out)
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,12 @@ Shows dataset summary and sample images for the Water Quality Prediction System.
 
 Usage:
     python data_view.py --data_dir "/mnt/data/water-quality-predictions/data/water images"
+    python data_view.py --data_dir "data/water images" --manifest dataset_manifest.sqlite
 
 This script:
  - Prints counts of images under train/ and test/ for each class
  - Displays a few sample images (requires a display or Jupyter; will save sample grid as samples_grid.png)
+ - With --manifest, reads counts and file lists from dataset_manifest.py output instead of globbing
 """
 import argparse
 from pathlib import Path
@@ -16,8 +18,11 @@ from PIL import Image
 import matplotlib.pyplot as plt
 import random
 import os
+from dataset_manifest import load_file_list, manifest_counts
 
-def gather_counts(data_dir):
+def gather_counts(data_dir, manifest=None):
+    if manifest:
+        return manifest_counts(manifest)
     data_dir = Path(data_dir)
     summary = {}
     for split in ["train", "test"]:
@@ -30,14 +35,19 @@ def gather_counts(data_dir):
             summary.setdefault(split, {})[cls] = count
     return summary
 
-def save_samples_grid(data_dir, out_path="samples_grid.png", samples_per_class=4):
+def save_samples_grid(data_dir, out_path="samples_grid.png", samples_per_class=4, manifest=None):
     data_dir = Path(data_dir)
     train_dir = data_dir / "train"
-    classes = [p.name for p in train_dir.iterdir() if p.is_dir()]
+    if manifest:
+        by_class = {}
+        for path, cls in load_file_list(manifest, "train", data_dir=data_dir):
+            by_class.setdefault(cls, []).append(Path(path))
+    else:
+        by_class = {p.name: list(p.glob("*")) for p in train_dir.iterdir() if p.is_dir()}
+    classes = sorted(by_class)
     imgs = []
     for cls in classes:
-        cls_dir = train_dir / cls
-        all_imgs = list(cls_dir.glob("*"))
+        all_imgs = by_class[cls]
         if not all_imgs:
             continue
         chosen = random.sample(all_imgs, min(samples_per_class, len(all_imgs)))
@@ -70,18 +80,19 @@ def save_samples_grid(data_dir, out_path="samples_grid.png", samples_per_class=4
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--data_dir", default="/mnt/data/water-quality-predictions/data/water images")
+    parser.add_argument("--manifest", default=None, help="dataset_manifest.py output to read file lists from")
     args = parser.parse_args()
     data_dir = Path(args.data_dir)
     if not data_dir.exists():
         print("[ERROR] data_dir does not exist:", data_dir)
         return
-    summary = gather_counts(data_dir)
+    summary = gather_counts(data_dir, manifest=args.manifest)
     print("Dataset summary (counts):")
     for split, d in summary.items():
         print(f"  {split}:")
         for cls, cnt in d.items():
             print(f"    {cls}: {cnt}")
-    out = save_samples_grid(data_dir, out_path="samples_grid.png")
+    out = save_samples_grid(data_dir, out_path="samples_grid.png", manifest=args.manifest)
     if out:
         print("Saved sample grid to", out)
     else:
@@ -0,0 +1,197 @@
+"""
+dataset_manifest.py
+-------------------
+Builds a manifest (integrity index) of the water image dataset so that the other
+scripts can load their file lists without walking the filesystem.
+
+Usage:
+    python dataset_manifest.py --data_dir "data/water images" --manifest dataset_manifest.sqlite
+    python dataset_manifest.py --manifest dataset_manifest.sqlite --summary
+
+This script:
+ - Scans <data_dir>/<split>/<class>/ in parallel and records, for each image,
+   its path, class, split, size, mtime, sha1, width/height and a decode-OK flag
+ - Stores everything in a single SQLite file indexed by (split, class)
+ - On re-run only re-hashes/decodes files whose size or mtime changed and drops
+   rows for files that disappeared
+"""
+import argparse
+import csv
+import hashlib
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from PIL import Image
+
+DEFAULT_MANIFEST = "dataset_manifest.sqlite"
+SPLITS = ["train", "test"]
+# Same whitelist flow_from_directory uses, so the manifest sees what training sees
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".bmp", ".ppm", ".tif", ".tiff"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    split TEXT NOT NULL,
+    cls TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha1 TEXT,
+    width INTEGER,
+    height INTEGER,
+    ok INTEGER NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS files_split_cls ON files (split, cls);
+CREATE INDEX IF NOT EXISTS files_sha1 ON files (sha1);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+def connect(manifest_path):
+    conn = sqlite3.connect(str(manifest_path))
+    conn.executescript(SCHEMA)
+    return conn
+
+def iter_dataset_files(data_dir):
+    """Yield (relative_path, split, cls, size, mtime_ns) for every image under data_dir."""
+    data_dir = Path(data_dir)
+    for split in SPLITS:
+        split_dir = data_dir / split
+        if not split_dir.exists():
+            continue
+        for cls_dir in sorted(p for p in split_dir.iterdir() if p.is_dir()):
+            for root, _, names in os.walk(cls_dir):
+                for name in sorted(names):
+                    if Path(name).suffix.lower() not in IMAGE_EXTENSIONS:
+                        continue
+                    full = Path(root) / name
+                    st = full.stat()
+                    yield full.relative_to(data_dir).as_posix(), split, cls_dir.name, st.st_size, st.st_mtime_ns
+
+def inspect_file(full_path):
+    """Hash and fully decode one image. Returns (sha1, width, height, ok, error)."""
+    h = hashlib.sha1()
+    with open(full_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    try:
+        with Image.open(full_path) as img:
+            img.load()  # verify() misses truncated JPEGs, a full decode does not
+            width, height = img.size
+        return h.hexdigest(), width, height, 1, None
+    except Exception as e:
+        return h.hexdigest(), None, None, 0, str(e)
+
+def build_manifest(data_dir, manifest_path=DEFAULT_MANIFEST, workers=None):
+    """Create or incrementally update the manifest. Returns a dict of change counts."""
+    data_dir = Path(data_dir).resolve()
+    conn = connect(manifest_path)
+    known = {row[0]: (row[1], row[2]) for row in conn.execute("SELECT path, size, mtime_ns FROM files")}
+    seen = set()
+    todo = []
+    for rel, split, cls, size, mtime_ns in iter_dataset_files(data_dir):
+        seen.add(rel)
+        if known.get(rel) != (size, mtime_ns):
+            todo.append((rel, split, cls, size, mtime_ns))
+
+    stats = {"added": 0, "updated": 0, "unchanged": len(seen) - len(todo), "removed": 0, "corrupt": 0}
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(inspect_file, [str(data_dir / t[0]) for t in todo], chunksize=16)
+            rows = []
+            for (rel, split, cls, size, mtime_ns), (sha1, w, h, ok, err) in zip(todo, results):
+                stats["updated" if rel in known else "added"] += 1
+                rows.append((rel, split, cls, size, mtime_ns, sha1, w, h, ok, err))
+        conn.executemany("INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?,?,?)", rows)
+
+    removed = [(p,) for p in known if p not in seen]
+    conn.executemany("DELETE FROM files WHERE path = ?", removed)
+    stats["removed"] = len(removed)
+    conn.execute("INSERT OR REPLACE INTO meta VALUES ('data_dir', ?)", (str(data_dir),))
+    conn.commit()
+    stats["corrupt"] = conn.execute("SELECT COUNT(*) FROM files WHERE ok = 0").fetchone()[0]
+    conn.close()
+    return stats
+
+def load_file_list(manifest_path, split, data_dir=None, include_corrupt=False):
+    """Return [(absolute_path, class_name), ...] for a split, sorted by path.
+
+    data_dir overrides the root recorded at build time (e.g. the manifest was
+    built on another machine). Files that failed to decode are skipped unless
+    include_corrupt is set.
+    """
+    if not Path(manifest_path).exists():
+        raise FileNotFoundError("manifest not found: " + str(manifest_path))
+    conn = connect(manifest_path)
+    if data_dir is None:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'data_dir'").fetchone()
+        data_dir = row[0] if row else "."
+    query = "SELECT path, cls FROM files WHERE split = ?" + ("" if include_corrupt else " AND ok = 1")
+    rows = conn.execute(query + " ORDER BY path", (split,)).fetchall()
+    conn.close()
+    root = Path(data_dir)
+    return [(str(root / rel), cls) for rel, cls in rows]
+
+def write_file_list(files, out_path):
+    """Write [(path, class_name), ...] as a two-column CSV train_model.py --file_list can read."""
+    with open(out_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["filename", "class"])
+        writer.writerows(files)
+
+def read_file_list(path):
+    with open(path, newline="") as f:
+        return [(row["filename"], row["class"]) for row in csv.DictReader(f)]
+
+def split_validation(files, validation_split):
+    """Per class, the first fraction is validation (same rule as flow_from_directory)."""
+    train, val = [], []
+    for cls in sorted({c for _, c in files}):
+        members = [f for f in files if f[1] == cls]
+        n_val = int(validation_split * len(members))
+        val += members[:n_val]
+        train += members[n_val:]
+    return train, val
+
+def manifest_counts(manifest_path, include_corrupt=False):
+    """Same shape as data_view.gather_counts: {split: {class: count}}."""
+    conn = connect(manifest_path)
+    query = "SELECT split, cls, COUNT(*) FROM files" + ("" if include_corrupt else " WHERE ok = 1")
+    summary = {}
+    for split, cls, count in conn.execute(query + " GROUP BY split, cls ORDER BY split DESC, cls"):
+        summary.setdefault(split, {})[cls] = count
+    conn.close()
+    return summary
+
+def corrupt_files(manifest_path):
+    conn = connect(manifest_path)
+    rows = conn.execute("SELECT path, error FROM files WHERE ok = 0 ORDER BY path").fetchall()
+    conn.close()
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", default="data/water images")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST)
+    parser.add_argument("--workers", type=int, default=None, help="Decode/hash processes (default: all cores)")
+    parser.add_argument("--summary", action="store_true", help="Only print counts from an existing manifest")
+    args = parser.parse_args()
+
+    if not args.summary:
+        if not Path(args.data_dir).exists():
+            print("[ERROR] data_dir does not exist:", args.data_dir)
+            return
+        stats = build_manifest(args.data_dir, args.manifest, workers=args.workers)
+        print("Manifest updated:", args.manifest)
+        for k, v in stats.items():
+            print(f"  {k}: {v}")
+
+    for split, d in manifest_counts(args.manifest).items():
+        print(f"  {split}:")
+        for cls, cnt in d.items():
+            print(f"    {cls}: {cnt}")
+    for path, err in corrupt_files(args.manifest):
+        print(f"[WARN] corrupt image {path}: {err}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+dedup_images.py
+---------------
+Finds near-duplicate images (burst shots, re-uploads) in the water image dataset
+using perceptual hashes.
+
+Usage:
+    python dedup_images.py --data_dir "data/water images"
+    python dedup_images.py --manifest dataset_manifest.sqlite --max_distance 6 --out_list train_dedup.csv
+
+This script:
+ - Computes 64-bit pHash and dHash for every image in parallel
+ - Indexes the hashes in a BK-tree so each near-duplicate query only visits a
+   small part of the tree instead of comparing against every image
+ - Prints duplicate clusters within train, within test and across the two
+   (train/test leakage)
+ - Optionally writes a deduplicated train file list for train_model.py --file_list,
+   keeping one image per cluster, dropping train images that leak into test and
+   leaving out files that do not decode
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from dataset_manifest import iter_dataset_files, load_file_list, write_file_list
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+DCT_32 = _dct_matrix(32)
+
+def _bits_to_int(bits):
+    return int("".join("1" if b else "0" for b in bits.ravel()), 2)
+
+def phash(img):
+    """DCT hash: sign of the low 8x8 frequencies (minus DC) relative to their median."""
+    gray = np.asarray(img.convert("L").resize((32, 32), Image.LANCZOS), dtype=np.float64)
+    low = (DCT_32 @ gray @ DCT_32.T)[:8, :8]
+    return _bits_to_int(low > np.median(low.ravel()[1:]))
+
+def dhash(img):
+    """Gradient hash: is each pixel brighter than its right neighbour (9x8 thumbnail)."""
+    gray = np.asarray(img.convert("L").resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    return _bits_to_int(gray[:, 1:] > gray[:, :-1])
+
+def hash_file(path):
+    """(phash, dhash) for one file, or (None, None) if it does not decode."""
+    try:
+        with Image.open(path) as img:
+            return phash(img), dhash(img)
+    except Exception:
+        return None, None
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes with hamming distance.
+
+    By the triangle inequality a query with radius r only descends into
+    children whose edge distance d satisfies |d - dist(query, node)| <= r.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, h, item):
+        self.size += 1
+        if self.root is None:
+            self.root = (h, [item], {})
+            return
+        node = self.root
+        while True:
+            d = hamming(h, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = (h, [item], {})
+                return
+            node = child
+
+    def query(self, h, radius):
+        """Return [(distance, item), ...] for every indexed hash within radius of h."""
+        out = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_hash, items, children = stack.pop()
+            d = hamming(h, node_hash)
+            if d <= radius:
+                out.extend((d, item) for item in items)
+            for edge, child in children.items():
+                if d - radius <= edge <= d + radius:
+                    stack.append(child)
+        return out
+
+def collect_files(data_dir=None, manifest=None):
+    """[(path, split, class), ...] from a manifest (decodable images only) or a directory walk."""
+    if manifest:
+        return [(p, split, cls) for split in ("train", "test") for p, cls in load_file_list(manifest, split)]
+    root = Path(data_dir)
+    return [(str(root / rel), split, cls) for rel, split, cls, _, _ in iter_dataset_files(root)]
+
+def find_clusters(files, hashes, max_distance):
+    """Union-find over all pairs within max_distance. Returns clusters (lists of indices) of size > 1."""
+    tree = BKTree()
+    for i, h in enumerate(hashes):
+        if h is not None:
+            tree.add(h, i)
+    parent = list(range(len(files)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, h in enumerate(hashes):
+        if h is None:
+            continue
+        for _, j in tree.query(h, max_distance):
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                parent[max(ri, rj)] = min(ri, rj)
+    groups = {}
+    for i in range(len(files)):
+        if hashes[i] is not None:
+            groups.setdefault(find(i), []).append(i)
+    return [sorted(g) for g in groups.values() if len(g) > 1]
+
+def dedup_train_list(files, clusters, drop_test_leaks=True, failed=()):
+    """Train files with one representative per cluster; whole cluster dropped if it reaches test.
+    failed: indices of files that did not decode, left out so training never hits them."""
+    drop = set(failed)
+    for cluster in clusters:
+        train = [i for i in cluster if files[i][1] == "train"]
+        leaks = any(files[i][1] == "test" for i in cluster)
+        if drop_test_leaks and leaks:
+            drop.update(train)
+        else:
+            drop.update(train[1:])
+    return [(p, cls) for i, (p, split, cls) in enumerate(files) if split == "train" and i not in drop]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", default="data/water images")
+    parser.add_argument("--manifest", default=None, help="dataset_manifest.py output to read file lists from")
+    parser.add_argument("--hash", choices=["phash", "dhash"], default="phash")
+    parser.add_argument("--max_distance", type=int, default=8, help="Max hamming distance (of 64 bits) for a near-duplicate")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out_list", default=None, help="Write deduplicated train list (CSV) for train_model.py --file_list")
+    parser.add_argument("--keep_test_leaks", action="store_true", help="Keep one train image from clusters that also appear in test")
+    args = parser.parse_args()
+
+    if not args.manifest and not Path(args.data_dir).exists():
+        print("[ERROR] data_dir does not exist:", args.data_dir)
+        return
+    files = collect_files(args.data_dir, args.manifest)
+    print(f"Hashing {len(files)} images...")
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        pairs = list(pool.map(hash_file, [f[0] for f in files], chunksize=16))
+    hashes = [p[0] if args.hash == "phash" else p[1] for p in pairs]
+    failed = [i for i, h in enumerate(hashes) if h is None]
+    for i in failed:
+        print("[WARN] could not decode", files[i][0])
+
+    clusters = find_clusters(files, hashes, args.max_distance)
+    sections = {"train": [], "test": [], "cross-split (train/test leakage)": []}
+    for cluster in clusters:
+        splits = {files[i][1] for i in cluster}
+        key = "cross-split (train/test leakage)" if len(splits) > 1 else splits.pop()
+        sections[key].append(cluster)
+    print(f"Near-duplicate clusters ({args.hash}, distance <= {args.max_distance}):")
+    for name, group in sections.items():
+        print(f"  {name}: {len(group)} clusters, {sum(len(c) for c in group)} images")
+        for cluster in group:
+            print("    - " + ", ".join(f"{files[i][1]}:{Path(files[i][0]).name}[{files[i][2]}]" for i in cluster))
+
+    if args.out_list:
+        kept = dedup_train_list(files, clusters, drop_test_leaks=not args.keep_test_leaks, failed=failed)
+        write_file_list(kept, args.out_list)
+        total = sum(1 for f in files if f[1] == "train")
+        undecodable = sum(1 for i in failed if files[i][1] == "train")
+        print(f"Wrote {len(kept)}/{total} train images to {args.out_list}"
+              + (f" ({undecodable} undecodable left out)" if undecodable else ""))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+distill.py
+----------
+Knowledge distillation of the MobileNetV2 teacher (best_model.h5) into a small
+CNN student.
+
+Usage:
+    python distill.py --teacher best_model.h5 --data_dir "data/water images"
+    python distill.py --student_size 96 --width 12 --aug_passes 20 --temperature 4 --output student_model.h5
+
+This script:
+ - Runs the teacher over the train subset once without and --aug_passes times
+   with train_model.py's augmentation, and caches the images (at the student's
+   input size) with the teacher's probabilities in distill_cache/<key>/ as .npy
+   memmaps. The key covers the teacher file, the file list, the student size and
+   the number of passes, so runs with other student settings skip the teacher
+ - Trains the student on
+       alpha * BCE(label, p) + (1 - alpha) * T^2 * KL(teacher_T || p_T)
+   where *_T are the sigmoid outputs with their logits divided by T
+ - Saves the student compiled with plain binary_crossentropy, as train_model.py
+   saves its models, so predict_image.py and api_server.py
+   (MODEL_PATH=student_model.h5) load it unchanged
+ - Compares teacher and student on the test split: accuracy, agreement,
+   single-image and batched latency (each in a fresh process, see
+   variant_sweep.py), parameters and file size -> distill_report.json
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras import layers
+from tensorflow.keras.optimizers import Adam
+
+TEACHER_SIZE = (224, 224)
+
+def build_student(img_size=(128, 128, 3), width=16, dropout=0.2):
+    """Conv stem + three stride-2 stages of separable convolutions -> Dense(1, sigmoid)."""
+    inputs = keras.Input(img_size)
+    x = layers.Conv2D(width, 3, strides=2, padding="same", use_bias=False)(inputs)
+    x = layers.ReLU()(layers.BatchNormalization()(x))
+    for mult in (2, 4, 8):
+        for strides in (2, 1):
+            x = layers.SeparableConv2D(width * mult, 3, strides=strides, padding="same", use_bias=False)(x)
+            x = layers.ReLU()(layers.BatchNormalization()(x))
+    x = layers.GlobalAveragePooling2D()(x)
+    x = layers.Dropout(dropout)(x)
+    outputs = layers.Dense(1, activation="sigmoid")(x)
+    return keras.Model(inputs, outputs, name=f"student_w{width}")
+
+def _logit(p):
+    p = tf.clip_by_value(p, 1e-7, 1 - 1e-7)
+    return tf.math.log(p / (1 - p))
+
+def distillation_loss(temperature=4.0, alpha=0.3):
+    """Loss on y_true = [hard_label, teacher_prob] and the student's probability."""
+    def loss(y_true, y_pred):
+        hard, teacher = y_true[:, :1], y_true[:, 1:]
+        soft_target = tf.sigmoid(_logit(teacher) / temperature)
+        soft_pred = tf.sigmoid(_logit(y_pred) / temperature)
+        bce = keras.losses.binary_crossentropy
+        # BCE minus the target's own entropy = KL(teacher_T || student_T), zero at a perfect match
+        kl = bce(soft_target, soft_pred) - bce(soft_target, soft_target)
+        return alpha * bce(hard, y_pred) + (1 - alpha) * temperature ** 2 * kl
+    return loss
+
+def hard_accuracy(y_true, y_pred):
+    return keras.metrics.binary_accuracy(y_true[:, :1], y_pred)
+
+def cache_key(teacher_path, paths, student_size, passes, seed):
+    st = os.stat(teacher_path)
+    h = hashlib.sha1(f"{os.path.abspath(teacher_path)}|{st.st_size}|{st.st_mtime_ns}|{student_size}|{passes}|{seed}".encode())
+    for p in paths:
+        h.update(str(p).encode())
+    return h.hexdigest()[:16]
+
+def cache_soft_labels(teacher, train_flow, val_flow, out_dir, student_size, passes=10):
+    """Teacher probabilities for the clean train/val images and `passes` augmented
+    train passes -> {"train": (x, y), "val": (x, y)} memmaps, y = [label, teacher_prob]."""
+    from embeddings import load_images
+    out_dir = Path(out_dir)
+    if (out_dir / "done").exists():
+        print(f"[INFO] Using cached teacher soft labels in {out_dir}")
+        return {s: (np.load(out_dir / f"{s}.x.npy", mmap_mode="r"), np.load(out_dir / f"{s}.y.npy", mmap_mode="r"))
+                for s in ("train", "val")}
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    def shrink(x):
+        return tf.image.resize(x, student_size, method="area").numpy().astype(np.float16)
+
+    result = {}
+    for split, flow, n_pass in (("train", train_flow, passes), ("val", val_flow, 0)):
+        n = flow.samples * (1 + n_pass)
+        x = np.lib.format.open_memmap(str(out_dir / f"{split}.x.npy"), mode="w+", dtype=np.float16,
+                                      shape=(n,) + tuple(student_size) + (3,))
+        y = np.lib.format.open_memmap(str(out_dir / f"{split}.y.npy"), mode="w+", dtype=np.float32, shape=(n, 2))
+        # Pass 0: the un-augmented images, resized like flow_from_directory
+        i = 0
+        for start in range(0, flow.samples, 32):
+            xb = load_images(flow.filepaths[start:start + 32], TEACHER_SIZE)
+            k = len(xb)
+            x[i:i + k] = shrink(xb)
+            y[i:i + k, 0] = flow.classes[start:start + k]
+            y[i:i + k, 1] = teacher.predict_on_batch(xb).ravel()
+            i += k
+        for p in range(n_pass):
+            for b in range(len(flow)):
+                xb, yb = flow[b]
+                k = len(xb)
+                x[i:i + k] = shrink(xb)
+                y[i:i + k, 0] = yb
+                y[i:i + k, 1] = teacher.predict_on_batch(xb).ravel()
+                i += k
+            flow.on_epoch_end()
+            print(f"[INFO] Teacher pass {p + 1}/{n_pass} done")
+        x.flush(); y.flush()
+        result[split] = (x[:i], y[:i])
+    (out_dir / "done").touch()
+    return result
+
+def _measure(path, images, threads):
+    from hparam_sweep import _init_worker
+    from variant_sweep import measure_variant
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx, initializer=_init_worker, initargs=(threads,)) as pool:
+        return pool.submit(measure_variant, path, images).result()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", default="data/water images")
+    parser.add_argument("--manifest", default=None, help="dataset_manifest.py output to read the file lists from")
+    parser.add_argument("--teacher", default="best_model.h5")
+    parser.add_argument("--output", default="student_model.h5")
+    parser.add_argument("--student_size", type=int, default=128)
+    parser.add_argument("--width", type=int, default=16, help="Stem channels; stages use 2x, 4x, 8x")
+    parser.add_argument("--aug_passes", type=int, default=10, help="Augmented copies of the train subset to label")
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--alpha", type=float, default=0.3, help="Weight of the hard-label loss")
+    parser.add_argument("--epochs", type=int, default=60)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--cache_dir", default="distill_cache")
+    parser.add_argument("--threads", type=int, default=1, help="CPU threads for the latency comparison")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from tensorflow.keras.models import load_model
+    from embeddings import load_images
+    from finetune_cache import ArraySequence
+    from shard_dataset import collect_split_files
+    from train_model import prepare_generators
+
+    np.random.seed(args.seed)
+    tf.random.set_seed(args.seed)
+    student_size = (args.student_size, args.student_size)
+    train_files = collect_split_files("train", args.data_dir, args.manifest)
+    test_files = collect_split_files("test", args.data_dir, args.manifest)
+    teacher = load_model(args.teacher, compile=False)
+
+    train_flow, val_flow = prepare_generators(args.data_dir, batch_size=args.batch_size, files=train_files)
+    # Keyed on the actual train/val split, so a cache built with a different split is not reused
+    key = cache_key(args.teacher, list(train_flow.filepaths) + ["--val--"] + list(val_flow.filepaths),
+                    args.student_size, args.aug_passes, args.seed)
+    data = cache_soft_labels(teacher, train_flow, val_flow, Path(args.cache_dir) / key, student_size, args.aug_passes)
+    (x_train, y_train), (x_val, y_val) = data["train"], data["val"]
+    print(f"[INFO] {len(x_train)} teacher-labelled train images, {len(x_val)} val images "
+          f"(per class {np.bincount(val_flow.classes).tolist()})")
+
+    student = build_student(student_size + (3,), width=args.width)
+    student.compile(optimizer=Adam(args.lr), loss=distillation_loss(args.temperature, args.alpha), metrics=[hard_accuracy])
+    student.fit(
+        ArraySequence(x_train, y_train, batch_size=args.batch_size, seed=args.seed),
+        epochs=args.epochs,
+        validation_data=ArraySequence(x_val, y_val, batch_size=args.batch_size, shuffle=False),
+        callbacks=[keras.callbacks.EarlyStopping(monitor="val_loss", patience=10, restore_best_weights=True, verbose=1)],
+        verbose=2
+    )
+    # Same compile + save as train_model.py, so loaders need no custom objects
+    student.compile(optimizer=Adam(args.lr), loss='binary_crossentropy', metrics=['accuracy'])
+    student.save(args.output)
+
+    paths = [p for p, _ in test_files]
+    class_names = sorted({c for _, c in test_files})
+    y_test = np.array([class_names.index(c) for _, c in test_files])
+    teacher_images = load_images(paths, TEACHER_SIZE)
+    student_images = load_images(paths, student_size)
+    p_teacher = teacher.predict(teacher_images, verbose=0).ravel()
+    p_student = student.predict(student_images, verbose=0).ravel()
+    report = {"config": vars(args), "test_images": len(paths)}
+    for name, path, prob, images in (("teacher", args.teacher, p_teacher, teacher_images),
+                                     ("student", args.output, p_student, student_images)):
+        report[name] = {
+            "test_accuracy": float(((prob >= 0.5) == y_test).mean()),
+            "params": int((teacher if name == "teacher" else student).count_params()),
+            "file_mb": os.path.getsize(path) / 2 ** 20,
+            **_measure(path, images[:32], args.threads),
+        }
+    report["agreement"] = float(((p_teacher >= 0.5) == (p_student >= 0.5)).mean())
+    with open("distill_report.json", "w") as f:
+        json.dump(report, f, indent=2)
+
+    t, s = report["teacher"], report["student"]
+    print("\n" + "=" * 60)
+    print("DISTILLATION REPORT (test split)")
+    print("=" * 60)
+    print(f"{'':<22} {'teacher':>12} {'student':>12}")
+    print(f"{'accuracy':<22} {t['test_accuracy']:>12.3f} {s['test_accuracy']:>12.3f}")
+    print(f"{'1-image latency p50':<22} {t['single_ms_p50']:>10.1f}ms {s['single_ms_p50']:>10.1f}ms")
+    print(f"{'batched ms / image':<22} {t['batch_per_image_ms']:>10.2f}ms {s['batch_per_image_ms']:>10.2f}ms")
+    print(f"{'peak RSS':<22} {t['peak_rss_mb']:>10.0f}MB {s['peak_rss_mb']:>10.0f}MB")
+    print(f"{'parameters':<22} {t['params']:>12,} {s['params']:>12,}")
+    print(f"{'file size':<22} {t['file_mb']:>10.1f}MB {s['file_mb']:>10.1f}MB")
+    print(f"Student agrees with the teacher on {report['agreement'] * 100:.1f}% of test images")
+    print("=" * 60)
+    print(f"Saved {args.output} and distill_report.json")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+distributed_train.py
+--------------------
+Data-parallel training of the train_model.py classifier across N local worker
+processes with MultiWorkerMirroredStrategy (gradient all-reduce over localhost).
+
+Usage:
+    python distributed_train.py --data_dir "data/water images" --workers 4 --epochs 5
+    python distributed_train.py --data_dir "data/water images" --workers 8 --scaling --epochs 3
+
+This script:
+ - Launches N workers with a localhost TF_CONFIG and pins each one to its own
+   contiguous set of CPU cores (intra-op threads = cores per worker)
+ - Shards the train file list per worker (worker i reads files i, i+N, ...)
+   and decodes/augments with tf.data
+ - Chief (worker 0) saves final_model_dp.h5 and writes dp_stats.json
+ - With --scaling, runs 1, 2, 4, ... N workers and reports throughput and
+   scaling efficiency = throughput(n) / (n * throughput(1))
+
+Augmentation here uses tf.image (flip, brightness, contrast) inside the tf.data
+graph instead of ImageDataGenerator, so each worker's input pipeline runs
+without the Python GIL.
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+IMG_SIZE = (224, 224)
+
+def free_ports(n):
+    socks = [socket.socket() for _ in range(n)]
+    for s in socks:
+        s.bind(("localhost", 0))
+    ports = [s.getsockname()[1] for s in socks]
+    for s in socks:
+        s.close()
+    return ports
+
+def core_sets(n_workers):
+    """Split the cores this process may use into n contiguous groups."""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    per = max(1, len(cores) // n_workers)
+    return [cores[i * per:(i + 1) * per] or cores[-per:] for i in range(n_workers)]
+
+def launch(args, n_workers, stats_path):
+    """Run one n-worker training job to completion; returns the chief's stats dict."""
+    ports = free_ports(n_workers)
+    cluster = {"worker": [f"localhost:{p}" for p in ports]}
+    procs = []
+    for i, cores in enumerate(core_sets(n_workers)):
+        env = dict(os.environ)
+        env["TF_CONFIG"] = json.dumps({"cluster": cluster, "task": {"type": "worker", "index": i}})
+        env["OMP_NUM_THREADS"] = str(len(cores))
+        env["TF_CPP_MIN_LOG_LEVEL"] = env.get("TF_CPP_MIN_LOG_LEVEL", "2")
+        cmd = [sys.executable, __file__, "--worker", "--stats", str(stats_path)] + args.passthrough
+        pin = (lambda c=cores: os.sched_setaffinity(0, c)) if hasattr(os, "sched_setaffinity") else None
+        procs.append(subprocess.Popen(cmd, env=env, preexec_fn=pin))
+        print(f"[INFO] worker {i}: port {ports[i]}, cores {cores[0]}-{cores[-1]}")
+    codes = [p.wait() for p in procs]
+    if any(codes):
+        raise RuntimeError(f"worker exit codes: {codes}")
+    with open(stats_path) as f:
+        return json.load(f)
+
+def train_files(args):
+    if args.manifest:
+        from dataset_manifest import load_file_list
+        return load_file_list(args.manifest, "train")
+    from dataset_manifest import iter_dataset_files
+    root = Path(args.data_dir)
+    return [(str(root / rel), cls) for rel, split, cls, _, _ in iter_dataset_files(root) if split == "train"]
+
+def make_dataset(files, class_indices, batch_size, training):
+    import tensorflow as tf
+    paths = [p for p, _ in files]
+    labels = [float(class_indices[c]) for _, c in files]
+
+    def load(path, label):
+        img = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        img = tf.cast(tf.image.resize(img, IMG_SIZE, method="nearest"), tf.float32) / 255.0
+        if training:
+            img = tf.image.random_flip_left_right(img)
+            img = tf.image.random_brightness(img, 0.2)
+            img = tf.image.random_contrast(img, 0.9, 1.1)
+            img = tf.clip_by_value(img, 0.0, 1.0)
+        return img, label
+
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+    if training:
+        ds = ds.shuffle(len(paths), reshuffle_each_iteration=True)
+    ds = ds.map(load, num_parallel_calls=tf.data.AUTOTUNE).batch(batch_size).repeat().prefetch(tf.data.AUTOTUNE)
+    options = tf.data.Options()
+    # Files are already sharded per worker by hand
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    return ds.with_options(options)
+
+def run_worker(args):
+    import tensorflow as tf
+    from tensorflow import keras
+    from train_model import build_model
+
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    tf.config.threading.set_intra_op_parallelism_threads(cores)
+    tf.config.threading.set_inter_op_parallelism_threads(2)
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    task = json.loads(os.environ["TF_CONFIG"])["task"]
+    index, n = task["index"], strategy.num_replicas_in_sync
+
+    files = train_files(args)
+    class_indices = {c: i for i, c in enumerate(sorted({c for _, c in files}))}
+    from dataset_manifest import split_validation
+    train, val = split_validation(files, args.validation_split)
+    my_train, my_val = train[index::n], val[index::n] or val[:1]
+    # Keras treats each worker's batch as the global batch and splits it across
+    # the replicas, so batch by batch_size * n to give every worker batch_size
+    global_batch = args.batch_size * n
+    # Every worker must run the same number of steps or the all-reduce deadlocks
+    steps = max(1, min(len(train[i::n]) for i in range(n)) // args.batch_size)
+    val_steps = max(1, min(len(val[i::n]) or 1 for i in range(n)) // args.batch_size)
+
+    with strategy.scope():
+        model = build_model(img_size=(IMG_SIZE[0], IMG_SIZE[1], 3), lr=args.lr, weights=args.weights)
+
+    epoch_times = []
+    timer = keras.callbacks.LambdaCallback(
+        on_epoch_begin=lambda e, logs: epoch_times.append(time.perf_counter()),
+        on_epoch_end=lambda e, logs: epoch_times.__setitem__(-1, time.perf_counter() - epoch_times[-1]))
+    history = model.fit(
+        make_dataset(my_train, class_indices, global_batch, training=True),
+        epochs=args.epochs,
+        steps_per_epoch=steps,
+        validation_data=make_dataset(my_val, class_indices, global_batch, training=False),
+        validation_steps=val_steps,
+        callbacks=[timer],
+        verbose=2 if index == 0 else 0
+    )
+    # Saving reads sync-on-read variables through collectives, so every worker
+    # has to call save; only the chief keeps the file
+    if index == 0:
+        model.save(args.output)
+    else:
+        tmp_dir = tempfile.mkdtemp()
+        model.save(os.path.join(tmp_dir, "model.h5"))
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    if index == 0:
+        timed = epoch_times[1:] or epoch_times  # first epoch includes graph building
+        images_per_epoch = steps * global_batch
+        stats = {
+            "workers": n,
+            "global_batch": global_batch,
+            "steps_per_epoch": steps,
+            "epoch_s": epoch_times,
+            "images_per_sec": images_per_epoch / (sum(timed) / len(timed)),
+            "history": {k: [float(x) for x in v] for k, v in history.history.items()},
+        }
+        with open(args.stats, "w") as f:
+            json.dump(stats, f, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", default="data/water images")
+    parser.add_argument("--manifest", default=None, help="dataset_manifest.py output to read the train file list from")
+    parser.add_argument("--workers", type=int, default=2, help="Number of local worker processes")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--batch_size", type=int, default=16, help="Images per worker per step (global batch = batch_size * workers)")
+    parser.add_argument("--lr", type=float, default=1e-4)
+    parser.add_argument("--validation_split", type=float, default=0.2)
+    parser.add_argument("--weights", default="imagenet", help="'imagenet' or 'none' (random init, for benchmarking)")
+    parser.add_argument("--output", default="final_model_dp.h5")
+    parser.add_argument("--stats", default="dp_stats.json")
+    parser.add_argument("--scaling", action="store_true", help="Measure 1, 2, 4 ... --workers and report scaling efficiency")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.weights == "none":
+        args.weights = None
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    args.passthrough = [a for a in sys.argv[1:] if a not in ("--scaling",)]
+    if args.weights == "imagenet":
+        # Download the backbone weights once, before N workers race for the cache file
+        from tensorflow.keras.applications import MobileNetV2
+        MobileNetV2(weights="imagenet", include_top=False, input_shape=(IMG_SIZE[0], IMG_SIZE[1], 3))
+
+    counts = [args.workers]
+    if args.scaling:
+        counts = sorted({1, args.workers} | {2 ** k for k in range(1, 8) if 2 ** k < args.workers})
+    results = []
+    for n in counts:
+        print(f"\n[INFO] Training with {n} worker(s)...")
+        results.append(launch(args, n, args.stats))
+
+    if args.scaling:
+        base = results[0]["images_per_sec"]
+        print("\nScaling report:")
+        print(f"  {'workers':>7} {'images/sec':>11} {'speedup':>8} {'efficiency':>10}")
+        for r in results:
+            speedup = r["images_per_sec"] / base
+            r["scaling_efficiency"] = speedup / r["workers"]
+            print(f"  {r['workers']:>7} {r['images_per_sec']:>11.1f} {speedup:>7.2f}x {r['scaling_efficiency']*100:>9.0f}%")
+        with open("dp_scaling.json", "w") as f:
+            json.dump(results, f, indent=2)
+        print("Saved dp_scaling.json")
+    else:
+        print(f"\n{results[0]['images_per_sec']:.1f} images/sec with {results[0]['workers']} worker(s). "
+              f"Saved {args.output} and {args.stats}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+drift_monitor.py
+----------------
+Constant-memory input/output drift monitoring for api_server.py.
+
+Usage:
+    python drift_monitor.py --model best_model.h5 --data_dir "data/water images" --out drift_baseline.json
+    DRIFT_BASELINE=drift_baseline.json python api_server.py           # GET /drift
+
+Features per image: predicted P(Dirty) (plain CNN answers only; cascade and
+tiled answers skip it), mean R/G/B and brightness (on a 32x32 thumbnail),
+log2 width/height, log2 aspect ratio and, when the server already computed
+it, the L2 norm of the pooled embedding.
+
+How it works:
+ - Every feature has a fixed-bin histogram. The bin edges are stored in the
+   baseline, so live and baseline counts line up bin for bin. The baseline is
+   built from the train split with the same feature code and the same model
+ - The server keeps a ring of `windows` histograms, each covering
+   window_seconds. A request increments one bin per feature in the newest
+   window; when the window expires, the oldest one is cleared and reused. Time
+   and memory per request are O(1) no matter how much traffic has been seen
+ - /drift compares the sum of the live windows with the baseline per feature:
+   PSI (sum (p - q) * ln(p / q) over bins, half a pseudo-count per bin) and the
+   largest CDF gap (a binned Kolmogorov-Smirnov statistic). PSI < 0.1 is
+   "stable", < 0.25 "moderate", otherwise "drift". Features with fewer than
+   min_samples live values report "warming up"
+"""
+import argparse
+import json
+import math
+import threading
+import time
+import numpy as np
+from PIL import Image
+
+# feature -> (low, high, bins); values outside are counted in the edge bins
+BINS = {
+    "probability": (0.0, 1.0, 20),
+    "mean_r": (0.0, 255.0, 32), "mean_g": (0.0, 255.0, 32), "mean_b": (0.0, 255.0, 32),
+    "brightness": (0.0, 255.0, 32),
+    "log2_width": (6.0, 13.0, 28), "log2_height": (6.0, 13.0, 28),
+    "log2_aspect": (-2.0, 2.0, 16),
+}
+PSI_MODERATE, PSI_DRIFT = 0.1, 0.25
+
+def image_stats(img):
+    """Cheap per-image features from a PIL image (fixed-size thumbnail)."""
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    thumb = np.asarray(img.resize((32, 32), Image.BILINEAR, reducing_gap=2.0), dtype=np.float32)
+    r, g, b = thumb.reshape(-1, 3).mean(axis=0)
+    w, h = img.size
+    return {"mean_r": float(r), "mean_g": float(g), "mean_b": float(b),
+            "brightness": float(0.299 * r + 0.587 * g + 0.114 * b),
+            "log2_width": math.log2(max(w, 1)), "log2_height": math.log2(max(h, 1)),
+            "log2_aspect": math.log2(max(w, 1) / max(h, 1))}
+
+def bin_index(value, low, high, bins):
+    return min(bins - 1, max(0, int((value - low) / (high - low) * bins)))
+
+def psi(expected, actual, prior=0.5):
+    """PSI with `prior` pseudo-counts per bin, so sparse histograms do not blow up."""
+    p = (expected + prior) / (expected.sum() + prior * len(expected))
+    q = (actual + prior) / (actual.sum() + prior * len(actual))
+    return float(((q - p) * np.log(q / p)).sum())
+
+def binned_ks(expected, actual):
+    return float(np.abs(np.cumsum(expected) / max(expected.sum(), 1) - np.cumsum(actual) / max(actual.sum(), 1)).max())
+
+def build_baseline(served, files, batch_size=32):
+    """Histogram counts for every feature over [(path, class_name), ...] with a
+    model_reload.ServedModel (split=True adds the embedding norm)."""
+    bins = dict(BINS)
+    values = {name: [] for name in bins}
+    norms = []
+    for start in range(0, len(files), batch_size):
+        images = []
+        for path, _ in files[start:start + batch_size]:
+            with Image.open(path) as im:
+                images.append(im.convert("RGB"))
+        for im in images:
+            for k, v in image_stats(im).items():
+                values[k].append(v)
+        if served.extractor is not None:
+            features = served.extractor.predict_on_batch(served.to_array(images))
+            values["probability"].extend(np.asarray(served.head.predict_on_batch(features)).ravel().tolist())
+            norms.extend(np.linalg.norm(features, axis=1).tolist())
+        else:
+            values["probability"].extend(served.probabilities(images).tolist())
+    if norms:
+        lo, hi = float(np.min(norms)), float(np.max(norms))
+        pad = max(hi - lo, 1e-3)
+        bins["embedding_norm"] = (max(0.0, lo - pad), hi + pad, 32)
+        values["embedding_norm"] = norms
+    counts = {}
+    for name, (lo, hi, n) in bins.items():
+        c = np.zeros(n, np.int64)
+        for v in values[name]:
+            c[bin_index(v, lo, hi, n)] += 1
+        counts[name] = c.tolist()
+    return {"model": served.path, "images": len(files), "bins": {k: list(v) for k, v in bins.items()},
+            "counts": counts, "means": {k: float(np.mean(v)) for k, v in values.items() if v}}
+
+class DriftMonitor:
+    """Ring of fixed-bin histograms compared against a baseline."""
+
+    def __init__(self, baseline, window_seconds=3600, windows=24, min_samples=100):
+        self.baseline = baseline
+        self.min_samples = min_samples
+        self.bins = {k: tuple(v) for k, v in baseline["bins"].items()}
+        self.window_seconds = window_seconds
+        self.features = list(self.bins)
+        self._index = {name: i for i, name in enumerate(self.features)}
+        width = max(n for _, _, n in self.bins.values())
+        # [window, feature, bin] counts and [window, feature] value sums
+        self.counts = np.zeros((windows, len(self.features), width), np.int64)
+        self.sums = np.zeros((windows, len(self.features)), np.float64)
+        self.window_start = np.zeros(windows)
+        self.current = 0
+        self.window_start[0] = time.time()
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def _advance(self, now):
+        if now - self.window_start[self.current] >= self.window_seconds * len(self.window_start):
+            # Idle for longer than the whole ring: start over
+            self.counts[:] = 0
+            self.sums[:] = 0
+            self.window_start[:] = 0
+            self.window_start[self.current] = now
+            return
+        while now - self.window_start[self.current] >= self.window_seconds:
+            start = self.window_start[self.current] + self.window_seconds
+            self.current = (self.current + 1) % len(self.window_start)
+            self.counts[self.current] = 0
+            self.sums[self.current] = 0
+            self.window_start[self.current] = max(start, now - self.window_seconds)
+
+    def update(self, img, probability=None, embedding=None):
+        """Record one request: a fixed number of bin increments."""
+        values = image_stats(img)
+        if probability is not None:
+            values["probability"] = probability
+        if embedding is not None and "embedding_norm" in self._index:
+            values["embedding_norm"] = float(np.linalg.norm(embedding))
+        with self._lock:
+            self._advance(time.time())
+            for name, v in values.items():
+                i = self._index.get(name)
+                if i is not None:
+                    lo, hi, n = self.bins[name]
+                    self.counts[self.current, i, bin_index(v, lo, hi, n)] += 1
+                    self.sums[self.current, i] += v
+            self.total += 1
+
+    def report(self):
+        with self._lock:
+            self._advance(time.time())
+            live = self.counts.sum(axis=0)
+            sums = self.sums.sum(axis=0)
+            total = self.total
+        features = {}
+        for name, i in self._index.items():
+            n_bins = self.bins[name][2]
+            actual = live[i, :n_bins]
+            expected = np.asarray(self.baseline["counts"][name])
+            n = int(actual.sum())
+            entry = {"samples": n, "baseline_mean": self.baseline["means"].get(name)}
+            if n:
+                entry.update(psi=psi(expected, actual), ks=binned_ks(expected, actual), live_mean=float(sums[i] / n))
+                if n < self.min_samples:
+                    entry["status"] = "warming up"
+                else:
+                    entry["status"] = "stable" if entry["psi"] < PSI_MODERATE else "moderate" if entry["psi"] < PSI_DRIFT else "drift"
+            features[name] = entry
+        scored = [f for f in features.values() if f.get("status") not in (None, "warming up")]
+        worst = max(scored, key=lambda f: f["psi"], default=None)
+        return {"requests_total": total, "window_seconds": self.window_seconds,
+                "covered_seconds": self.window_seconds * len(self.window_start),
+                "baseline_images": self.baseline["images"], "baseline_model": self.baseline["model"],
+                "min_samples": self.min_samples, "status": worst["status"] if worst else "warming up",
+                "max_psi": worst["psi"] if worst else None, "features": features}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", default="data/water images")
+    parser.add_argument("--manifest", default=None, help="dataset_manifest.py output to read the file lists from")
+    parser.add_argument("--model", default="best_model.h5", help="The model the server runs")
+    parser.add_argument("--out", default="drift_baseline.json")
+    args = parser.parse_args()
+
+    from model_reload import ServedModel
+    from shard_dataset import collect_split_files
+    files = collect_split_files("train", args.data_dir, args.manifest)
+    try:
+        served = ServedModel(args.model, split=True)
+    except ValueError:
+        served = ServedModel(args.model)  # no pooling layer to split at: no embedding norms
+    baseline = build_baseline(served, files)
+    with open(args.out, "w") as f:
+        json.dump(baseline, f, indent=1)
+    print(f"[INFO] Saved {args.out}: {len(baseline['bins'])} features over {len(files)} train images")
+
+if __name__ == "__main__":
+    main()
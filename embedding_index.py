@@ -0,0 +1,270 @@
+"""
+embedding_index.py
+------------------
+Nearest-neighbor index over pooled MobileNetV2 embeddings of the labeled
+images, so a prediction can show the most similar training images.
+
+Usage:
+    python embedding_index.py --model best_model.h5 --out embedding_index
+    python embedding_index.py --model best_model.h5 --nlist 64 --pq_m 32 --splits train,test
+    python embedding_index.py --benchmark --synthetic 200000      # recall / latency at archive scale
+
+    NEIGHBOR_INDEX=embedding_index python api_server.py            # POST /predict?neighbors=5
+
+Index layout (<out>/, loaded with np.load(mmap_mode="r")):
+ - meta.json      kind, dim, class names, file paths and labels, backbone fingerprint
+ - vectors.npy    L2-normalised float32 embeddings (cosine similarity = dot product),
+                  stored in inverted-list order when IVF is used
+ - ids.npy        original row of every stored vector
+ - centroids.npy, offsets.npy   IVF: k-means centroids and the [start, end) of each list
+ - codebooks.npy, codes.npy     PQ: per-subspace k-means codebooks and uint8 codes
+
+Search: flat scans every vector. IVF scans the --nprobe lists whose
+centroids are closest to the query. PQ scores candidates from a per-query
+lookup table (asymmetric distance), and then re-ranks the best few with the
+exact vectors if they were kept.
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+import numpy as np
+
+def normalize(X):
+    X = np.asarray(X, dtype=np.float32)
+    return X / (np.linalg.norm(X, axis=-1, keepdims=True) + 1e-12)
+
+def kmeans(X, k, iters=10, seed=0, per_centroid=32):
+    """Lloyd's k-means on up to per_centroid * k sampled rows -> centroids [k, D]."""
+    rng = np.random.default_rng(seed)
+    sample = per_centroid * k
+    if len(X) > sample:
+        X = X[np.sort(rng.choice(len(X), sample, replace=False))]
+    X = np.asarray(X, dtype=np.float32)
+    k = min(k, len(X))
+    C = X[rng.choice(len(X), k, replace=False)].copy()
+    for _ in range(iters):
+        assign = assign_nearest(X, C)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=k)
+        nonempty = counts > 0
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        C[nonempty] = np.add.reduceat(X[order], starts[nonempty], axis=0) / counts[nonempty, None]
+        # Re-seed empty clusters with random points
+        C[~nonempty] = X[rng.choice(len(X), int((~nonempty).sum()), replace=False)]
+    return C
+
+def assign_nearest(X, C, chunk=8192):
+    """Index of the nearest centroid (squared L2) for every row of X."""
+    c2 = (C ** 2).sum(axis=1)
+    out = np.empty(len(X), dtype=np.int64)
+    for s in range(0, len(X), chunk):
+        out[s:s + chunk] = np.argmin(c2 - 2 * np.asarray(X[s:s + chunk]) @ C.T, axis=1)
+    return out
+
+def train_pq(X, m, seed=0):
+    """Per-subspace codebooks [m, ks, D/m] (ks = 256, or fewer for tiny data)."""
+    d = X.shape[1]
+    if d % m:
+        raise ValueError(f"pq_m={m} must divide the embedding size {d}")
+    sub = d // m
+    return np.stack([kmeans(X[:, j * sub:(j + 1) * sub], 256, seed=seed + j) for j in range(m)])
+
+def encode_pq(X, codebooks, chunk=8192):
+    m, _, sub = codebooks.shape
+    codes = np.empty((len(X), m), dtype=np.uint8)
+    for j in range(m):
+        codes[:, j] = assign_nearest(X[:, j * sub:(j + 1) * sub], codebooks[j], chunk)
+    return codes
+
+def build_index(X, out_dir, paths=None, labels=None, class_names=None, nlist=0, pq_m=0, keep_vectors=True,
+                fingerprint=None, seed=0):
+    """Write an index for embeddings X [N, D] to out_dir."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    X = normalize(X)
+    ids = np.arange(len(X))
+    offsets = None
+    if nlist:
+        centroids = normalize(kmeans(X, nlist, seed=seed))
+        assign = assign_nearest(X, centroids)
+        ids = np.argsort(assign, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(centroids)))])
+        np.save(out_dir / "centroids.npy", centroids)
+        np.save(out_dir / "offsets.npy", offsets)
+    np.save(out_dir / "ids.npy", ids)
+    if pq_m:
+        codebooks = train_pq(X, pq_m, seed=seed)
+        np.save(out_dir / "codebooks.npy", codebooks)
+        np.save(out_dir / "codes.npy", encode_pq(X[ids], codebooks))
+    if keep_vectors or not pq_m:
+        np.save(out_dir / "vectors.npy", X[ids])
+    kind = "+".join(k for k, on in (("ivf", nlist), ("pq", pq_m)) if on) or "flat"
+    meta = {"kind": kind, "dim": int(X.shape[1]), "count": int(len(X)), "nlist": int(len(offsets) - 1) if nlist else 0,
+            "pq_m": int(pq_m), "class_names": class_names, "backbone_fingerprint": fingerprint,
+            "paths": paths, "labels": None if labels is None else [int(v) for v in labels]}
+    with open(out_dir / "meta.json", "w") as f:
+        json.dump(meta, f)
+    return out_dir
+
+class EmbeddingIndex:
+    """Memory-mapped index written by build_index()."""
+
+    def __init__(self, index_dir):
+        d = Path(index_dir)
+        with open(d / "meta.json") as f:
+            self.meta = json.load(f)
+
+        def load(name):
+            return np.load(d / name, mmap_mode="r") if (d / name).exists() else None
+
+        self.ids = load("ids.npy")
+        self.vectors = load("vectors.npy")
+        self.centroids = load("centroids.npy")
+        self.offsets = load("offsets.npy")
+        self.codebooks = None if load("codebooks.npy") is None else np.load(d / "codebooks.npy")
+        self.codes = load("codes.npy")
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def _candidates(self, q, nprobe):
+        """Row ranges of the stored arrays to scan for query q."""
+        if self.centroids is None:
+            return [(0, len(self))]
+        lists = np.argsort(-(self.centroids @ q))[:nprobe]
+        return [(int(self.offsets[l]), int(self.offsets[l + 1])) for l in lists if self.offsets[l + 1] > self.offsets[l]]
+
+    def search(self, queries, k=5, nprobe=8, rerank=4):
+        """Top-k (ids [B, k], cosine similarities [B, k]) for query embeddings [B, D].
+        ids index the original rows (meta paths/labels); -1 pads short results."""
+        queries = normalize(np.atleast_2d(queries))
+        all_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for b, q in enumerate(queries):
+            ranges = self._candidates(q, nprobe)
+            rows = np.concatenate([np.arange(s, e) for s, e in ranges]) if ranges else np.zeros(0, np.int64)
+            if self.codes is not None:
+                m, _, sub = self.codebooks.shape
+                lut = np.einsum("mkd,md->mk", self.codebooks, q.reshape(m, sub))
+                codes = np.concatenate([self.codes[s:e] for s, e in ranges]) if ranges else np.zeros((0, m), np.uint8)
+                scores = lut[np.arange(m), codes].sum(axis=1)
+                if self.vectors is not None and rerank:
+                    top = _topk(scores, k * rerank)
+                    rows, scores = rows[top], np.asarray(self.vectors[rows[top]]) @ q
+            else:
+                scores = np.concatenate([np.asarray(self.vectors[s:e]) @ q for s, e in ranges]) if ranges else np.zeros(0)
+            top = _topk(scores, k)
+            all_ids[b, :len(top)] = self.ids[rows[top]]
+            all_scores[b, :len(top)] = scores[top]
+        return all_ids, all_scores
+
+    def neighbors(self, query, k=5, nprobe=8):
+        """[{path, label, similarity}] for one query embedding."""
+        ids, scores = self.search(query, k, nprobe)
+        names, paths, labels = self.meta["class_names"], self.meta["paths"], self.meta["labels"]
+        return [{"path": paths[i] if paths else int(i),
+                 "label": names[labels[i]] if labels is not None and names else None,
+                 "similarity": float(s)} for i, s in zip(ids[0], scores[0]) if i >= 0]
+
+def _topk(scores, k):
+    if len(scores) <= k:
+        return np.argsort(-scores)
+    top = np.argpartition(-scores, k)[:k]
+    return top[np.argsort(-scores[top])]
+
+def synthetic_embeddings(n, dim=1280, clusters=200, sites=20, seed=0):
+    """Clustered unit vectors: scene types -> sites (repeat photos of one place) -> shots."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    site_centers = centers.repeat(sites, axis=0) + 0.6 * rng.normal(size=(clusters * sites, dim)).astype(np.float32)
+    X = site_centers[rng.integers(0, clusters * sites, n)] + 0.3 * rng.normal(size=(n, dim)).astype(np.float32)
+    return normalize(X)
+
+def benchmark(X, queries, out_dir, k=5, nlist=None, pq_m=32):
+    """Recall@k against exact search and per-query latency for flat / IVF / PQ / IVF+PQ."""
+    X, queries = normalize(X), normalize(queries)
+    exact = np.argsort(-(queries @ X.T), axis=1)[:, :k]
+    nlist = nlist or max(1, int(np.sqrt(len(X))))
+    pq_m = pq_m if X.shape[1] % pq_m == 0 else 0
+    configs = [("flat", 0, 0, [1])]
+    if nlist > 1:
+        configs.append(("ivf", nlist, 0, [1, 4, 16, 64]))
+    if pq_m:
+        configs.append(("pq", 0, pq_m, [1]))
+        if nlist > 1:
+            configs.append(("ivf+pq", nlist, pq_m, [4, 16, 64]))
+    results = []
+    for name, n_l, m, nprobes in configs:
+        start = time.perf_counter()
+        index = EmbeddingIndex(build_index(X, Path(out_dir) / name.replace("+", "_"), nlist=n_l, pq_m=m))
+        build_s = time.perf_counter() - start
+        for nprobe in nprobes:
+            if n_l and nprobe > index.meta["nlist"]:
+                continue
+            index.search(queries[:1], k, nprobe)  # warm the page cache
+            times, found = [], []
+            for q in queries:
+                t = time.perf_counter()
+                ids, _ = index.search(q, k, nprobe)
+                times.append((time.perf_counter() - t) * 1000)
+                found.append(ids[0])
+            recall = np.mean([len(set(f) & set(e)) / k for f, e in zip(found, exact)])
+            results.append({"index": name, "nprobe": nprobe if n_l else None, "recall_at_k": float(recall),
+                            "ms_p50": float(np.percentile(times, 50)), "ms_p95": float(np.percentile(times, 95)),
+                            "build_s": build_s})
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", default="data/water images")
+    parser.add_argument("--manifest", default=None, help="dataset_manifest.py output to read the file lists from")
+    parser.add_argument("--model", default="best_model.h5", help="Model whose backbone embeds the images (use the serving model)")
+    parser.add_argument("--splits", default="train", help="Comma-separated labeled splits to index")
+    parser.add_argument("--out", default="embedding_index")
+    parser.add_argument("--nlist", type=int, default=0, help="IVF lists (0 = no IVF)")
+    parser.add_argument("--pq_m", type=int, default=0, help="PQ subspaces (0 = keep exact float32 vectors only)")
+    parser.add_argument("--drop_vectors", action="store_true", help="With PQ, do not keep exact vectors for re-ranking")
+    parser.add_argument("--benchmark", action="store_true", help="Recall@k / latency of flat, IVF and PQ indexes")
+    parser.add_argument("--synthetic", type=int, default=0, help="Benchmark on N synthetic 1280-d embeddings")
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.benchmark and args.synthetic:
+        X = synthetic_embeddings(args.synthetic + 200)
+        X, queries = X[:-200], X[-200:]
+    else:
+        from tensorflow.keras.models import load_model
+        from embeddings import compute_embeddings, feature_extractor
+        from multi_head import backbone_fingerprint
+        from shard_dataset import collect_split_files
+        model = load_model(args.model, compile=False)
+        extractor, _ = feature_extractor(model)
+        files = [f for split in args.splits.split(",") for f in collect_split_files(split, args.data_dir, args.manifest)]
+        X, y, class_names = compute_embeddings(extractor, files)
+        if not args.benchmark:
+            build_index(X, args.out, paths=[p for p, _ in files], labels=y, class_names=class_names,
+                        nlist=args.nlist, pq_m=args.pq_m, keep_vectors=not args.drop_vectors,
+                        fingerprint=backbone_fingerprint(model))
+            print(f"[INFO] Indexed {len(X)} images ({X.shape[1]}-d) from {args.splits} into {args.out}/")
+            return
+        test_files = collect_split_files("test", args.data_dir, args.manifest)
+        queries, _, _ = compute_embeddings(extractor, test_files)
+
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        results = benchmark(X, queries, tmp, k=args.k, nlist=args.nlist or None, pq_m=args.pq_m or 32)
+    with open("index_benchmark.json", "w") as f:
+        json.dump({"count": len(X), "queries": len(queries), "k": args.k, "results": results}, f, indent=2)
+    print("\n" + "=" * 64)
+    print(f"INDEX BENCHMARK: {len(X)} vectors, {len(queries)} queries, recall@{args.k}")
+    print("=" * 64)
+    print(f"{'index':<8} {'nprobe':>6} {'recall':>8} {'ms p50':>8} {'ms p95':>8} {'build s':>8}")
+    for r in results:
+        print(f"{r['index']:<8} {r['nprobe'] or '-':>6} {r['recall_at_k']:>8.3f} {r['ms_p50']:>8.2f} "
+              f"{r['ms_p95']:>8.2f} {r['build_s']:>8.1f}")
+    print("=" * 64)
+    print("Saved index_benchmark.json")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+embeddings.py
+-------------
+Pooled MobileNetV2 embeddings and a NumPy version of the classification head.
+
+The classifier from train_model.build_model is backbone -> GlobalAveragePooling2D
+(1280-d) -> Dropout -> Dense(units, relu) -> Dropout -> Dense(1, sigmoid).
+This module:
+ - splits a model (or a fresh ImageNet backbone) into a feature extractor and
+   its head (model_utils.split_at)
+ - computes embeddings for a file list once and caches them in an .npz keyed
+   by the file list and the extractor weights
+ - trains/evaluates the dense head directly on embeddings in NumPy. The weight
+   layout matches the Keras Dense layers, so a trained head can be copied into
+   the model with set_head_weights()
+"""
+import hashlib
+from pathlib import Path
+import numpy as np
+from PIL import Image
+
+IMG_SIZE = (224, 224)
+
+def load_images(paths, img_size=IMG_SIZE):
+    """float32 [N, H, W, 3] in [0, 1], resized like flow_from_directory (nearest)."""
+    out = np.empty((len(paths), img_size[1], img_size[0], 3), dtype=np.float32)
+    for i, p in enumerate(paths):
+        with Image.open(p) as img:
+            out[i] = np.asarray(img.convert("RGB").resize(img_size, Image.NEAREST), dtype=np.float32) / 255.0
+    return out
+
+def feature_extractor(model=None, img_size=IMG_SIZE, alpha=1.0):
+    """(extractor, head). With a model: split at its pooling layer. Without: a fresh
+    ImageNet MobileNetV2 + GlobalAveragePooling2D, and head None."""
+    if model is not None:
+        from model_utils import pooling_layer, split_at
+        return split_at(model, pooling_layer(model).name)
+    from tensorflow import keras
+    from tensorflow.keras.applications import MobileNetV2
+    base = MobileNetV2(weights="imagenet", include_top=False, input_shape=(img_size[1], img_size[0], 3), alpha=alpha)
+    return keras.Model(base.input, keras.layers.GlobalAveragePooling2D()(base.output)), None
+
+def _cache_key(extractor, paths):
+    h = hashlib.sha1(str(extractor.input_shape).encode())
+    for p in paths:
+        h.update(str(p).encode())
+    # Every weight, in full: a fine-tuned backbone can differ only in its middle blocks
+    for w in extractor.weights:
+        h.update(np.ascontiguousarray(w.numpy(), dtype=np.float32).tobytes())
+    return h.hexdigest()[:16]
+
+def compute_embeddings(extractor, files, batch_size=32, cache_dir="embedding_cache"):
+    """Embeddings for [(path, class_name), ...] -> (X float32 [N, D], y int [N], class_names).
+
+    Results are cached in <cache_dir>/<key>.npz so repeated runs (CV, sweeps,
+    index builds) skip the backbone entirely.
+    """
+    paths = [p for p, _ in files]
+    class_names = sorted({c for _, c in files})
+    y = np.asarray([class_names.index(c) for _, c in files], dtype=np.int64)
+    img_size = tuple(extractor.input_shape[1:3][::-1])
+    cache = Path(cache_dir) / f"{_cache_key(extractor, paths)}.npz" if cache_dir else None
+    if cache is not None and cache.exists():
+        with np.load(cache) as data:
+            return data["X"], y, class_names
+    X = np.empty((len(paths), extractor.output_shape[-1]), dtype=np.float32)
+    for start in range(0, len(paths), batch_size):
+        batch = load_images(paths[start:start + batch_size], img_size)
+        X[start:start + len(batch)] = extractor.predict_on_batch(batch)
+    if cache is not None:
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(cache, X=X, paths=np.asarray(paths))
+    return X, y, class_names
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -40, 40)))
+
+def predict_head(weights, X):
+    """Sigmoid probabilities of the dense head (dropout off)."""
+    h = np.maximum(X @ weights["W1"] + weights["b1"], 0.0)
+    return _sigmoid(h @ weights["W2"] + weights["b2"]).ravel()
+
+def fit_head(X, y, units=128, dropout=0.3, dense_dropout=0.2, epochs=150, lr=1e-3, batch_size=32,
+             l2=1e-4, seed=0, init=None, sample_weight=None):
+    """Train Dense(units, relu) -> Dense(1, sigmoid) with Adam on embeddings.
+
+    init: optional weights dict to continue from (e.g. the deployed head).
+    Returns {"W1", "b1", "W2", "b2"} in Keras kernel layout.
+    """
+    rng = np.random.default_rng(seed)
+    X = np.asarray(X, dtype=np.float32)
+    n, d = X.shape
+    y = np.asarray(y, dtype=np.float32).reshape(-1, 1)
+    sw = np.ones((n, 1), np.float32) if sample_weight is None else np.asarray(sample_weight, np.float32).reshape(-1, 1)
+    if init is None:
+        # Glorot uniform, Keras' Dense default
+        lim1, lim2 = np.sqrt(6.0 / (d + units)), np.sqrt(6.0 / (units + 1))
+        params = {"W1": rng.uniform(-lim1, lim1, (d, units)).astype(np.float32), "b1": np.zeros(units, np.float32),
+                  "W2": rng.uniform(-lim2, lim2, (units, 1)).astype(np.float32), "b2": np.zeros(1, np.float32)}
+    else:
+        params = {k: np.array(v, dtype=np.float32) for k, v in init.items()}
+    m = {k: np.zeros_like(v) for k, v in params.items()}
+    v = {k: np.zeros_like(p) for k, p in params.items()}
+    b1, b2, eps, t = np.float32(0.9), np.float32(0.999), np.float32(1e-7), 0
+    for _ in range(epochs):
+        order = rng.permutation(n)
+        for start in range(0, n, batch_size):
+            idx = order[start:start + batch_size]
+            xb, yb, wb = X[idx], y[idx], sw[idx]
+            # float32 masks keep every matmul in single precision
+            mask_in = (rng.random(xb.shape, dtype=np.float32) >= dropout) * np.float32(1.0 / (1.0 - dropout)) if dropout else 1.0
+            xd = xb * mask_in
+            pre = xd @ params["W1"] + params["b1"]
+            h = np.maximum(pre, 0.0)
+            mask_h = (rng.random(h.shape, dtype=np.float32) >= dense_dropout) * np.float32(1.0 / (1.0 - dense_dropout)) if dense_dropout else 1.0
+            hd = h * mask_h
+            p = _sigmoid(hd @ params["W2"] + params["b2"])
+            g_out = (p - yb) * wb / wb.sum()
+            grads = {"W2": hd.T @ g_out + l2 * params["W2"], "b2": g_out.sum(axis=0)}
+            g_h = (g_out @ params["W2"].T) * mask_h * (pre > 0)
+            grads["W1"] = xd.T @ g_h + l2 * params["W1"]
+            grads["b1"] = g_h.sum(axis=0)
+            t += 1
+            for k in params:
+                m[k] = b1 * m[k] + (1 - b1) * grads[k]
+                v[k] = b2 * v[k] + (1 - b2) * grads[k] ** 2
+                params[k] -= lr * (m[k] / (1 - b1 ** t)) / (np.sqrt(v[k] / (1 - b2 ** t)) + eps)
+    return params
+
+def head_dense_layers(model):
+    """The two Dense layers after the pooling layer, in order."""
+    from tensorflow.keras.layers import Dense
+    from model_utils import pooling_layer
+    layers = model.layers
+    dense = [l for l in layers[layers.index(pooling_layer(model)) + 1:] if isinstance(l, Dense)]
+    if len(dense) != 2:
+        raise ValueError("expected a Dense(units) -> Dense(1) head after the pooling layer")
+    return dense
+
+def get_head_weights(model):
+    (W1, b1), (W2, b2) = [l.get_weights() for l in head_dense_layers(model)]
+    return {"W1": W1, "b1": b1, "W2": W2, "b2": b2}
+
+def set_head_weights(model, weights):
+    d1, d2 = head_dense_layers(model)
+    d1.set_weights([weights["W1"], weights["b1"]])
+    d2.set_weights([weights["W2"], weights["b2"]])
@@ -1,5 +1,13 @@
 #!/usr/bin/env python3
-"""Evaluate model on test set"""
+"""Evaluate model on test set
+
+Usage:
+    python evaluate_model.py
+    python evaluate_model.py --model final_model.h5 --manifest dataset_manifest.sqlite
+    python evaluate_model.py --shard_dir shards
+    python evaluate_model.py --model best_model.h5 final_model.h5   # one backbone pass, see multi_head.py
+"""
+import argparse
 import numpy as np
 from tensorflow.keras.models import load_model
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
@@ -7,49 +15,100 @@ from pathlib import Path
 import sklearn.metrics as skm
 
 IMG_SIZE = (224, 224)
-data_dir = "data/water images"
-test_dir = Path(data_dir) / "test"
-
-# Load model
-print("Loading model...")
-model = load_model("best_model.h5")
-
-# Prepare test data
-test_datagen = ImageDataGenerator(rescale=1./255)
-test_flow = test_datagen.flow_from_directory(
-    str(test_dir),
-    target_size=IMG_SIZE,
-    batch_size=16,
-    class_mode='binary',
-    shuffle=False
-)
-
-print(f"\nFound {test_flow.samples} test images")
-print(f"Classes: {test_flow.class_indices}")
-
-# Predict
-print("\nMaking predictions...")
-preds = model.predict(test_flow, verbose=1).ravel()
-y_pred = (preds >= 0.5).astype(int)
-y_true = test_flow.classes
-
-# Calculate metrics
-acc = (y_pred == y_true).mean()
-cm = skm.confusion_matrix(y_true, y_pred)
-
-print("\n" + "="*60)
-print("MODEL EVALUATION RESULTS")
-print("="*60)
-print(f"Overall Accuracy: {acc*100:.2f}%")
-print(f"\nConfusion Matrix:")
-print(f"                Predicted Clean  Predicted Dirty")
-print(f"Actual Clean         {cm[0][0]:3d}              {cm[0][1]:3d}")
-print(f"Actual Dirty         {cm[1][0]:3d}              {cm[1][1]:3d}")
-
-# Per-class metrics
-report = skm.classification_report(y_true, y_pred, 
-                                   target_names=['Clean', 'Dirty'],
-                                   digits=3)
-print(f"\nDetailed Classification Report:")
-print(report)
-print("="*60)
+
+def test_generator(data_dir, batch_size=16, files=None, shard_dir=None):
+    """Unshuffled test iterator, from <data_dir>/test, an explicit [(path, class), ...] list
+    or the memory-mapped <shard_dir>/test."""
+    if shard_dir is not None:
+        from shard_dataset import ShardSequence
+        return ShardSequence(Path(shard_dir) / "test", batch_size=batch_size, shuffle=False)
+    test_datagen = ImageDataGenerator(rescale=1./255)
+    if files is not None:
+        from train_model import files_dataframe
+        return test_datagen.flow_from_dataframe(
+            files_dataframe(files),
+            target_size=IMG_SIZE,
+            batch_size=batch_size,
+            class_mode='binary',
+            shuffle=False,
+            validate_filenames=False
+        )
+    test_dir = Path(data_dir) / "test"
+    return test_datagen.flow_from_directory(
+        str(test_dir),
+        target_size=IMG_SIZE,
+        batch_size=batch_size,
+        class_mode='binary',
+        shuffle=False
+    )
+
+def print_results(y_true, y_pred):
+    # Calculate metrics
+    acc = (y_pred == y_true).mean()
+    cm = skm.confusion_matrix(y_true, y_pred)
+
+    print("\n" + "="*60)
+    print("MODEL EVALUATION RESULTS")
+    print("="*60)
+    print(f"Overall Accuracy: {acc*100:.2f}%")
+    print(f"\nConfusion Matrix:")
+    print(f"                Predicted Clean  Predicted Dirty")
+    print(f"Actual Clean         {cm[0][0]:3d}              {cm[0][1]:3d}")
+    print(f"Actual Dirty         {cm[1][0]:3d}              {cm[1][1]:3d}")
+
+    # Per-class metrics
+    report = skm.classification_report(y_true, y_pred,
+                                       target_names=['Clean', 'Dirty'],
+                                       digits=3)
+    print(f"\nDetailed Classification Report:")
+    print(report)
+    print("="*60)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", default="data/water images")
+    parser.add_argument("--model", nargs="+", default=["best_model.h5"], help="One or more models; heads on a shared backbone are compared in one pass")
+    parser.add_argument("--manifest", default=None, help="dataset_manifest.py output to read the test file list from")
+    parser.add_argument("--shard_dir", default=None, help="shard_dataset.py output to memory-map instead of reading JPEGs")
+    args = parser.parse_args()
+
+    # Prepare test data
+    files = None
+    if args.manifest:
+        from dataset_manifest import load_file_list
+        files = load_file_list(args.manifest, "test")
+    test_flow = test_generator(args.data_dir, files=files, shard_dir=args.shard_dir)
+
+    print(f"\nFound {test_flow.samples} test images")
+    print(f"Classes: {test_flow.class_indices}")
+
+    y_true = test_flow.classes
+    if len(args.model) == 1:
+        print("Loading model...")
+        model = load_model(args.model[0])
+        print("\nMaking predictions...")
+        preds = model.predict(test_flow, verbose=1).ravel()
+        print_results(y_true, (preds >= 0.5).astype(int))
+        return
+
+    from multi_head import MultiHeadModel
+    print("Loading models...")
+    models = MultiHeadModel({path: path for path in args.model})
+    print(f"Backbone groups: {models.describe()}")
+    print("\nMaking predictions...")
+    preds = {path: [] for path in args.model}
+    for i in range(len(test_flow)):
+        x, _ = test_flow[i]
+        for path, p in models.predict(x).items():
+            preds[path].append(p)
+    preds = {path: np.concatenate(p) for path, p in preds.items()}
+    print(f"{len(test_flow)} batches, {models.backbone_passes} backbone passes for {len(args.model)} models")
+    for path in args.model:
+        print(f"\n### {path}")
+        print_results(y_true, (preds[path] >= 0.5).astype(int))
+    base = preds[args.model[0]] >= 0.5
+    for path in args.model[1:]:
+        print(f"Agreement {args.model[0]} vs {path}: {((preds[path] >= 0.5) == base).mean() * 100:.1f}%")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+feedback_learner.py
+-------------------
+Operator corrections -> dense-head updates in the running API server, with no
+train_model.py run.
+
+Usage:
+    FEEDBACK_DIR=feedback python api_server.py     # POST /feedback, GET /feedback/status
+    python feedback_learner.py --model best_model.h5 --feedback_dir feedback --output best_model_feedback.h5
+
+How it works:
+ - POST /feedback (image + correct label) stores the image's pooled embedding
+   and the label as one line of <feedback_dir>/corrections.jsonl. Nothing else
+   happens on the request path
+ - A background thread wakes every FEEDBACK_INTERVAL seconds. Once at least
+   FEEDBACK_MIN_NEW new corrections have arrived, it refits only the dense head
+   (embeddings.fit_head, starting from the live head) on the cached train-split
+   embeddings plus every correction. Corrections are weighted FEEDBACK_WEIGHT x
+ - The candidate head is kept only if its accuracy on the train-split
+   embeddings drops by no more than --max_drop. It is then swapped in by
+   replacing one reference, so in-flight predictions finish on the old head.
+   The head is also saved to <feedback_dir>/head.npz, so a restart picks it up
+ - This CLI folds the saved head into a copy of the .h5 model for deployment
+"""
+import argparse
+import json
+import threading
+import time
+from pathlib import Path
+import numpy as np
+
+CLASS_NAMES = ["Clean", "Dirty"]
+
+class FeedbackStore:
+    """Append-only corrections log: {"time", "label", "predicted", "embedding"} per line."""
+
+    def __init__(self, feedback_dir):
+        self.dir = Path(feedback_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.path = self.dir / "corrections.jsonl"
+        self._lock = threading.Lock()
+        # Counted once here and kept up to date by add(), so len() never rereads the log
+        self._count = 0
+        if self.path.exists():
+            with open(self.path) as f:
+                self._count = sum(1 for line in f if line.strip())
+
+    def add(self, embedding, label, predicted=None):
+        record = {"time": time.time(), "label": int(label), "predicted": predicted,
+                  "embedding": np.asarray(embedding, dtype=np.float32).round(6).tolist()}
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            self._count += 1
+
+    def load(self):
+        """(X float32 [N, D], y int [N]) of every stored correction."""
+        X, y = [], []
+        with self._lock:
+            if self.path.exists():
+                with open(self.path) as f:
+                    for line in f:
+                        if line.strip():
+                            record = json.loads(line)
+                            X.append(record["embedding"])
+                            y.append(record["label"])
+        return np.asarray(X, dtype=np.float32), np.asarray(y, dtype=np.int64)
+
+    def __len__(self):
+        with self._lock:
+            return self._count
+
+def save_head(weights, path, fingerprint=None, **info):
+    np.savez(path, **weights, fingerprint=np.array(fingerprint or ""), info=np.array(json.dumps(info)))
+
+def load_head(path, fingerprint=None):
+    """Weights dict from save_head(), or None if missing or saved for another backbone."""
+    if not Path(path).exists():
+        return None
+    with np.load(path) as data:
+        if fingerprint and str(data["fingerprint"]) not in ("", fingerprint):
+            print(f"[WARN] {path} belongs to a different backbone; ignoring it")
+            return None
+        return {k: data[k] for k in ("W1", "b1", "W2", "b2")}
+
+def head_version(path):
+    """Version save_head() recorded in path (0 if none), so versions keep counting across restarts."""
+    if not Path(path).exists():
+        return 0
+    with np.load(path) as data:
+        return int(json.loads(str(data["info"])).get("version", 0))
+
+class HeadUpdater:
+    """Holds the live head and refits it from feedback in a daemon thread."""
+
+    def __init__(self, head, store, base_X=None, base_y=None, fingerprint=None, interval=300, min_new=5,
+                 feedback_weight=5.0, epochs=40, max_drop=0.05, version=0):
+        self.head = head
+        self.store = store
+        self.base_X = np.zeros((0, len(head["W1"])), np.float32) if base_X is None else base_X
+        self.base_y = np.zeros(0, np.int64) if base_y is None else base_y
+        self.fingerprint = fingerprint
+        self.interval = interval
+        self.min_new = min_new
+        self.feedback_weight = feedback_weight
+        self.epochs = epochs
+        self.max_drop = max_drop
+        self.version = version
+        self.trained_on = len(store)
+        self.last_update = None
+        # Guards head/version/trained_on: adopt() can run while update() is fitting
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def predict(self, features):
+        from embeddings import predict_head
+        return predict_head(self.head, features)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="head-updater", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.update()
+            except Exception as e:
+                print(f"[WARN] Head update failed: {e}")
+
+    def update(self, force=False):
+        """Refit on base + corrections; swap the head in if it passes the check."""
+        from embeddings import fit_head
+        Xf, yf = self.store.load()
+        with self._lock:
+            head, version = self.head, self.version
+            new = len(yf) - self.trained_on
+        if not len(yf) or (new < self.min_new and not force):
+            return self.last_update
+        X = np.concatenate([self.base_X, Xf]) if len(self.base_X) else Xf
+        y = np.concatenate([self.base_y, yf])
+        weight = np.concatenate([np.ones(len(self.base_y)), np.full(len(yf), self.feedback_weight)])
+        start = time.perf_counter()
+        candidate = fit_head(X, y, units=len(head["b1"]), epochs=self.epochs, init=head,
+                             sample_weight=weight, seed=version + 1)
+        result = {"corrections": int(len(yf)), "new": int(new), "seconds": time.perf_counter() - start,
+                  "feedback_accuracy": self._accuracy(candidate, Xf, yf)}
+        if len(self.base_y):
+            result["base_accuracy_before"] = self._accuracy(head, self.base_X, self.base_y)
+            result["base_accuracy_after"] = self._accuracy(candidate, self.base_X, self.base_y)
+        result["accepted"] = not len(self.base_y) or \
+            result["base_accuracy_after"] >= result["base_accuracy_before"] - self.max_drop
+        with self._lock:
+            if self.version != version:
+                # A head was adopted while this one was fitting from the old one: drop it
+                result["accepted"], result["stale"] = False, True
+            else:
+                self.trained_on = len(yf)
+            if result["accepted"]:
+                self.head = candidate
+                self.version += 1
+                save_head(candidate, self.store.dir / "head.npz", self.fingerprint, version=self.version,
+                          corrections=int(len(yf)))
+            result["version"] = self.version
+        self.last_update = result
+        print(f"[INFO] Head update {'accepted' if result['accepted'] else 'rejected'}: {result}")
+        return result
+
+    def adopt(self, head):
+        """Serve `head` (e.g. from a hot-swapped model on the same backbone) and persist it."""
+        with self._lock:
+            self.head = head
+            self.version += 1
+            save_head(head, self.store.dir / "head.npz", self.fingerprint, version=self.version, adopted=True)
+
+    @staticmethod
+    def _accuracy(head, X, y):
+        from embeddings import predict_head
+        return float(((predict_head(head, X) >= 0.5) == y).mean()) if len(y) else None
+
+    def status(self):
+        with self._lock:
+            version, trained_on = self.version, self.trained_on
+        return {"version": version, "corrections": len(self.store), "trained_on": trained_on,
+                "min_new": self.min_new, "interval_s": self.interval, "last_update": self.last_update}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="best_model.h5")
+    parser.add_argument("--feedback_dir", default="feedback")
+    parser.add_argument("--output", default="best_model_feedback.h5")
+    args = parser.parse_args()
+
+    from tensorflow.keras.models import load_model
+    from tensorflow.keras.optimizers import Adam
+    from embeddings import set_head_weights
+    from multi_head import backbone_fingerprint
+    model = load_model(args.model, compile=False)
+    head = load_head(Path(args.feedback_dir) / "head.npz", backbone_fingerprint(model))
+    if head is None:
+        raise SystemExit(f"No usable head.npz in {args.feedback_dir}")
+    set_head_weights(model, head)
+    model.compile(optimizer=Adam(1e-4), loss='binary_crossentropy', metrics=['accuracy'])
+    model.save(args.output)
+    print(f"[INFO] Saved {args.output} with the feedback-trained head "
+          f"({len(FeedbackStore(args.feedback_dir))} corrections)")
+
+if __name__ == "__main__":
+    main()
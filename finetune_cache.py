@@ -0,0 +1,134 @@
+"""
+finetune_cache.py
+-----------------
+Progressive fine-tuning of the top K MobileNetV2 blocks on cached activations.
+
+Usage:
+    python train_model.py --epochs 10 --finetune_blocks 3 --finetune_epochs 5
+
+With only the top K inverted-residual blocks unfrozen, everything below the cut
+point gives the same output for the same input image. The frozen prefix is
+therefore run once per (augmented) training image, and its activations are
+stored in .npy memmaps. Each fine-tuning step then runs forward and backward
+through the trainable suffix only. The suffix shares its layers with the
+full model, so the full model is fine-tuned in place.
+
+aug_passes controls how many augmented copies of the training set are cached
+(one fresh ImageDataGenerator pass each); more passes give more augmentation
+variety at the cost of cache size.
+"""
+import json
+import time
+from pathlib import Path
+import numpy as np
+from tensorflow import keras
+from tensorflow.keras.optimizers import Adam
+from model_utils import set_backbone_trainable, split_at, top_blocks_cut_layer
+
+class ArraySequence(keras.utils.Sequence):
+    """Batches from (memory-mapped) feature/label arrays, reshuffled every epoch."""
+
+    def __init__(self, x, y, batch_size=16, shuffle=True, seed=None):
+        super().__init__()
+        self.x, self.y = x, y
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.order = np.arange(len(x))
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(len(self.x) / self.batch_size))
+
+    def __getitem__(self, idx):
+        # Sorted row order keeps memmap reads mostly sequential
+        rows = np.sort(self.order[idx * self.batch_size:(idx + 1) * self.batch_size])
+        return np.asarray(self.x[rows], dtype=np.float32), np.asarray(self.y[rows], dtype=np.float32)
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.order)
+
+def cache_activations(prefix, flow, out_path, passes=1):
+    """Run prefix over `passes` epochs of flow into <out_path>.x.npy / .y.npy memmaps."""
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    n = flow.samples * passes
+    x = np.lib.format.open_memmap(str(out_path) + ".x.npy", mode="w+", dtype=np.float32,
+                                  shape=(n,) + tuple(prefix.output_shape[1:]))
+    y = np.lib.format.open_memmap(str(out_path) + ".y.npy", mode="w+", dtype=np.float32, shape=(n,))
+    i = 0
+    for _ in range(passes):
+        for b in range(len(flow)):
+            xb, yb = flow[b]
+            k = len(xb)
+            x[i:i + k] = prefix.predict_on_batch(xb)
+            y[i:i + k] = yb
+            i += k
+        flow.on_epoch_end()
+    x.flush(); y.flush()
+    return np.load(str(out_path) + ".x.npy", mmap_mode="r")[:i], np.load(str(out_path) + ".y.npy", mmap_mode="r")[:i]
+
+def _time_full_network_epoch(model, train_flow, lr, top_blocks):
+    """Seconds for one epoch of ordinary full-network fine-tuning, on a throwaway clone."""
+    clone = keras.models.clone_model(model)
+    clone.set_weights(model.get_weights())
+    set_backbone_trainable(clone, top_blocks)
+    clone.compile(optimizer=Adam(lr), loss='binary_crossentropy', metrics=['accuracy'])
+    steps = len(train_flow)
+    clone.fit(train_flow, epochs=1, steps_per_epoch=1, verbose=0)  # trace the train step
+    start = time.perf_counter()
+    clone.fit(train_flow, epochs=1, steps_per_epoch=steps, verbose=0)
+    return time.perf_counter() - start
+
+def finetune_top_blocks(model, train_flow, val_flow, top_blocks=3, epochs=5, lr=1e-5,
+                        cache_dir="finetune_cache", aug_passes=2, batch_size=16, measure_baseline=True,
+                        callbacks=None):
+    """Fine-tune the top K blocks of model in place on cached prefix activations.
+
+    Returns a report dict with cache build time, per-epoch suffix time, and
+    (if measure_baseline) the per-epoch time and speedup against full-network
+    fine-tuning of the same blocks.
+    """
+    cut = top_blocks_cut_layer(model, top_blocks)
+    set_backbone_trainable(model, top_blocks)
+    prefix, suffix = split_at(model, cut)
+    print(f"[INFO] Fine-tuning top {top_blocks} blocks; caching activations at '{cut}' {prefix.output_shape[1:]}")
+
+    start = time.perf_counter()
+    x_train, y_train = cache_activations(prefix, train_flow, Path(cache_dir) / "train", passes=aug_passes)
+    x_val, y_val = cache_activations(prefix, val_flow, Path(cache_dir) / "val", passes=1)
+    cache_seconds = time.perf_counter() - start
+
+    suffix.compile(optimizer=Adam(lr), loss='binary_crossentropy', metrics=['accuracy'])
+    train_seq = ArraySequence(x_train, y_train, batch_size=batch_size)
+    val_seq = ArraySequence(x_val, y_val, batch_size=batch_size, shuffle=False)
+    # One augmented pass of the train set per epoch, the same number of images a
+    # full-network epoch sees
+    steps = max(1, int(np.ceil(len(x_train) / aug_passes / batch_size)))
+    epoch_times = []
+    timer = keras.callbacks.LambdaCallback(
+        on_epoch_begin=lambda e, logs: epoch_times.append(time.perf_counter()),
+        on_epoch_end=lambda e, logs: epoch_times.__setitem__(-1, time.perf_counter() - epoch_times[-1]))
+    history = suffix.fit(train_seq, epochs=epochs, steps_per_epoch=steps, validation_data=val_seq,
+                         callbacks=[timer] + list(callbacks or []), verbose=1)
+
+    report = {
+        "top_blocks": top_blocks,
+        "cut_layer": cut,
+        "cached_images": int(len(x_train)),
+        "cache_build_s": cache_seconds,
+        # Epoch 0 includes tf.function tracing
+        "suffix_epoch_s": float(np.median(epoch_times[1:] if len(epoch_times) > 1 else epoch_times)),
+    }
+    if measure_baseline:
+        report["full_network_epoch_s"] = _time_full_network_epoch(model, train_flow, lr, top_blocks)
+        report["speedup_per_epoch"] = report["full_network_epoch_s"] / max(report["suffix_epoch_s"], 1e-9)
+        print(f"[INFO] Per-epoch: cached suffix {report['suffix_epoch_s']:.2f}s vs full network "
+              f"{report['full_network_epoch_s']:.2f}s -> {report['speedup_per_epoch']:.1f}x "
+              f"(one-time cache build {cache_seconds:.1f}s)")
+    return history, report
+
+def save_report(report, path="finetune_report.json"):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
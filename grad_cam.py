@@ -0,0 +1,149 @@
+"""
+grad_cam.py
+-----------
+Grad-CAM heatmaps for the train_model.py classifier, for web_app.py and
+api_server.py (POST /explain).
+
+Usage:
+    python grad_cam.py --model best_model.h5 --image sample.jpg --out sample_cam.png
+    python grad_cam.py --model best_model.h5 --benchmark --data_dir "data/water images"
+
+How it works:
+ - GradCAM builds one Keras model from the input to [last feature map (the
+   input of the global pooling layer), prediction] when it is created, not per
+   request
+ - The gradient step is a tf.function with input signature [None, H, W, 3],
+   so it is traced once and reused for any batch size. It differentiates the
+   Dirty logit (log p - log(1 - p), so a saturated sigmoid does not flatten
+   the gradients) w.r.t. the feature map, weights each channel by its mean
+   gradient, keeps the positive part and normalises every map to [0, 1]
+ - overlay() colours the map (NumPy jet colormap, no matplotlib needed when
+   serving), upsamples it to the photo and alpha-blends it
+ - --benchmark times plain predict (as /predict does it), compiled Grad-CAM at
+   batch 1 and 8, and the naive version that builds a sub-model and a
+   GradientTape on every call
+"""
+import argparse
+import io
+import time
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+from tensorflow import keras
+from model_utils import pooling_layer
+
+class GradCAM:
+    def __init__(self, model, layer_name=None):
+        feature_map = model.get_layer(layer_name).output if layer_name else pooling_layer(model).input
+        self.grad_model = keras.Model(model.inputs, [feature_map, model.output])
+        self.img_size = (model.input_shape[2], model.input_shape[1])
+        self._compute = tf.function(self._cam, input_signature=[
+            tf.TensorSpec([None, model.input_shape[1], model.input_shape[2], 3], tf.float32)])
+
+    def _cam(self, images):
+        with tf.GradientTape() as tape:
+            features, probs = self.grad_model(images, training=False)
+            p = tf.clip_by_value(probs[:, 0], 1e-7, 1 - 1e-7)
+            logit = tf.math.log(p) - tf.math.log1p(-p)
+        grads = tape.gradient(logit, features)
+        weights = tf.reduce_mean(grads, axis=(1, 2), keepdims=True)
+        cam = tf.nn.relu(tf.reduce_sum(weights * features, axis=-1))
+        cam = cam / (tf.reduce_max(cam, axis=(1, 2), keepdims=True) + 1e-8)
+        return cam, probs[:, 0]
+
+    def to_array(self, images):
+        return np.stack([np.asarray(im.resize(self.img_size), dtype=np.float32) / 255.0 for im in images])
+
+    def explain(self, images):
+        """(heatmaps [N, h, w] in [0, 1], P(Dirty) [N]) for RGB PIL images or a float batch."""
+        batch = images if isinstance(images, np.ndarray) else self.to_array(images)
+        cam, probs = self._compute(tf.convert_to_tensor(batch, tf.float32))
+        return cam.numpy(), probs.numpy()
+
+def jet(x):
+    """[..., 3] uint8 jet colours for values in [0, 1]."""
+    x = np.clip(x, 0.0, 1.0)[..., None]
+    rgb = np.clip(1.5 - np.abs(4.0 * x - np.array([3.0, 2.0, 1.0])), 0.0, 1.0)
+    return (rgb * 255).astype(np.uint8)
+
+def overlay(img, cam, alpha=0.45, max_side=640):
+    """Heatmap blended over the photo (downscaled to max_side) as a PIL image."""
+    img = img.convert("RGB")
+    scale = min(1.0, max_side / max(img.size))
+    base = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))))
+    heat = Image.fromarray((cam * 255).astype(np.uint8)).resize(base.size, Image.BILINEAR)
+    colored = Image.fromarray(jet(np.asarray(heat, dtype=np.float32) / 255.0))
+    return Image.blend(base, colored, alpha)
+
+def to_png(img):
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+def naive_grad_cam(model, batch):
+    """Per-request version: new sub-model + GradientTape every call (benchmark baseline)."""
+    grad_model = keras.Model(model.inputs, [pooling_layer(model).input, model.output])
+    x = tf.convert_to_tensor(batch)
+    with tf.GradientTape() as tape:
+        features, probs = grad_model(x)
+        p = tf.clip_by_value(probs[:, 0], 1e-7, 1 - 1e-7)
+        logit = tf.math.log(p) - tf.math.log1p(-p)
+    grads = tape.gradient(logit, features)
+    cam = tf.nn.relu(tf.reduce_sum(tf.reduce_mean(grads, axis=(1, 2), keepdims=True) * features, axis=-1))
+    return (cam / (tf.reduce_max(cam, axis=(1, 2), keepdims=True) + 1e-8)).numpy()
+
+def _time_ms(fn, runs):
+    fn()
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.percentile(times, 50)), float(np.percentile(times, 95))
+
+def benchmark(model, images, runs=20):
+    cam = GradCAM(model)
+    one, eight = cam.to_array(images[:1]), cam.to_array((images * 8)[:8])
+    rows = [
+        ("predict (as /predict)", 1, _time_ms(lambda: model.predict(one, verbose=0), runs)),
+        ("grad-cam compiled", 1, _time_ms(lambda: cam.explain(one), runs)),
+        ("grad-cam compiled", 8, _time_ms(lambda: cam.explain(eight), runs)),
+        ("grad-cam naive", 1, _time_ms(lambda: naive_grad_cam(model, one), max(3, runs // 4))),
+    ]
+    np.testing.assert_allclose(cam.explain(one)[0], naive_grad_cam(model, one), atol=1e-4)
+    return [{"method": m, "batch": b, "ms_p50": p50, "ms_p95": p95, "ms_per_image": p50 / b} for m, b, (p50, p95) in rows]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="best_model.h5")
+    parser.add_argument("--image", default=None, help="Photo to explain")
+    parser.add_argument("--out", default="grad_cam.png")
+    parser.add_argument("--benchmark", action="store_true", help="Latency of predict vs Grad-CAM")
+    parser.add_argument("--data_dir", default="data/water images", help="Benchmark images (test split)")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    model = keras.models.load_model(args.model, compile=False)
+    if args.image:
+        with Image.open(args.image) as im:
+            img = im.convert("RGB")
+        heatmaps, probs = GradCAM(model).explain([img])
+        overlay(img, heatmaps[0]).save(args.out)
+        print(f"[INFO] P(Dirty) = {probs[0]:.3f}; saved {args.out}")
+    if args.benchmark:
+        from shard_dataset import collect_split_files
+        images = []
+        for path, _ in collect_split_files("test", args.data_dir)[:8]:
+            with Image.open(path) as im:
+                images.append(im.convert("RGB"))
+        rows = benchmark(model, images, args.runs)
+        print("\n" + "=" * 60)
+        print("GRAD-CAM LATENCY")
+        print("=" * 60)
+        print(f"{'method':<24} {'batch':>5} {'p50 ms':>9} {'p95 ms':>9} {'ms/image':>9}")
+        for r in rows:
+            print(f"{r['method']:<24} {r['batch']:>5} {r['ms_p50']:>9.1f} {r['ms_p95']:>9.1f} {r['ms_per_image']:>9.1f}")
+        print("=" * 60)
+
+if __name__ == "__main__":
+    main()
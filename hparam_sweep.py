@@ -0,0 +1,256 @@
+"""
+hparam_sweep.py
+---------------
+Parallel hyperparameter sweep over the train_model.py classifier.
+
+Usage:
+    python hparam_sweep.py --space sweep_space.json --mode grid --parallel 4 --threads_per_trial 8
+    python hparam_sweep.py --space sweep_space.json --mode random --trials 20 --epochs 8
+    python hparam_sweep.py --space sweep_space.json --mode halving --trials 27 --min_epochs 1 --eta 3
+
+Search space (JSON). A list means "choose one of"; {"loguniform": [a, b]} or
+{"uniform": [a, b]} ranges are allowed in random/halving mode:
+    {
+      "lr": {"loguniform": [1e-5, 1e-3]},
+      "dropout": [0.2, 0.3, 0.5],
+      "dense_dropout": [0.1, 0.2],
+      "dense_units": [64, 128, 256],
+      "batch_size": [8, 16, 32],
+      "unfreeze_blocks": [0, 2, 4]
+    }
+
+This script:
+ - Decodes the train split once into shard_dataset.py shards; every trial
+   memory-maps the same files, so they share one copy in the page cache
+ - Runs trials in a spawn-based process pool, each limited to
+   --threads_per_trial TensorFlow/OpenMP threads
+ - grid/random: stops a trial early when its best val_accuracy falls below the
+   median of other trials at the same epoch (median stopping rule)
+ - halving: successive halving; every rung keeps the top 1/eta trials and
+   resumes them from their last checkpoint with eta times the epoch budget
+ - Writes <sweep_dir>/leaderboard.json and .csv with the best checkpoint,
+   epochs run and wall-clock seconds of every trial
+"""
+import argparse
+import csv
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+DEFAULTS = {"lr": 1e-4, "dropout": 0.3, "dense_dropout": 0.2, "dense_units": 128, "batch_size": 16, "unfreeze_blocks": 0}
+
+def sample_value(spec, rng):
+    if isinstance(spec, list):
+        return rng.choice(spec)
+    if isinstance(spec, dict) and "loguniform" in spec:
+        lo, hi = spec["loguniform"]
+        return float(math.exp(rng.uniform(math.log(lo), math.log(hi))))
+    if isinstance(spec, dict) and "uniform" in spec:
+        return float(rng.uniform(*spec["uniform"]))
+    return spec
+
+def make_trials(space, mode, n_trials, seed=0):
+    if mode == "grid":
+        for key, spec in space.items():
+            if not isinstance(spec, list):
+                raise ValueError(f"grid mode needs a list of values for '{key}'")
+        keys = list(space)
+        return [dict(DEFAULTS, **dict(zip(keys, values))) for values in itertools.product(*(space[k] for k in keys))]
+    rng = random.Random(seed)
+    return [dict(DEFAULTS, **{k: sample_value(v, rng) for k, v in space.items()}) for _ in range(n_trials)]
+
+def _init_worker(threads):
+    # Runs in a fresh (spawned) process before TensorFlow is imported
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "2"
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(2)
+
+def _median_stopper(progress_path, trial_id, min_epochs, min_trials=3):
+    """Keras callback: stop when this trial's best val_accuracy so far is below the
+    median best of other trials at the same epoch."""
+    from tensorflow import keras
+    best = {"acc": 0.0}
+
+    def on_epoch_end(epoch, logs):
+        best["acc"] = max(best["acc"], float(logs.get("val_accuracy", 0.0)))
+        with open(progress_path, "a") as f:
+            f.write(json.dumps({"trial": trial_id, "epoch": epoch, "best": best["acc"]}) + "\n")
+        if epoch + 1 < min_epochs:
+            return
+        others = []
+        with open(progress_path) as f:
+            for line in f:
+                r = json.loads(line)
+                if r["trial"] != trial_id and r["epoch"] == epoch:
+                    others.append(r["best"])
+        if len(others) >= min_trials and best["acc"] < sorted(others)[len(others) // 2]:
+            print(f"[SWEEP] trial {trial_id} below median at epoch {epoch}, stopping")
+            callback.model.stop_training = True
+            callback.stopped_early = True
+
+    callback = keras.callbacks.LambdaCallback(on_epoch_end=on_epoch_end)
+    callback.stopped_early = False
+    return callback
+
+def run_trial(trial_id, params, shard_dir, trial_dir, epochs, initial_epoch=0, weights="imagenet",
+              progress_path=None, min_epochs=2, best_so_far=None):
+    """Train one configuration (resuming from trial_dir/last.h5 when initial_epoch > 0)."""
+    from tensorflow import keras
+    from tensorflow.keras.models import load_model
+    from tensorflow.keras.optimizers import Adam
+    from model_utils import set_backbone_trainable
+    from train_model import build_model, prepare_generators
+
+    start = time.perf_counter()
+    trial_dir = Path(trial_dir)
+    trial_dir.mkdir(parents=True, exist_ok=True)
+    train_flow, val_flow = prepare_generators(".", batch_size=int(params["batch_size"]), shard_dir=shard_dir)
+    if initial_epoch > 0:
+        model = load_model(trial_dir / "last.h5")
+    else:
+        model = build_model(lr=params["lr"], weights=weights, dense_units=int(params["dense_units"]),
+                            dropout=params["dropout"], dense_dropout=params["dense_dropout"])
+        if params["unfreeze_blocks"]:
+            set_backbone_trainable(model, int(params["unfreeze_blocks"]))
+            model.compile(optimizer=Adam(params["lr"]), loss='binary_crossentropy', metrics=['accuracy'])
+    callbacks = [
+        keras.callbacks.ModelCheckpoint(str(trial_dir / "best.h5"), monitor='val_accuracy', save_best_only=True,
+                                        initial_value_threshold=best_so_far),
+        keras.callbacks.ModelCheckpoint(str(trial_dir / "last.h5")),
+    ]
+    stopper = None
+    if progress_path:
+        stopper = _median_stopper(progress_path, trial_id, min_epochs)
+        callbacks.append(stopper)
+    history = model.fit(train_flow, epochs=epochs, initial_epoch=initial_epoch,
+                        steps_per_epoch=max(1, train_flow.samples // train_flow.batch_size),
+                        validation_data=val_flow, validation_steps=max(1, val_flow.samples // val_flow.batch_size),
+                        callbacks=callbacks, verbose=0)
+    val_acc = history.history.get("val_accuracy", [0.0])
+    return {
+        "trial": trial_id,
+        "params": params,
+        "best_val_accuracy": float(max(val_acc)),
+        "final_val_loss": float(history.history.get("val_loss", [float("nan")])[-1]),
+        "epochs_run": initial_epoch + len(val_acc),
+        "stopped_early": bool(stopper and stopper.stopped_early),
+        "seconds": time.perf_counter() - start,
+        "best_checkpoint": str(trial_dir / "best.h5"),
+    }
+
+def run_sweep(trials, args, shard_dir):
+    sweep_dir = Path(args.sweep_dir)
+    ctx = multiprocessing.get_context("spawn")
+    pool = ProcessPoolExecutor(max_workers=args.parallel, mp_context=ctx,
+                               initializer=_init_worker, initargs=(args.threads_per_trial,))
+    results = {}
+    with pool:
+        if args.mode in ("grid", "random"):
+            progress = sweep_dir / "progress.jsonl"
+            progress.unlink(missing_ok=True)
+            futures = [pool.submit(run_trial, i, p, shard_dir, sweep_dir / f"trial_{i:03d}", args.epochs,
+                                   0, args.weights, str(progress), args.min_epochs) for i, p in enumerate(trials)]
+            for f in futures:
+                r = f.result()
+                results[r["trial"]] = r
+                print(f"[SWEEP] trial {r['trial']}: val_acc {r['best_val_accuracy']:.3f} in {r['seconds']:.0f}s")
+        else:
+            alive = list(range(len(trials)))
+            budget, done_epochs = args.min_epochs, 0
+            while alive:
+                print(f"[SWEEP] rung: {len(alive)} trials to {budget} epochs")
+                futures = [pool.submit(run_trial, i, trials[i], shard_dir, sweep_dir / f"trial_{i:03d}", budget,
+                                       done_epochs, args.weights, None, args.min_epochs,
+                                       results[i]["best_val_accuracy"] if i in results else None) for i in alive]
+                for f in futures:
+                    r = f.result()
+                    prev = results.get(r["trial"])
+                    if prev:
+                        r["seconds"] += prev["seconds"]
+                        r["best_val_accuracy"] = max(r["best_val_accuracy"], prev["best_val_accuracy"])
+                    results[r["trial"]] = r
+                if budget >= args.epochs:
+                    break
+                keep = max(1, len(alive) // args.eta)
+                alive = sorted(alive, key=lambda i: -results[i]["best_val_accuracy"])[:keep]
+                done_epochs, budget = budget, min(args.epochs, budget * args.eta)
+            for r in results.values():
+                r["stopped_early"] = r["epochs_run"] < args.epochs
+    return sorted(results.values(), key=lambda r: (-r["best_val_accuracy"], r["final_val_loss"]))
+
+def write_leaderboard(board, sweep_dir):
+    with open(Path(sweep_dir) / "leaderboard.json", "w") as f:
+        json.dump(board, f, indent=2)
+    keys = list(DEFAULTS)
+    with open(Path(sweep_dir) / "leaderboard.csv", "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["rank", "trial", "best_val_accuracy", "final_val_loss", "epochs_run", "stopped_early",
+                    "seconds", "best_checkpoint"] + keys)
+        for rank, r in enumerate(board, 1):
+            w.writerow([rank, r["trial"], f"{r['best_val_accuracy']:.4f}", f"{r['final_val_loss']:.4f}", r["epochs_run"],
+                        r["stopped_early"], f"{r['seconds']:.1f}", r["best_checkpoint"]] + [r["params"][k] for k in keys])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", default="data/water images")
+    parser.add_argument("--manifest", default=None, help="dataset_manifest.py output to read the train file list from")
+    parser.add_argument("--space", required=True, help="JSON search space")
+    parser.add_argument("--mode", choices=["grid", "random", "halving"], default="grid")
+    parser.add_argument("--trials", type=int, default=10, help="Number of sampled trials (random/halving)")
+    parser.add_argument("--epochs", type=int, default=10, help="Max epochs per trial")
+    parser.add_argument("--min_epochs", type=int, default=2, help="Epochs before early stopping / first halving rung")
+    parser.add_argument("--eta", type=int, default=3, help="Successive halving reduction factor")
+    parser.add_argument("--parallel", type=int, default=max(1, (os.cpu_count() or 1) // 4), help="Concurrent trials")
+    parser.add_argument("--threads_per_trial", type=int, default=4)
+    parser.add_argument("--sweep_dir", default="sweep")
+    parser.add_argument("--weights", default="imagenet", help="'imagenet' or 'none'")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.weights == "none":
+        args.weights = None
+
+    with open(args.space) as f:
+        space = json.load(f)
+    trials = make_trials(space, args.mode, args.trials, seed=args.seed)
+    sweep_dir = Path(args.sweep_dir)
+    sweep_dir.mkdir(parents=True, exist_ok=True)
+
+    # Decode once; every trial memory-maps these shards
+    from shard_dataset import collect_split_files, pack_split
+    shard_dir = sweep_dir / "shards"
+    if not (shard_dir / "train" / "index.json").exists():
+        files = collect_split_files("train", args.data_dir, args.manifest)
+        pack_split(files, shard_dir / "train")
+    if args.weights == "imagenet":
+        from tensorflow.keras.applications import MobileNetV2
+        MobileNetV2(weights="imagenet", include_top=False, input_shape=(224, 224, 3))  # download once
+
+    print(f"[SWEEP] {len(trials)} trials ({args.mode}), {args.parallel} at a time x {args.threads_per_trial} threads")
+    start = time.perf_counter()
+    board = run_sweep(trials, args, str(shard_dir))
+    write_leaderboard(board, sweep_dir)
+
+    print("\n" + "=" * 78)
+    print(f"LEADERBOARD ({time.perf_counter() - start:.0f}s wall clock)")
+    print("=" * 78)
+    for rank, r in enumerate(board[:10], 1):
+        p = r["params"]
+        print(f"{rank:>2}. trial {r['trial']:>3}  val_acc {r['best_val_accuracy']:.3f}  {r['epochs_run']:>2} ep  "
+              f"{r['seconds']:>6.0f}s  lr={p['lr']:.1e} drop={p['dropout']}/{p['dense_dropout']} "
+              f"units={p['dense_units']} bs={p['batch_size']} unfreeze={p['unfreeze_blocks']}"
+              + ("  (stopped)" if r["stopped_early"] else ""))
+    print(f"Best checkpoint: {board[0]['best_checkpoint']}")
+    print(f"Saved {sweep_dir / 'leaderboard.json'} and {sweep_dir / 'leaderboard.csv'}")
+
+if __name__ == "__main__":
+    main()
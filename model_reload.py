@@ -0,0 +1,228 @@
+"""
+model_reload.py
+---------------
+Zero-downtime model hot swap for api_server.py.
+
+Usage:
+    MODEL_WATCH_INTERVAL=10 python api_server.py      # reload when MODEL_PATH changes on disk
+    curl -X POST -H "X-Admin-Token: $ADMIN_TOKEN" localhost:5555/admin/reload
+    curl -X POST -H "X-Admin-Token: $ADMIN_TOKEN" -d path=pruned_model.h5 localhost:5555/admin/reload
+    curl -X POST -H "X-Admin-Token: $ADMIN_TOKEN" -d path=v2.h5 -d watch=1 localhost:5555/admin/reload
+
+How it works:
+ - Everything derived from a model (input size, backbone/head split,
+   fingerprint, comparison heads) lives in one ServedModel. Each request reads
+   ModelReloader.current once and uses that object to the end, so a swap never
+   changes the model under a request in flight
+ - A reload runs in a background thread (reniced, though TF's own pools are
+   not). It loads the new file, warms it (the first predict() call traces the
+   graph) and runs the canary images through it. Only if they pass is `current` replaced, which is
+   a single reference assignment. on_swap (e.g. the feedback head) runs before
+   that assignment, so no request sees the new model with the old derived state
+ - Canaries come from CANARY_DIR (default: the test split). The new model is
+   rejected if any output is not a probability, or if its agreement with the
+   current model or its accuracy on labeled canaries is below
+   RELOAD_MIN_AGREEMENT / RELOAD_MIN_ACCURACY (default 0, i.e. report only)
+ - The watcher polls the file's size and mtime and only loads a file that has
+   been unchanged for one poll. Copying the new model next to the old one and
+   renaming it into place (mv) is the safest way to deploy. Loading another
+   path through /admin/reload does not move the watcher off MODEL_PATH unless
+   watch=1 is sent
+"""
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+def lower_thread_priority(niceness=10):
+    """Renice the calling thread (Linux gives every thread its own nice value).
+
+    Advisory for TensorFlow work: the ops run on TF's shared thread pools,
+    which keep their normal priority."""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+    except (AttributeError, OSError):
+        pass
+
+def _file_stamp(path):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime_ns)
+
+def _file_digest(path, chunk=2 ** 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class ServedModel:
+    """A loaded model plus what the server derives from it."""
+
+    def __init__(self, path, split=False):
+        from tensorflow.keras.models import load_model
+        self.path = str(path)
+        self.stamp = _file_stamp(path)
+        # Content hash: the same file gets the same id across restarts and replicas
+        self.model_id = _file_digest(path)[:12]
+        self.model = load_model(self.path, compile=False)
+        # (width, height) for PIL; smaller variants from variant_sweep.py take e.g. 128x128
+        self.img_size = (self.model.input_shape[2], self.model.input_shape[1])
+        self.extractor = self.head = self.fingerprint = None
+        if split:
+            from embeddings import feature_extractor
+            from multi_head import backbone_fingerprint
+            self.extractor, self.head = feature_extractor(self.model)
+            self.fingerprint = backbone_fingerprint(self.model)
+        self.extras = {}
+        self.loaded_at = time.time()
+
+    def to_array(self, images):
+        """[N, H, W, 3] float32 in [0, 1] from RGB PIL images (api_server preprocessing)."""
+        return np.stack([np.asarray(im.resize(self.img_size), dtype=np.float32) / 255.0 for im in images])
+
+    def probabilities(self, images):
+        return self.model.predict(self.to_array(images), verbose=0).ravel()
+
+    def warm(self):
+        blank = [Image.new("RGB", self.img_size)]
+        self.probabilities(blank)
+        if self.extractor is not None:
+            self.head.predict_on_batch(self.extractor.predict_on_batch(self.to_array(blank)))
+
+    def describe(self):
+        return {"path": self.path, "model_id": self.model_id, "input": list(self.img_size), "loaded_at": self.loaded_at,
+                "fingerprint": self.fingerprint}
+
+def load_canaries(canary_dir, count=8):
+    """Up to `count` RGB images from canary_dir, spread over its sub-folders, with
+    labels 0/1 where a folder name starts with Clean/Dirty (else None)."""
+    if not canary_dir or not Path(canary_dir).is_dir():
+        return [], []
+    folders = {}
+    for p in sorted(Path(canary_dir).rglob("*")):
+        if p.suffix.lower() in IMAGE_EXTS:
+            folders.setdefault(p.parent, []).append(p)
+    picked = []
+    while len(picked) < count and any(folders.values()):
+        for files in folders.values():
+            if files and len(picked) < count:
+                picked.append(files.pop(0))
+    images, labels = [], []
+    for p in picked:
+        with Image.open(p) as im:
+            images.append(im.convert("RGB"))
+        name = p.parent.name.lower()
+        labels.append(0 if name.startswith("clean") else 1 if name.startswith("dirty") else None)
+    return images, labels
+
+class ModelReloader:
+    """Holds the current ServedModel and replaces it after a validated background load.
+
+    load_fn(path) -> ServedModel. on_swap(old, new) runs right before a swap.
+    """
+
+    def __init__(self, path, load_fn, canaries=((), ()), min_agreement=0.0, min_accuracy=0.0, on_swap=None):
+        self.path = str(path)
+        self.load_fn = load_fn
+        self.canary_images, self.canary_labels = canaries
+        self.min_agreement = min_agreement
+        self.min_accuracy = min_accuracy
+        self.on_swap = on_swap
+        self.current = load_fn(self.path)
+        self.current.warm()
+        self.version = 1
+        self.last_result = None
+        self._loading = threading.Lock()
+        self._rejected = None
+
+    def reload(self, path=None, background=True, watch=False):
+        """Start loading path (default: the watched file); watch=True also makes the
+        watcher follow path once it is accepted. Returns False if a load is already running."""
+        if not self._loading.acquire(blocking=False):
+            return False
+        target = str(path or self.path)
+        if background:
+            threading.Thread(target=self._reload, args=(target, watch), name="model-reload", daemon=True).start()
+        else:
+            self._reload(target, watch)
+        return True
+
+    def _reload(self, path, watch=False):
+        try:
+            lower_thread_priority()
+            start = time.perf_counter()
+            result = {"path": path, "started": time.time()}
+            try:
+                candidate = self.load_fn(path)
+                candidate.warm()
+                result.update(self.validate(candidate))
+            except Exception as e:
+                candidate, result["accepted"], result["error"] = None, False, str(e)
+            result["load_seconds"] = time.perf_counter() - start
+            if result["accepted"] and self.on_swap is not None:
+                try:
+                    self.on_swap(self.current, candidate)
+                except Exception as e:
+                    # Not swapped; recorded as a rejection so the watcher does not retry the file forever
+                    result["accepted"], result["error"] = False, f"on_swap failed: {e}"
+            if result["accepted"]:
+                self.current = candidate
+                self.version += 1
+                if watch:
+                    self.path = path
+            elif Path(path).exists():
+                self._rejected = (path, _file_stamp(path))
+            result["version"] = self.version
+            self.last_result = result
+            print(f"[INFO] Model reload {'accepted' if result['accepted'] else 'rejected'}: {result}")
+        finally:
+            self._loading.release()
+
+    def validate(self, candidate):
+        """Canary check of candidate against the current model."""
+        if not self.canary_images:
+            return {"accepted": True, "canaries": 0}
+        new = candidate.probabilities(self.canary_images)
+        old = self.current.probabilities(self.canary_images)
+        result = {"canaries": len(new), "max_abs_delta": float(np.abs(new - old).max()),
+                  "agreement": float(((new >= 0.5) == (old >= 0.5)).mean())}
+        labeled = [(p, y) for p, y in zip(new, self.canary_labels) if y is not None]
+        if labeled:
+            result["canary_accuracy"] = float(np.mean([(p >= 0.5) == y for p, y in labeled]))
+        reasons = []
+        if not np.all(np.isfinite(new)) or new.min() < 0 or new.max() > 1:
+            reasons.append("outputs are not probabilities")
+        if result["agreement"] < self.min_agreement:
+            reasons.append(f"agreement {result['agreement']:.2f} < {self.min_agreement}")
+        if result.get("canary_accuracy", 1.0) < self.min_accuracy:
+            reasons.append(f"canary accuracy {result['canary_accuracy']:.2f} < {self.min_accuracy}")
+        result["accepted"] = not reasons
+        if reasons:
+            result["reasons"] = reasons
+        return result
+
+    def start_watching(self, interval=10):
+        threading.Thread(target=self._watch, args=(interval,), name="model-watch", daemon=True).start()
+        return self
+
+    def _watch(self, interval):
+        previous = None
+        while True:
+            time.sleep(interval)
+            try:
+                stamp = _file_stamp(self.path)
+            except OSError:
+                continue  # mid-rename or removed
+            # Load only a file that has stopped changing and is not the served or a rejected one
+            if stamp == previous and stamp != self.current.stamp and (self.path, stamp) != self._rejected:
+                self.reload()
+            previous = stamp
+
+    def status(self):
+        return {"version": self.version, "current": self.current.describe(), "watching": self.path,
+                "loading": self._loading.locked(), "last_reload": self.last_result}
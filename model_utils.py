@@ -0,0 +1,86 @@
+"""
+model_utils.py
+--------------
+Helpers for working with the MobileNetV2 classifier built by train_model.build_model.
+
+build_model wires MobileNetV2's layers straight into the classifier graph, so
+the backbone is not a nested layer: model.layers[0] is the InputLayer and the
+backbone layers run from there up to GlobalAveragePooling2D. These helpers find
+and unfreeze parts of the backbone, and split the graph at a layer into a
+prefix model and a suffix model that share weights with the original.
+"""
+from tensorflow import keras
+from tensorflow.keras.layers import BatchNormalization, GlobalAveragePooling2D
+
+NUM_BLOCKS = 16  # MobileNetV2 inverted-residual blocks block_1 .. block_16
+
+def pooling_layer(model):
+    for layer in model.layers:
+        if isinstance(layer, GlobalAveragePooling2D):
+            return layer
+    raise ValueError("model has no GlobalAveragePooling2D layer")
+
+def backbone_layers(model):
+    """Layers from the input up to (excluding) the global pooling layer."""
+    layers = model.layers
+    return layers[:layers.index(pooling_layer(model))]
+
+def block_of(layer_name):
+    """Inverted-residual block number of a MobileNetV2 layer, NUM_BLOCKS + 1 for the
+    final Conv_1/out_relu stage, 0 for the stem."""
+    if layer_name.startswith("block_"):
+        return int(layer_name.split("_")[1])
+    if layer_name in ("Conv_1", "Conv_1_bn", "out_relu"):
+        return NUM_BLOCKS + 1
+    return 0
+
+def set_backbone_trainable(model, top_blocks=None, train_batchnorm=False):
+    """Unfreeze the whole backbone (top_blocks=None) or only its top K blocks.
+
+    BatchNormalization layers stay frozen (inference mode) unless
+    train_batchnorm is set; with a few dozen images their batch statistics
+    would wreck the pretrained ones. Recompile the model afterwards.
+    """
+    first = 0 if top_blocks is None else NUM_BLOCKS + 1 - top_blocks
+    for layer in backbone_layers(model):
+        trainable = block_of(layer.name) >= first and not isinstance(layer, keras.layers.InputLayer)
+        if isinstance(layer, BatchNormalization) and not train_batchnorm:
+            trainable = False
+        layer.trainable = trainable
+
+def top_blocks_cut_layer(model, top_blocks):
+    """Name of the layer whose output feeds the first of the top K blocks."""
+    if not 1 <= top_blocks <= NUM_BLOCKS:
+        raise ValueError(f"top_blocks must be between 1 and {NUM_BLOCKS}")
+    first = model.get_layer(f"block_{NUM_BLOCKS + 1 - top_blocks}_expand")
+    return first.get_input_at(0)._keras_history.layer.name
+
+def split_at(model, cut_layer_name):
+    """Split model at a layer's output into (prefix, suffix) models sharing weights.
+
+    prefix: model input -> cut layer output
+    suffix: Input(cut output shape) -> model output, built by replaying every
+    layer after the cut. Raises ValueError if a later layer reads a tensor from
+    before the cut (e.g. a skip connection across it).
+    """
+    cut = model.get_layer(cut_layer_name)
+    cut_output = cut.get_output_at(0)
+    prefix = keras.Model(model.inputs, cut_output, name=model.name + "_prefix")
+    suffix_input = keras.Input(shape=cut_output.shape[1:], name=cut_layer_name + "_features")
+    tensors = {id(cut_output): suffix_input}
+
+    def lookup(t):
+        if id(t) not in tensors:
+            raise ValueError(f"cannot split at {cut_layer_name}: a later layer reads {t.name} from before the cut")
+        return tensors[id(t)]
+
+    layers = model.layers
+    for layer in layers[layers.index(cut) + 1:]:
+        inputs = layer.get_input_at(0)
+        if isinstance(inputs, (list, tuple)):
+            out = layer([lookup(t) for t in inputs])
+        else:
+            out = layer(lookup(inputs))
+        tensors[id(layer.get_output_at(0))] = out
+    suffix = keras.Model(suffix_input, lookup(model.outputs[0]), name=model.name + "_suffix")
+    return prefix, suffix
@@ -0,0 +1,76 @@
+"""
+multi_head.py
+-------------
+Run several train_model.py classifiers on the same images with one backbone
+pass per distinct backbone.
+
+Models trained with the backbone frozen (best_model.h5, final_model.h5, A/B
+candidates that only differ in their head) carry byte-identical MobileNetV2
+weights. MultiHeadModel fingerprints each model's backbone weights, keeps a
+single feature extractor per fingerprint, and evaluates every head on the
+pooled features. Standard Dense -> Dense heads are kept as NumPy arrays
+(embeddings.predict_head), so the duplicate backbones can be freed; other head
+shapes run as the Keras suffix model. Models with a fine-tuned backbone simply
+get their own group.
+
+Used by evaluate_model.py (several --model), api_server.py (/compare with
+COMPARE_MODELS) and streamlit_app.py ("Compare both").
+"""
+import hashlib
+import numpy as np
+from model_utils import backbone_layers, pooling_layer, split_at
+
+def backbone_fingerprint(model):
+    """sha1 of the input shape and every backbone weight."""
+    h = hashlib.sha1(str(model.input_shape).encode())
+    for layer in backbone_layers(model):
+        for w in layer.get_weights():
+            h.update(np.ascontiguousarray(w).tobytes())
+    return h.hexdigest()
+
+class MultiHeadModel:
+    """models: {name: keras model or .h5 path}. predict(x) -> {name: P(Dirty) [N]}."""
+
+    def __init__(self, models):
+        from tensorflow.keras.models import load_model
+        from embeddings import get_head_weights
+        self.names = list(models)
+        self.groups = {}  # fingerprint -> {"extractor": model, "heads": {name: weights dict or suffix model}}
+        for name, model in models.items():
+            if not hasattr(model, "layers"):
+                model = load_model(model, compile=False)
+            fingerprint = backbone_fingerprint(model)
+            group = self.groups.get(fingerprint)
+            if group is None:
+                extractor, _ = split_at(model, pooling_layer(model).name)
+                group = self.groups[fingerprint] = {"extractor": extractor, "heads": {}}
+            try:
+                group["heads"][name] = get_head_weights(model)
+            except ValueError:
+                group["heads"][name] = split_at(model, pooling_layer(model).name)[1]
+        shapes = {g["extractor"].input_shape for g in self.groups.values()}
+        if len(shapes) > 1:
+            raise ValueError(f"models take different input shapes: {sorted(shapes)}")
+        self.input_shape = shapes.pop()
+        self.backbone_passes = 0
+
+    @property
+    def shared(self):
+        """True when all models share one backbone."""
+        return len(self.groups) == 1
+
+    def predict(self, x):
+        from embeddings import predict_head
+        out = {}
+        for group in self.groups.values():
+            features = group["extractor"].predict_on_batch(x)
+            self.backbone_passes += 1
+            for name, head in group["heads"].items():
+                if isinstance(head, dict):
+                    out[name] = predict_head(head, features)
+                else:
+                    out[name] = np.asarray(head.predict_on_batch(features)).ravel()
+        return {name: out[name] for name in self.names}
+
+    def describe(self):
+        return [sorted(g["heads"]) for g in self.groups.values()]
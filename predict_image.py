@@ -1,29 +1,40 @@
 #!/usr/bin/env python3
 """
 Simple script to predict water quality from an image
-Usage: python3 predict_image.py <image_path>
+Usage: python3 predict_image.py <image_path> [model_path]
+       python3 predict_image.py <image_path> [model_path] --tiles 4 [--overlap 0.25] [--aggregate max|mean|map]
 """
-import sys
+import argparse
 import numpy as np
 from PIL import Image
 from tensorflow.keras.models import load_model
 from tensorflow.keras.preprocessing.image import img_to_array
 
-IMG_SIZE = (224, 224)
-
-def predict_image(model_path, image_path):
+def predict_image(model_path, image_path, tiles=0, overlap=0.25, aggregate="max"):
     # Load model
     print(f"Loading model: {model_path}")
     model = load_model(model_path)
+    img_size = (model.input_shape[2], model.input_shape[1])
     
     # Load and preprocess image
     print(f"Loading image: {image_path}")
-    img = Image.open(image_path).convert("RGB").resize(IMG_SIZE)
-    arr = img_to_array(img) / 255.0
-    arr = np.expand_dims(arr, axis=0)
+    img = Image.open(image_path).convert("RGB")
     
     # Predict
-    prob = float(model.predict(arr, verbose=0)[0][0])
+    if tiles:
+        # Overlapping full-resolution tiles instead of one squashed image
+        from tiled_inference import tiled_predict
+        result = tiled_predict(lambda batch: model.predict_on_batch(batch).ravel(), img,
+                               img_size[1], tiles, overlap, aggregate)
+        prob = result["probability"]
+        rows, cols = result["grid"]
+        print(f"Tiles: {rows}x{cols} ({aggregate}), per tile:")
+        for row in result["tile_probabilities"]:
+            print("  " + " ".join(f"{v:.2f}" for v in row))
+    else:
+        arr = img_to_array(img.resize(img_size)) / 255.0
+        arr = np.expand_dims(arr, axis=0)
+        prob = float(model.predict(arr, verbose=0)[0][0])
     label = "Dirty" if prob >= 0.5 else "Clean"
     confidence = prob * 100 if prob >= 0.5 else (1 - prob) * 100
     
@@ -42,12 +53,13 @@ def predict_image(model_path, image_path):
     print("="*50)
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python3 predict_image.py <image_path>")
-        print("Example: python3 predict_image.py test_image.jpg")
-        sys.exit(1)
-    
-    image_path = sys.argv[1]
-    model_path = "best_model.h5"
+    parser = argparse.ArgumentParser(description="Predict water quality from an image",
+                                     epilog="Example: python3 predict_image.py test_image.jpg")
+    parser.add_argument("image_path")
+    parser.add_argument("model_path", nargs="?", default="best_model.h5")
+    parser.add_argument("--tiles", type=int, default=0, help="Tiled mode: tiles along the long side (0 = off)")
+    parser.add_argument("--overlap", type=float, default=0.25, help="Fraction shared by neighbouring tiles")
+    parser.add_argument("--aggregate", choices=["max", "mean", "map"], default="max")
+    args = parser.parse_args()
     
-    predict_image(model_path, image_path)
+    predict_image(args.model_path, args.image_path, args.tiles, args.overlap, args.aggregate)
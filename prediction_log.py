@@ -0,0 +1,149 @@
+"""
+prediction_log.py
+-----------------
+Write-behind prediction audit log for api_server.py.
+
+Usage:
+    PREDICTION_LOG=logs/requests.jsonl python api_server.py       # default path
+    PREDICTION_LOG= python api_server.py                          # disabled
+
+One JSON line per /predict:
+    {"ts", "sha1", "probability", "label", "stage", "model", "model_id", "head_version",
+     "timings_ms": {"decode", "model", "total"}}
+
+model_id is a content hash of the model file (the same across restarts and
+replicas) and head_version the FEEDBACK_DIR head that produced the
+probability (0 for the model's own head).
+
+How it works:
+ - log() only does a non-blocking put on a bounded queue (PREDICTION_LOG_QUEUE
+   records). When a burst fills it, the record is dropped and counted, and the
+   request never waits
+ - A background thread batches records and writes each batch with one write()
+   once it has PREDICTION_LOG_BATCH records or the oldest is
+   PREDICTION_LOG_FLUSH_S seconds old
+ - The file is rotated once it reaches max_bytes or is rotate_seconds old:
+   requests.jsonl -> requests.<UTC time>-<nn>.jsonl.gz (gzip, in the writer thread),
+   keeping the newest `backups` rotated files. compact_logs.py turns these
+   into a columnar store for queries
+ - close() (also run at exit) drains the queue and flushes
+"""
+import atexit
+import gzip
+import json
+import queue
+import shutil
+import threading
+import time
+from pathlib import Path
+
+_STOP = object()
+
+class PredictionLogger:
+    def __init__(self, path="logs/requests.jsonl", max_queue=10000, batch_records=500, flush_seconds=2.0,
+                 max_bytes=64 * 2 ** 20, rotate_seconds=3600, backups=48):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_records = batch_records
+        self.flush_seconds = flush_seconds
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backups = backups
+        self.counts = {"logged": 0, "written": 0, "dropped": 0, "flushes": 0, "rotations": 0, "errors": 0}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._file = None
+        self._opened_at = None
+        self._thread = threading.Thread(target=self._run, name="prediction-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, record):
+        """Queue one record; returns False (and counts a drop) if the queue is full."""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.counts["dropped"] += 1
+            return False
+        with self._lock:
+            self.counts["logged"] += 1
+        return True
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        batch, deadline, stopping = [], None, False
+        while not stopping:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+                    deadline = deadline or time.monotonic() + self.flush_seconds
+            except queue.Empty:
+                pass
+            if batch and (stopping or len(batch) >= self.batch_records or time.monotonic() >= deadline):
+                self._write(batch)
+                batch, deadline = [], None
+        if self._file is not None:
+            self._file.close()
+
+    def _write(self, batch):
+        try:
+            if self._file is not None and (self._file.tell() >= self.max_bytes
+                                           or time.time() - self._opened_at >= self.rotate_seconds):
+                self._rotate()
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+                # An existing file keeps its age across restarts: its first record's ts
+                # (ctime changes on every append, so it cannot tell the age)
+                self._opened_at = (_first_record_time(self.path) if self._file.tell() else None) or time.time()
+            self._file.write("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in batch))
+            self._file.flush()
+            with self._lock:
+                self.counts["written"] += len(batch)
+                self.counts["flushes"] += 1
+        except Exception as e:
+            print(f"[WARN] Prediction log write failed ({len(batch)} records lost): {e}")
+            with self._lock:
+                self.counts["errors"] += len(batch)
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        n = 0
+        while True:
+            rotated = self.path.with_name(f"{self.path.stem}.{stamp}-{n:02d}{self.path.suffix}.gz")
+            if not rotated.exists():
+                break
+            n += 1
+        with open(self.path, "rb") as src, gzip.open(rotated, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        self.path.unlink()
+        for old in rotated_files(self.path)[:-self.backups or None]:
+            old.unlink()
+        with self._lock:
+            self.counts["rotations"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {"path": str(self.path), "queued": self._queue.qsize(), **self.counts}
+
+def _first_record_time(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return float(json.loads(f.readline())["ts"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def rotated_files(path):
+    """Rotated, compressed logs for `path`, oldest first."""
+    path = Path(path)
+    return sorted(path.parent.glob(f"{path.stem}.*{path.suffix}.gz"))
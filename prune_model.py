@@ -0,0 +1,209 @@
+"""
+prune_model.py
+--------------
+Gradual structured (channel) pruning of the train_model.py classifier, with an
+export that physically removes the pruned channels.
+
+Usage:
+    python prune_model.py --model best_model.h5 --sparsity 0.5 --stages 4 --epochs_per_stage 2
+    python prune_model.py --model best_model.h5 --sparsity 0.7 --output pruned_model.h5
+
+What is pruned: the expansion channels of MobileNetV2's inverted-residual
+blocks 1-16 (block_N_expand -> depthwise -> block_N_project) and the 1280
+channels of the final Conv_1. Removing them leaves every block's input and
+output width, and so the residual adds, unchanged. Each layer keeps the same
+fraction of its channels, rounded up to a multiple of 8 for the CPU kernels.
+
+ - Channel importance: L1 norm of the expand (or Conv_1) filter times the
+   BatchNorm scale |gamma| / sqrt(var + eps)
+ - Gradual: sparsity rises over --stages steps on a cubic schedule
+   (s_t = s * (1 - (1 - t / stages)^3)); after each step the model is
+   fine-tuned for --epochs_per_stage epochs with the BatchNorm layers frozen
+ - Masking: a pruned channel gets BatchNorm gamma = beta = 0. With BatchNorm
+   frozen that zeroes it exactly, and keeps it zero while the convolutions train
+ - Export: the layers are rebuilt with fewer filters and sliced weights. The
+   constant a pruned channel still added through the depthwise BatchNorm
+   bias is folded into the project BatchNorm's moving mean, so the exported
+   model computes what the masked model computes
+ - Benchmarks dense vs pruned: test accuracy, latency (fresh process, see
+   variant_sweep.py), parameters and file size -> prune_report.json
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from tensorflow import keras
+from tensorflow.keras.optimizers import Adam
+from model_utils import NUM_BLOCKS, pooling_layer, set_backbone_trainable
+
+def prunable_groups(model):
+    """[(conv_name, bn_name, depthwise_name or None)] for every prunable channel group."""
+    groups = [(f"block_{i}_expand", f"block_{i}_expand_BN", f"block_{i}") for i in range(1, NUM_BLOCKS + 1)]
+    groups.append(("Conv_1", "Conv_1_bn", None))
+    names = {l.name for l in model.layers}
+    return [g for g in groups if g[0] in names]
+
+def channel_importance(model, conv_name, bn_name):
+    kernel = model.get_layer(conv_name).get_weights()[0]
+    gamma, _, _, var = model.get_layer(bn_name).get_weights()
+    eps = model.get_layer(bn_name).epsilon
+    return np.abs(kernel).sum(axis=(0, 1, 2)) * np.abs(gamma) / np.sqrt(var + eps)
+
+def keep_count(channels, sparsity, multiple=8):
+    return min(channels, max(multiple, int(math.ceil(channels * (1 - sparsity) / multiple)) * multiple))
+
+def cubic_schedule(final_sparsity, stages):
+    return [final_sparsity * (1 - (1 - t / stages) ** 3) for t in range(1, stages + 1)]
+
+def apply_masks(model, sparsity):
+    """Zero the BatchNorm gamma/beta of the least important channels. Returns
+    {conv_name: sorted kept channel indices}."""
+    keep = {}
+    for conv_name, bn_name, _ in prunable_groups(model):
+        score = channel_importance(model, conv_name, bn_name)
+        n_keep = keep_count(len(score), sparsity)
+        kept = np.sort(np.argsort(-score, kind="stable")[:n_keep])
+        bn = model.get_layer(bn_name)
+        gamma, beta, mean, var = bn.get_weights()
+        mask = np.zeros(len(score), dtype=bool)
+        mask[kept] = True
+        bn.set_weights([gamma * mask, beta * mask, mean, var])
+        keep[conv_name] = kept
+    return keep
+
+def export_pruned(model, keep):
+    """Rebuild model with the pruned channels removed and weights sliced to match."""
+    def clone_layer(layer):
+        config = layer.get_config()
+        if layer.name in keep:
+            config["filters"] = len(keep[layer.name])
+        return layer.__class__.from_config(config)
+
+    pruned = keras.models.clone_model(model, clone_function=clone_layer)
+    groups = {g[0]: g for g in prunable_groups(model)}
+    overrides = {}
+    for conv_name, kept in keep.items():
+        _, bn_name, block = groups[conv_name]
+        w = model.get_layer(conv_name).get_weights()
+        overrides[conv_name] = [w[0][..., kept]] + [b[kept] for b in w[1:]]
+        overrides[bn_name] = [v[kept] for v in model.get_layer(bn_name).get_weights()]
+        if block is None:
+            # Conv_1 feeds global pooling and the first Dense layer
+            layers = model.layers
+            dense = next(l for l in layers[layers.index(pooling_layer(model)) + 1:] if isinstance(l, keras.layers.Dense))
+            kernel, bias = dense.get_weights()
+            overrides[dense.name] = [kernel[kept], bias]
+            continue
+        dropped = np.setdiff1d(np.arange(len(model.get_layer(bn_name).get_weights()[0])), kept)
+        dw = model.get_layer(f"{block}_depthwise").get_weights()
+        overrides[f"{block}_depthwise"] = [dw[0][:, :, kept]] + [b[kept] for b in dw[1:]]
+        dbn = model.get_layer(f"{block}_depthwise_BN")
+        g, b, m, v = dbn.get_weights()
+        overrides[dbn.name] = [g[kept], b[kept], m[kept], v[kept]]
+        # A masked channel enters the depthwise conv as 0; its BatchNorm + ReLU6 turn
+        # that into a constant the project conv still sums in
+        const = np.clip(b[dropped] - g[dropped] * m[dropped] / np.sqrt(v[dropped] + dbn.epsilon), 0.0, 6.0)
+        project = model.get_layer(f"{block}_project").get_weights()
+        overrides[f"{block}_project"] = [project[0][:, :, kept]] + project[1:]
+        pbn = model.get_layer(f"{block}_project_BN")
+        pg, pb, pm, pv = pbn.get_weights()
+        pm = pm - const @ project[0][0, 0, dropped]
+        overrides[pbn.name] = [pg, pb, pm, pv]
+    for layer in pruned.layers:
+        layer.set_weights(overrides.get(layer.name, model.get_layer(layer.name).get_weights()))
+    pruned.compile(optimizer=Adam(1e-4), loss='binary_crossentropy', metrics=['accuracy'])
+    return pruned
+
+def _measure(path, images, threads):
+    from hparam_sweep import _init_worker
+    from variant_sweep import measure_variant
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx, initializer=_init_worker, initargs=(threads,)) as pool:
+        return pool.submit(measure_variant, path, images).result()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", default="data/water images")
+    parser.add_argument("--manifest", default=None, help="dataset_manifest.py output to read the file lists from")
+    parser.add_argument("--model", default="best_model.h5", help="Trained train_model.py model (dense baseline)")
+    parser.add_argument("--output", default="pruned_model.h5")
+    parser.add_argument("--sparsity", type=float, default=0.5, help="Final fraction of channels removed per layer")
+    parser.add_argument("--stages", type=int, default=4, help="Pruning steps on the way to --sparsity")
+    parser.add_argument("--epochs_per_stage", type=int, default=2, help="Recovery fine-tuning after every step")
+    parser.add_argument("--final_epochs", type=int, default=3, help="Extra fine-tuning at the final sparsity")
+    parser.add_argument("--finetune_blocks", type=int, default=None, help="Only train the top K blocks (default: whole backbone)")
+    parser.add_argument("--lr", type=float, default=1e-5)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--threads", type=int, default=1, help="CPU threads for the latency comparison")
+    args = parser.parse_args()
+
+    from tensorflow.keras.models import load_model
+    from embeddings import load_images
+    from shard_dataset import collect_split_files
+    from train_model import prepare_generators
+
+    train_files = collect_split_files("train", args.data_dir, args.manifest)
+    test_files = collect_split_files("test", args.data_dir, args.manifest)
+    train_flow, val_flow = prepare_generators(args.data_dir, batch_size=args.batch_size, files=train_files)
+    model = load_model(args.model, compile=False)
+    size = tuple(model.input_shape[1:3])
+    test_images = load_images([p for p, _ in test_files], size[::-1])
+    class_names = sorted({c for _, c in test_files})
+    y_test = np.array([class_names.index(c) for _, c in test_files])
+
+    def test_accuracy(m):
+        return float(((m.predict(test_images, verbose=0).ravel() >= 0.5) == y_test).mean())
+
+    val_counts = np.bincount(val_flow.classes, minlength=len(val_flow.class_indices)).tolist()
+    print(f"[INFO] Validation images per class: {dict(zip(val_flow.class_indices, val_counts))}")
+    report = {"config": vars(args), "validation_per_class": val_counts,
+              "dense": {"test_accuracy": test_accuracy(model)}, "stages": []}
+    set_backbone_trainable(model, args.finetune_blocks)
+    steps = max(1, train_flow.samples // train_flow.batch_size)
+    schedule = cubic_schedule(args.sparsity, args.stages)
+    for stage, sparsity in enumerate(schedule, 1):
+        keep = apply_masks(model, sparsity)
+        before = test_accuracy(model)
+        epochs = args.epochs_per_stage + (args.final_epochs if stage == len(schedule) else 0)
+        model.compile(optimizer=Adam(args.lr), loss='binary_crossentropy', metrics=['accuracy'])
+        history = model.fit(train_flow, epochs=epochs, steps_per_epoch=steps, validation_data=val_flow,
+                            validation_steps=max(1, val_flow.samples // val_flow.batch_size), verbose=2)
+        after = test_accuracy(model)
+        report["stages"].append({"sparsity": sparsity, "test_accuracy_pruned": before, "test_accuracy_recovered": after,
+                                 "val_accuracy": float(history.history["val_accuracy"][-1])})
+        print(f"[INFO] Stage {stage}/{len(schedule)}: sparsity {sparsity:.2f}, "
+              f"test acc {before:.3f} after pruning -> {after:.3f} after fine-tuning")
+
+    pruned = export_pruned(model, keep)
+    drift = float(np.abs(pruned.predict(test_images, verbose=0) - model.predict(test_images, verbose=0)).max())
+    pruned.save(args.output)
+    print(f"[INFO] Exported {args.output}; max |masked - exported| output difference {drift:.2e}")
+
+    dense = load_model(args.model, compile=False)
+    report["dense"].update(params=int(dense.count_params()), file_mb=os.path.getsize(args.model) / 2 ** 20,
+                           **_measure(args.model, test_images[:32], args.threads))
+    report["pruned"] = {"test_accuracy": test_accuracy(pruned), "params": int(pruned.count_params()),
+                        "file_mb": os.path.getsize(args.output) / 2 ** 20, "export_max_abs_diff": drift,
+                        "channels_kept": {k: int(len(v)) for k, v in keep.items()},
+                        **_measure(args.output, test_images[:32], args.threads)}
+    with open("prune_report.json", "w") as f:
+        json.dump(report, f, indent=2)
+
+    d, p = report["dense"], report["pruned"]
+    print("\n" + "=" * 60)
+    print(f"STRUCTURED PRUNING REPORT (sparsity {args.sparsity:.2f})")
+    print("=" * 60)
+    print(f"{'':<22} {'dense':>12} {'pruned':>12}")
+    print(f"{'test accuracy':<22} {d['test_accuracy']:>12.3f} {p['test_accuracy']:>12.3f}")
+    print(f"{'1-image latency p50':<22} {d['single_ms_p50']:>10.1f}ms {p['single_ms_p50']:>10.1f}ms")
+    print(f"{'batched ms / image':<22} {d['batch_per_image_ms']:>10.2f}ms {p['batch_per_image_ms']:>10.2f}ms")
+    print(f"{'parameters':<22} {d['params']:>12,} {p['params']:>12,}")
+    print(f"{'file size':<22} {d['file_mb']:>10.1f}MB {p['file_mb']:>10.1f}MB")
+    print("=" * 60)
+    print(f"Saved {args.output} and prune_report.json")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+shadow_eval.py
+--------------
+Shadow evaluation of a candidate model on live api_server.py traffic.
+
+Usage:
+    SHADOW_MODEL=pruned_model.h5 SHADOW_SAMPLE_RATE=0.2 python api_server.py
+    curl localhost:5555/shadow                      # agreement, deltas, latency
+
+How it works:
+ - After /predict has its answer, a SHADOW_SAMPLE_RATE fraction of plain CNN
+   requests hands the decoded image and the primary result to
+   ShadowEvaluator.submit(). Cascade and tiled answers are not comparable with
+   one candidate CNN pass, so they are not shadowed.
+   That call only does a non-blocking put on a bounded queue (SHADOW_QUEUE). If
+   the queue is full, the sample is dropped and counted
+ - One worker thread runs the candidate. It drops samples that waited longer
+   than SHADOW_MAX_AGE seconds, so a backlog never builds up behind a busy
+   server. The thread is reniced (model_reload.lower_thread_priority), but
+   that is advisory: the candidate's predict runs on TensorFlow's shared
+   intra/inter-op pools at normal priority. SHADOW_SAMPLE_RATE is the knob
+   that actually bounds the extra CPU
+ - Per sample it records agreement, |P_candidate - P_primary| and both
+   latencies. /shadow reports totals and percentiles over the last `window`
+   samples. With SHADOW_LOG every sample is also appended as one JSON line
+ - Clients only ever get the primary model's response
+"""
+import json
+import queue
+import random
+import threading
+import time
+from collections import deque
+import numpy as np
+
+class ShadowEvaluator:
+    """Runs `candidate` (a model_reload.ServedModel) on sampled requests, off the request path."""
+
+    def __init__(self, candidate, sample_rate=0.1, queue_size=32, max_age=5.0, window=1000, log_path=None):
+        self.candidate = candidate
+        self.sample_rate = sample_rate
+        self.max_age = max_age
+        self.log_path = log_path
+        self.counts = {"requests": 0, "sampled": 0, "evaluated": 0, "dropped_full": 0, "dropped_stale": 0,
+                       "errors": 0, "agree": 0}
+        self.samples = deque(maxlen=window)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="shadow-eval", daemon=True)
+        self._thread.start()
+
+    def submit(self, image, primary_probability, primary_ms, stage="cnn"):
+        """Maybe queue one request for the candidate. Never blocks."""
+        with self._lock:
+            self.counts["requests"] += 1
+            if random.random() >= self.sample_rate:
+                return False
+            self.counts["sampled"] += 1
+        try:
+            self._queue.put_nowait((time.monotonic(), image, primary_probability, primary_ms, stage))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.counts["dropped_full"] += 1
+            return False
+
+    def _run(self):
+        from model_reload import lower_thread_priority
+        lower_thread_priority()
+        while True:
+            queued_at, image, p_primary, primary_ms, stage = self._queue.get()
+            if time.monotonic() - queued_at > self.max_age:
+                with self._lock:
+                    self.counts["dropped_stale"] += 1
+                continue
+            try:
+                start = time.perf_counter()
+                p_shadow = float(self.candidate.probabilities([image])[0])
+                shadow_ms = (time.perf_counter() - start) * 1000
+            except Exception as e:
+                print(f"[WARN] Shadow prediction failed: {e}")
+                with self._lock:
+                    self.counts["errors"] += 1
+                continue
+            record = {"time": time.time(), "stage": stage, "primary": p_primary, "shadow": p_shadow,
+                      "agree": (p_primary >= 0.5) == (p_shadow >= 0.5), "primary_ms": primary_ms, "shadow_ms": shadow_ms}
+            with self._lock:
+                self.counts["evaluated"] += 1
+                self.counts["agree"] += record["agree"]
+                self.samples.append(record)
+            if self.log_path:
+                with open(self.log_path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+            recent = list(self.samples)
+        out = {"candidate": self.candidate.path, "sample_rate": self.sample_rate, "queued": self._queue.qsize(), **counts,
+               "agreement": counts["agree"] / counts["evaluated"] if counts["evaluated"] else None}
+        if recent:
+            delta = np.abs([r["shadow"] - r["primary"] for r in recent])
+            out["window"] = {
+                "samples": len(recent),
+                "agreement": float(np.mean([r["agree"] for r in recent])),
+                "abs_delta_mean": float(delta.mean()), "abs_delta_p95": float(np.percentile(delta, 95)),
+                "abs_delta_max": float(delta.max()),
+                **{f"{m}_ms_{q}": float(np.percentile([r[f"{m}_ms"] for r in recent], int(q[1:])))
+                   for m in ("primary", "shadow") for q in ("p50", "p95")},
+            }
+        return out
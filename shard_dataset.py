@@ -0,0 +1,222 @@
+"""
+shard_dataset.py
+----------------
+Packs a dataset split into preprocessed uint8 shards (224x224x3 .npy files) that
+training and evaluation memory-map instead of decoding and resizing JPEGs again.
+
+Usage:
+    python shard_dataset.py --data_dir "data/water images" --out_dir shards
+    python shard_dataset.py --manifest dataset_manifest.sqlite --out_dir shards --splits train
+    python shard_dataset.py --data_dir "data/water images" --out_dir shards --benchmark
+
+Layout (one directory per split):
+    shards/train/images-00000.npy   uint8 [N, 224, 224, 3], opened with mmap_mode='r'
+    shards/train/index.json         classes, labels, source paths, shard sizes
+
+Images are resized with nearest-neighbour interpolation, the same as
+flow_from_directory, so shard-based runs see the same pixels as JPEG-based runs.
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from tensorflow import keras
+from dataset_manifest import iter_dataset_files, load_file_list
+
+IMG_SIZE = (224, 224)
+INDEX_FILE = "index.json"
+
+def decode_resized(path, img_size=IMG_SIZE):
+    with Image.open(path) as img:
+        return np.asarray(img.convert("RGB").resize(img_size, Image.NEAREST), dtype=np.uint8)
+
+def pack_split(files, split_dir, img_size=IMG_SIZE, shard_size=2048, workers=None, decode=None):
+    """Decode [(path, class_name), ...] in parallel and write shards + index.json to split_dir.
+
+    decode: optional callable(path, img_size) -> uint8 array for sources that are
+    not plain files (e.g. zip members); it runs in a thread pool instead of a
+    process pool.
+    """
+    split_dir = Path(split_dir)
+    split_dir.mkdir(parents=True, exist_ok=True)
+    classes = sorted({cls for _, cls in files})
+    class_indices = {cls: i for i, cls in enumerate(classes)}
+    shard_sizes = []
+    executor = ProcessPoolExecutor if decode is None else ThreadPoolExecutor
+    decode = decode or decode_resized
+    with executor(max_workers=workers) as pool:
+        for shard_id, start in enumerate(range(0, len(files), shard_size)):
+            chunk = files[start:start + shard_size]
+            out = np.lib.format.open_memmap(
+                split_dir / f"images-{shard_id:05d}.npy", mode="w+",
+                dtype=np.uint8, shape=(len(chunk), img_size[1], img_size[0], 3))
+            paths = [p for p, _ in chunk]
+            for i, arr in enumerate(pool.map(decode, paths, [img_size] * len(paths), chunksize=8)):
+                out[i] = arr
+            out.flush()
+            del out
+            shard_sizes.append(len(chunk))
+    index = {
+        "img_size": list(img_size),
+        "classes": classes,
+        "class_indices": class_indices,
+        "labels": [class_indices[cls] for _, cls in files],
+        "paths": [p for p, _ in files],
+        "shard_sizes": shard_sizes,
+    }
+    with open(split_dir / INDEX_FILE, "w") as f:
+        json.dump(index, f)
+    return index
+
+class ShardedImages:
+    """Read-only view over the shards of one split, indexable by a list of global indices.
+
+    Each shard is np.load(..., mmap_mode='r'), so only the rows a batch touches
+    are paged in.
+    """
+
+    def __init__(self, split_dir):
+        split_dir = Path(split_dir)
+        with open(split_dir / INDEX_FILE) as f:
+            self.index = json.load(f)
+        self.shards = [np.load(split_dir / f"images-{i:05d}.npy", mmap_mode="r")
+                       for i in range(len(self.index["shard_sizes"]))]
+        self.offsets = np.cumsum([0] + self.index["shard_sizes"])
+        self.labels = np.asarray(self.index["labels"], dtype=np.int32)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def take(self, indices):
+        """uint8 [len(indices), H, W, 3] for the given global row indices."""
+        indices = np.asarray(indices)
+        shard_ids = np.searchsorted(self.offsets, indices, side="right") - 1
+        h, w = self.index["img_size"][1], self.index["img_size"][0]
+        out = np.empty((len(indices), h, w, 3), dtype=np.uint8)
+        for s in np.unique(shard_ids):
+            mask = shard_ids == s
+            out[mask] = self.shards[s][indices[mask] - self.offsets[s]]
+        return out
+
+def _split_indices(labels, validation_split, subset):
+    """Per-class split matching flow_from_directory: the first fraction of each class is validation."""
+    if not validation_split or subset is None:
+        return np.arange(len(labels))
+    keep = []
+    for c in np.unique(labels):
+        idx = np.flatnonzero(labels == c)
+        n_val = int(validation_split * len(idx))
+        keep.append(idx[:n_val] if subset == "validation" else idx[n_val:])
+    return np.concatenate(keep)
+
+class ShardSequence(keras.utils.Sequence):
+    """Keras Sequence over a packed split, a drop-in for a DirectoryIterator.
+
+    Exposes samples, batch_size, classes and class_indices like the Keras
+    iterators do, and applies datagen.random_transform/standardize per image the
+    same way flow_from_directory does.
+    """
+
+    def __init__(self, split_dir, datagen=None, batch_size=16, subset=None, shuffle=True, seed=None):
+        super().__init__()
+        self.images = ShardedImages(split_dir)
+        self.datagen = datagen
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        split = datagen._validation_split if datagen is not None else 0.0
+        self.indices = _split_indices(self.images.labels, split, subset if split else None)
+        self.samples = len(self.indices)
+        self.classes = self.images.labels[self.indices]
+        self.class_indices = self.images.index["class_indices"]
+        self.filenames = [self.images.index["paths"][i] for i in self.indices]
+        self.order = np.arange(self.samples)
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(self.samples / self.batch_size))
+
+    def __getitem__(self, idx):
+        batch = self.order[idx * self.batch_size:(idx + 1) * self.batch_size]
+        rows = self.indices[batch]
+        x = self.images.take(rows).astype(np.float32)
+        if self.datagen is not None:
+            for i in range(len(x)):
+                x[i] = self.datagen.random_transform(x[i])
+                x[i] = self.datagen.standardize(x[i])
+        else:
+            x /= 255.0
+        return x, self.images.labels[rows].astype(np.float32)
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.order)
+
+def collect_split_files(split, data_dir=None, manifest=None):
+    if manifest:
+        return load_file_list(manifest, split)
+    root = Path(data_dir)
+    return [(str(root / rel), cls) for rel, s, cls, _, _ in iter_dataset_files(root) if s == split]
+
+def _time_epoch(flow, model=None):
+    """Seconds for one pass over flow: input only, or model.fit for one epoch."""
+    start = time.perf_counter()
+    if model is None:
+        for i in range(len(flow)):
+            flow[i]
+    else:
+        model.fit(flow, epochs=1, steps_per_epoch=len(flow), verbose=0)
+    return time.perf_counter() - start
+
+def benchmark(data_dir, shard_dir, batch_size=16, repeats=2):
+    """Compare epoch time of the JPEG directory pipeline and the shard pipeline."""
+    from train_model import prepare_generators, build_model
+    jpeg_train, _ = prepare_generators(data_dir, batch_size=batch_size)
+    shard_train, _ = prepare_generators(data_dir, batch_size=batch_size, shard_dir=shard_dir)
+    model = build_model(weights=None)
+    _time_epoch(shard_train, model)  # build/trace the train step once before timing
+    results = {}
+    for name, flow in [("jpeg_dir", jpeg_train), ("shards", shard_train)]:
+        results[name] = {
+            "input_only_s": min(_time_epoch(flow) for _ in range(repeats)),
+            "end_to_end_s": min(_time_epoch(flow, model) for _ in range(repeats)),
+            "images": flow.samples,
+        }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", default="data/water images")
+    parser.add_argument("--manifest", default=None, help="dataset_manifest.py output to read file lists from")
+    parser.add_argument("--out_dir", default="shards")
+    parser.add_argument("--splits", nargs="+", default=["train", "test"])
+    parser.add_argument("--shard_size", type=int, default=2048, help="Images per .npy shard")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--benchmark", action="store_true", help="Time one epoch on JPEGs vs shards after packing")
+    parser.add_argument("--batch_size", type=int, default=16)
+    args = parser.parse_args()
+
+    for split in args.splits:
+        files = collect_split_files(split, args.data_dir, args.manifest)
+        if not files:
+            print(f"[WARN] no images for split '{split}', skipping")
+            continue
+        start = time.perf_counter()
+        index = pack_split(files, Path(args.out_dir) / split, shard_size=args.shard_size, workers=args.workers)
+        print(f"Packed {len(files)} {split} images into {len(index['shard_sizes'])} shard(s) "
+              f"in {time.perf_counter() - start:.1f}s -> {Path(args.out_dir) / split}")
+
+    if args.benchmark:
+        results = benchmark(args.data_dir, args.out_dir, batch_size=args.batch_size)
+        print("\nEpoch time (best of 2):")
+        print(f"  {'pipeline':<10} {'input only':>12} {'end to end':>12}")
+        for name, r in results.items():
+            print(f"  {name:<10} {r['input_only_s']:>11.2f}s {r['end_to_end_s']:>11.2f}s")
+        speedup = results["jpeg_dir"]["end_to_end_s"] / max(results["shards"]["end_to_end_s"], 1e-9)
+        print(f"  end-to-end speedup: {speedup:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,7 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
 import streamlit as st
 from pathlib import Path
-import zipfile, tempfile, json
+import io, json
 import numpy as np
 from PIL import Image
 import matplotlib
@@ -87,10 +87,10 @@ def build_model(img_shape=(224,224,3), lr=1e-4, base_trainable=False):
     model.compile(optimizer=Adam(lr), loss='binary_crossentropy', metrics=['accuracy'])
     return model
 
-def prepare_generators(data_dir, img_size=(224,224), batch_size=16, val_split=0.2):
+def prepare_generators(data_dir, img_size=(224,224), batch_size=16, val_split=0.2, shard_dir=None):
     train_dir = Path(data_dir) / "train"
     test_dir = Path(data_dir) / "test"
-    if not train_dir.exists():
+    if shard_dir is None and not train_dir.exists():
         raise FileNotFoundError("train folder not found: " + str(train_dir))
     train_datagen = ImageDataGenerator(
         rescale=1./255,
@@ -103,6 +103,15 @@ def prepare_generators(data_dir, img_size=(224,224), batch_size=16, val_split=0.
         zoom_range=0.1,
         validation_split=val_split
     )
+    if shard_dir is not None:
+        # Dataset came from an uploaded zip and was decoded straight into shards
+        from shard_dataset import ShardSequence
+        train_flow = ShardSequence(Path(shard_dir) / "train", train_datagen, batch_size=batch_size, subset='training')
+        val_flow = ShardSequence(Path(shard_dir) / "train", train_datagen, batch_size=batch_size, subset='validation')
+        test_flow = None
+        if (Path(shard_dir) / "test").exists():
+            test_flow = ShardSequence(Path(shard_dir) / "test", batch_size=batch_size, shuffle=False)
+        return train_flow, val_flow, test_flow
     test_datagen = ImageDataGenerator(rescale=1./255)
     train_flow = train_datagen.flow_from_directory(str(train_dir), target_size=img_size, batch_size=batch_size, class_mode='binary', subset='training', shuffle=True)
     val_flow = train_datagen.flow_from_directory(str(train_dir), target_size=img_size, batch_size=batch_size, class_mode='binary', subset='validation', shuffle=True)
@@ -111,8 +120,8 @@ def prepare_generators(data_dir, img_size=(224,224), batch_size=16, val_split=0.
         test_flow = test_datagen.flow_from_directory(str(test_dir), target_size=img_size, batch_size=batch_size, class_mode='binary', shuffle=False)
     return train_flow, val_flow, test_flow
 
-def train_and_save(data_dir, epochs=8, batch_size=16):
-    train_flow, val_flow, test_flow = prepare_generators(data_dir, IMG_SIZE, batch_size)
+def train_and_save(data_dir, epochs=8, batch_size=16, shard_dir=None):
+    train_flow, val_flow, test_flow = prepare_generators(data_dir, IMG_SIZE, batch_size, shard_dir=shard_dir)
     model = build_model(img_shape=(IMG_SIZE[0],IMG_SIZE[1],3), lr=1e-4, base_trainable=False)
     callbacks = [
         ModelCheckpoint("best_model.h5", monitor='val_accuracy', save_best_only=True, verbose=1),
@@ -127,9 +136,9 @@ def train_and_save(data_dir, epochs=8, batch_size=16):
         json.dump({k:[float(x) for x in v] for k,v in history.history.items()}, f)
     return model, history, test_flow
 
-def evaluate_model_on_test(model_path, data_dir):
+def evaluate_model_on_test(model_path, data_dir, shard_dir=None):
     model = load_model(model_path)
-    _, _, test_flow = prepare_generators(data_dir)
+    _, _, test_flow = prepare_generators(data_dir, shard_dir=shard_dir)
     if test_flow is None:
         raise FileNotFoundError("No test folder found.")
     preds = model.predict(test_flow, verbose=1).ravel()
@@ -150,6 +159,30 @@ def predict_image_with_model(model_path, pil_image):
     drinkable = "Not safe to drink" if label=="Dirty" else "Safe to drink"
     return label, prob, drinkable, img
 
+COMPARE_CHOICE = "Compare both (shared backbone)"
+MODEL_FILES = ["best_model.h5", "final_model.h5"]
+
+def compare_models_on_image(model_paths, pil_image):
+    """P(Dirty) of every model with one backbone pass per distinct backbone (multi_head.py)."""
+    from multi_head import MultiHeadModel
+    models = MultiHeadModel({p: p for p in model_paths})
+    img = pil_image.convert("RGB").resize(IMG_SIZE)
+    arr = np.expand_dims(img_to_array(img)/255.0, axis=0)
+    return {name: float(p[0]) for name, p in models.predict(arr).items()}, models, img
+
+def compare_models_on_test(model_paths, data_dir, shard_dir=None):
+    from multi_head import MultiHeadModel
+    models = MultiHeadModel({p: p for p in model_paths})
+    _, _, test_flow = prepare_generators(data_dir, shard_dir=shard_dir)
+    if test_flow is None:
+        raise FileNotFoundError("No test folder found.")
+    preds = {p: [] for p in model_paths}
+    for i in range(len(test_flow)):
+        for name, p in models.predict(test_flow[i][0]).items():
+            preds[name].append(p)
+    y_true = test_flow.classes
+    return {name: float(((np.concatenate(p) >= 0.5).astype(int) == y_true).mean()) for name, p in preds.items()}, models
+
 # -------------------------
 # UI Layout (glass cards)
 # -------------------------
@@ -175,51 +208,39 @@ with right:
     st.markdown("<div class='glass'>", unsafe_allow_html=True)
     st.subheader("Inference & Evaluate")
     uploaded_image = st.file_uploader("Upload image for prediction", type=["jpg","jpeg","png"])
-    model_choice = st.selectbox("Model to use", options=["best_model.h5","final_model.h5"])
+    model_choice = st.selectbox("Model to use", options=MODEL_FILES + [COMPARE_CHOICE])
     predict_btn = st.button("Predict Image", key="predict_btn")
     st.markdown("---")
     st.write("Evaluation on test set (requires a `test/` folder in dataset)")
-    eval_model_choice = st.selectbox("Eval model", options=["best_model.h5","final_model.h5"], index=0, key="eval_model")
+    eval_model_choice = st.selectbox("Eval model", options=MODEL_FILES + [COMPARE_CHOICE], index=0, key="eval_model")
     eval_btn = st.button("Evaluate", key="eval_btn")
     st.markdown("</div>", unsafe_allow_html=True)
 
 # -------------------------
 # Actions
 # -------------------------
-# Handle uploaded zip extraction
+# Handle uploaded zip: members are decoded straight from the in-memory archive into
+# cached shards keyed by the archive fingerprint, so reruns and re-uploads reuse them
+zip_shard_dir = None
 if uploaded_zip is not None:
-    tmpdir = tempfile.mkdtemp()
-    zip_path = Path(tmpdir) / "dataset.zip"
-    with open(zip_path, "wb") as f:
-        f.write(uploaded_zip.getbuffer())
     try:
-        with zipfile.ZipFile(zip_path, "r") as zf:
-            zf.extractall(tmpdir)
-        # find folder containing train/
-        candidate = None
-        for p in Path(tmpdir).iterdir():
-            if (p / "train").exists():
-                candidate = p
-                break
-        if candidate is None and (Path(tmpdir) / "train").exists():
-            candidate = Path(tmpdir)
-        if candidate is None:
-            st.error("Could not find train/ folder inside zip. Please upload zip whose top level contains train/")
-        else:
-            data_dir_input = str(candidate)
-            st.success(f"Extracted dataset to: {candidate}")
+        from zip_dataset import prepare_zip_dataset
+        zip_shard_dir, reused = prepare_zip_dataset(io.BytesIO(uploaded_zip.getbuffer()))
+        st.success(("Reusing prepared dataset: " if reused else "Prepared dataset from zip: ") + str(zip_shard_dir))
+    except FileNotFoundError:
+        st.error("Could not find train/ folder inside zip. Please upload zip whose top level contains train/")
     except Exception as e:
-        st.error("Extraction failed: " + str(e))
+        st.error("Reading zip failed: " + str(e))
 
 # Train
 if train_btn:
     data_root = Path(data_dir_input)
-    if not data_root.exists():
+    if zip_shard_dir is None and not data_root.exists():
         st.error("Dataset path not found: " + str(data_root))
     else:
         st.info("Training started. This may take time (use small epochs to test).")
         try:
-            model, history, test_flow = train_and_save(str(data_root), epochs=int(epochs), batch_size=int(batch_size))
+            model, history, test_flow = train_and_save(str(data_root), epochs=int(epochs), batch_size=int(batch_size), shard_dir=zip_shard_dir)
             st.success("Training complete. Models saved: best_model.h5, final_model.h5")
             if Path("training_history.json").exists():
                 with open("training_history.json") as f:
@@ -234,7 +255,22 @@ if train_btn:
             st.error("Training failed: " + str(e))
 
 # Predict
-if predict_btn:
+if predict_btn and model_choice == COMPARE_CHOICE:
+    missing = [m for m in MODEL_FILES if not Path(m).exists()]
+    if uploaded_image is None:
+        st.error("Please upload an image first.")
+    elif missing:
+        st.warning(f"Model not found: {', '.join(missing)}. Train model first.")
+    else:
+        try:
+            probs, models, proc_img = compare_models_on_image(MODEL_FILES, Image.open(uploaded_image))
+            st.image(proc_img, caption=f"Processed ({IMG_SIZE[0]}×{IMG_SIZE[1]})", use_column_width=False)
+            for name, prob in probs.items():
+                st.markdown(f"**{name}:** {'Dirty' if prob >= 0.5 else 'Clean'} (P(Dirty) = {prob*100:.2f}%)")
+            st.caption(f"{len(models.groups)} backbone pass(es) for {len(probs)} models")
+        except Exception as e:
+            st.error("Prediction failed: " + str(e))
+elif predict_btn:
     if uploaded_image is None:
         st.error("Please upload an image first.")
     else:
@@ -256,17 +292,32 @@ if predict_btn:
                 st.error("Prediction failed: " + str(e))
 
 # Evaluate
-if eval_btn:
+if eval_btn and eval_model_choice == COMPARE_CHOICE:
+    missing = [m for m in MODEL_FILES if not Path(m).exists()]
+    if missing:
+        st.error("Model file not found: " + ", ".join(missing))
+    elif zip_shard_dir is None and not Path(data_dir_input).exists():
+        st.error("Dataset path not found: " + str(data_dir_input))
+    else:
+        try:
+            st.info("Evaluating both models on test set...")
+            accs, models = compare_models_on_test(MODEL_FILES, str(Path(data_dir_input)), shard_dir=zip_shard_dir)
+            for name, acc in accs.items():
+                st.write(f"{name}: accuracy **{acc:.4f}**")
+            st.caption(f"{models.backbone_passes} backbone passes for {len(accs)} models")
+        except Exception as e:
+            st.error("Evaluation failed: " + str(e))
+elif eval_btn:
     model_file = Path(eval_model_choice)
     data_root = Path(data_dir_input)
     if not model_file.exists():
         st.error("Model file not found: " + str(model_file))
-    elif not data_root.exists():
+    elif zip_shard_dir is None and not data_root.exists():
         st.error("Dataset path not found: " + str(data_root))
     else:
         try:
             st.info("Evaluating on test set...")
-            acc, report, cm = evaluate_model_on_test(str(model_file), str(data_root))
+            acc, report, cm = evaluate_model_on_test(str(model_file), str(data_root), shard_dir=zip_shard_dir)
             st.write(f"Accuracy: **{acc:.4f}**")
             st.write("Confusion matrix:")
             st.write(cm)
@@ -0,0 +1,185 @@
+"""
+tiled_inference.py
+------------------
+High-resolution tiled analysis: instead of squashing a 4000x3000 phone photo
+to 224x224, classify overlapping 224px tiles and aggregate them.
+
+Usage:
+    python tiled_inference.py --model best_model.h5 --image photo.jpg --tiles 4 --overlap 0.25 --aggregate max
+    python tiled_inference.py --model best_model.h5 --benchmark --data_dir "data/water images" --photo_size 4000x3000
+    curl -F image=@photo.jpg "localhost:5555/predict?tiled=1&tiles=6&aggregate=map"
+
+How it works:
+ - `tiles` is the number of tiles along the long side and `overlap` the
+   fraction two neighbouring tiles share. The photo is resized once, keeping
+   its aspect ratio, so that the long side is exactly what that grid covers
+   (tile + (n - 1) * stride, stride = tile * (1 - overlap)). 4 tiles at 0.25
+   overlap look at a 728px version of the photo instead of a 224px one. The
+   short side gets as many tiles as it takes to cover it, and the overhang
+   (less than a stride) is reflect-padded, not stretched or cropped away
+ - Tiles are a strided view of the uint8 pixel array
+   (np.lib.stride_tricks.sliding_window_view, stepped by stride): nothing is
+   copied until the one float32 batch the model needs
+ - All tiles go through the model as one batch
+ - Aggregation: "max" (the most contaminated tile decides, best for small
+   patches), "mean" (whole-photo average) or "map" (per-pixel average of the
+   tiles covering each pixel, returned as a grid; the verdict is its maximum,
+   so like "max" except that where tiles overlap one outlier tile is averaged
+   with its neighbours)
+ - Photos smaller than the grid get fewer tiles rather than being upsampled
+ - --benchmark prints accuracy and latency on the test split for a few tile
+   counts next to the plain resized prediction
+"""
+import argparse
+import math
+import time
+import numpy as np
+from PIL import Image
+
+AGGREGATES = ("max", "mean", "map")
+
+def tile_layout(size, tile=224, tiles=4, overlap=0.25):
+    """For a (width, height) photo: ((width, height) to resize to, keeping the aspect
+    ratio), stride, (rows, cols), and the (width, height) the tile grid covers."""
+    if not 0.0 <= overlap < 1.0:
+        raise ValueError("overlap must be in [0, 1)")
+    stride = max(1, int(round(tile * (1.0 - overlap))))
+    long_side, short_side = max(size), min(size)
+    # Never more tiles than fit the photo at its own resolution: no upsampling
+    n_long = max(1, min(int(tiles), 1 + max(0, (long_side - tile) // stride)))
+    scale = (tile + (n_long - 1) * stride) / long_side
+    short_scaled = max(1, int(round(short_side * scale)))
+    # Enough tiles to cover the short side; the overhang is padded, so no pixel is lost
+    n_short = 1 + max(0, -(-(short_scaled - tile) // stride))
+    n_short = min(n_short, n_long)
+    long_len, short_len = tile + (n_long - 1) * stride, tile + (n_short - 1) * stride
+    if size[0] >= size[1]:
+        return (long_len, short_scaled), stride, (n_short, n_long), (long_len, short_len)
+    return (short_scaled, long_len), stride, (n_long, n_short), (short_len, long_len)
+
+def extract_tiles(arr, tile, stride):
+    """[rows, cols, tile, tile, C] strided view of an [H, W, C] array (no copy)."""
+    windows = np.lib.stride_tricks.sliding_window_view(arr, (tile, tile), axis=(0, 1))
+    # sliding_window_view puts the window axes last: [rows, cols, C, tile, tile]
+    return windows[::stride, ::stride].transpose(0, 1, 3, 4, 2)
+
+def pad_to(pixels, size):
+    """Reflect-pad an [H, W, C] array evenly on both sides to (width, height)."""
+    pad = [((want - have) // 2, want - have - (want - have) // 2)
+           for have, want in zip(pixels.shape[:2], (size[1], size[0]))]
+    if pad == [(0, 0), (0, 0)]:
+        return pixels
+    return np.pad(pixels, pad + [(0, 0)], mode="reflect")
+
+def probability_map(probs, tile, stride):
+    """Per-cell mean probability of the tiles covering each cell (cell = gcd(tile, stride) px)."""
+    rows, cols = probs.shape
+    cell = math.gcd(tile, stride)
+    t, s = tile // cell, stride // cell
+    total = np.zeros((t + (rows - 1) * s, t + (cols - 1) * s))
+    count = np.zeros_like(total)
+    for r in range(rows):
+        for c in range(cols):
+            total[r * s:r * s + t, c * s:c * s + t] += probs[r, c]
+            count[r * s:r * s + t, c * s:c * s + t] += 1
+    return total / count
+
+def tiled_predict(predict_batch, img, tile=224, tiles=4, overlap=0.25, aggregate="max"):
+    """Aggregated P(Dirty) for an RGB PIL image plus per-tile details.
+    predict_batch: [N, tile, tile, 3] float32 in [0, 1] -> N probabilities."""
+    if aggregate not in AGGREGATES:
+        raise ValueError(f"aggregate must be one of {AGGREGATES}")
+    work_size, stride, (rows, cols), covered = tile_layout(img.size, tile, tiles, overlap)
+    pixels = np.asarray(img.resize(work_size, Image.BILINEAR, reducing_gap=2.0))
+    pixels = pad_to(pixels, covered)
+    view = extract_tiles(pixels, tile, stride)
+    # The only copy of the tiles: straight into a C-ordered float32 batch
+    batch = view.astype(np.float32, order="C").reshape(rows * cols, tile, tile, 3)
+    batch *= 1.0 / 255.0
+    probs = np.asarray(predict_batch(batch), dtype=np.float64).reshape(rows, cols)
+    result = {"grid": [rows, cols], "stride": stride, "resized_to": list(work_size), "tiled_area": list(covered),
+              "aggregate": aggregate, "tile_probabilities": probs.round(4).tolist()}
+    if aggregate == "max":
+        result["probability"] = float(probs.max())
+    elif aggregate == "mean":
+        result["probability"] = float(probs.mean())
+    else:
+        pmap = probability_map(probs, tile, stride)
+        result["probability"] = float(pmap.max())
+        result["map"] = pmap.round(4).tolist()
+    return result
+
+def benchmark(model, files, configs, runs=3, photo_size=None):
+    """Accuracy and p50 latency per image for each (tiles, overlap, aggregate) config.
+    photo_size=(w, h) resizes the test images first, to time phone-sized input."""
+    tile = model.input_shape[1]
+    images, labels = [], []
+    for path, class_name in files:
+        with Image.open(path) as im:
+            img = im.convert("RGB")
+        images.append(img.resize(photo_size, Image.BICUBIC) if photo_size else img)
+        labels.append(int(class_name.startswith("Dirty")))
+    predict = lambda b: model.predict_on_batch(b).ravel()
+    plain = lambda im: float(predict(np.asarray(im.resize((tile, tile)), dtype=np.float32)[None] / 255.0)[0])
+    rows = [("resize (plain /predict)", plain, 1)]
+    for tiles, overlap, aggregate in configs:
+        fn = lambda im, t=tiles, o=overlap, a=aggregate: tiled_predict(predict, im, tile, t, o, a)["probability"]
+        rows.append((f"tiles={tiles} overlap={overlap} {aggregate}", fn,
+                     int(np.prod(tile_layout(images[0].size, tile, tiles, overlap)[2]))))
+    results = []
+    for name, fn, n_tiles in rows:
+        fn(images[0])
+        times, correct = [], 0
+        for im, y in zip(images, labels):
+            for _ in range(runs):
+                start = time.perf_counter()
+                p = fn(im)
+                times.append((time.perf_counter() - start) * 1000)
+            correct += int((p >= 0.5) == y)
+        results.append({"method": name, "tiles": n_tiles, "accuracy": correct / len(images),
+                        "ms_p50": float(np.percentile(times, 50))})
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="best_model.h5")
+    parser.add_argument("--image", default=None, help="Photo to analyse")
+    parser.add_argument("--tiles", type=int, default=4, help="Tiles along the long side")
+    parser.add_argument("--overlap", type=float, default=0.25, help="Fraction shared by neighbouring tiles")
+    parser.add_argument("--aggregate", choices=AGGREGATES, default="max")
+    parser.add_argument("--benchmark", action="store_true", help="Accuracy/latency per tile count on the test split")
+    parser.add_argument("--data_dir", default="data/water images")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--photo_size", default=None, help="Benchmark at e.g. 4000x3000 (test images are upscaled)")
+    args = parser.parse_args()
+
+    from tensorflow.keras.models import load_model
+    model = load_model(args.model, compile=False)
+    if args.image:
+        with Image.open(args.image) as im:
+            img = im.convert("RGB")
+        result = tiled_predict(lambda b: model.predict_on_batch(b).ravel(), img, model.input_shape[1],
+                               args.tiles, args.overlap, args.aggregate)
+        p = result["probability"]
+        print(f"[INFO] {result['grid'][0]}x{result['grid'][1]} tiles on {img.size[0]}x{img.size[1]} "
+              f"(resized to {result['resized_to'][0]}x{result['resized_to'][1]})")
+        for row in result["tile_probabilities"]:
+            print("  " + " ".join(f"{v:.2f}" for v in row))
+        print(f"[INFO] {args.aggregate}: P(Dirty) = {p:.4f} -> {'Dirty' if p >= 0.5 else 'Clean'}")
+    if args.benchmark:
+        from shard_dataset import collect_split_files
+        files = collect_split_files("test", args.data_dir)
+        configs = [(2, 0.25, args.aggregate), (4, 0.25, args.aggregate), (4, 0.5, args.aggregate),
+                   (6, 0.25, args.aggregate)]
+        photo_size = tuple(int(v) for v in args.photo_size.split("x")) if args.photo_size else None
+        rows = benchmark(model, files, configs, args.runs, photo_size)
+        print("\n" + "=" * 70)
+        print(f"TILED ANALYSIS ({len(files)} test images{f' at {args.photo_size}' if photo_size else ''})")
+        print("=" * 70)
+        print(f"{'method':<34} {'tiles':>5} {'accuracy':>9} {'p50 ms':>9}")
+        for r in rows:
+            print(f"{r['method']:<34} {r['tiles']:>5} {r['accuracy']:>9.3f} {r['ms_p50']:>9.1f}")
+        print("=" * 70)
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,21 @@ Train a MobileNetV2-based classifier for Water Quality (Clean vs Dirty).
 
 Usage:
     python train_model.py --data_dir "/mnt/data/water-quality-predictions/data/water images" --epochs 10 --batch_size 16
+    python train_model.py --data_dir "data/water images" --manifest dataset_manifest.sqlite
+    python train_model.py --file_list train_dedup.csv   # e.g. from dedup_images.py --out_list
+    python train_model.py --shard_dir shards             # from shard_dataset.py
+    python train_model.py --profile --profile_trace_steps 5,10
+    python train_model.py --finetune_blocks 3 --finetune_epochs 5   # see finetune_cache.py
+    python train_model.py --epochs 30 --checkpoint_seconds 300
+    python train_model.py --epochs 30 --resume                       # continue a killed run
 
 Outputs:
  - best_model.h5 (best validation accuracy)
  - final_model.h5 (final saved model)
  - training_history.json
+ - profile_summary.json (with --profile; see training_profiler.py)
+ - finetune_report.json (with --finetune_blocks)
+ - training_state/ (resumable checkpoints; see training_state.py)
 """
 import argparse
 from pathlib import Path
@@ -28,9 +38,21 @@ ReduceLROnPlateau = keras.callbacks.ReduceLROnPlateau
 IMG_SIZE = (224,224)
 AUTOTUNE = tf.data.AUTOTUNE
 
-def prepare_generators(data_dir, batch_size=16, validation_split=0.2):
+def files_dataframe(files):
+    """[(path, class_name), ...] -> DataFrame in the layout flow_from_dataframe expects."""
+    import pandas as pd
+    return pd.DataFrame(files, columns=["filename", "class"])
+
+def prepare_generators(data_dir, batch_size=16, validation_split=0.2, files=None, shard_dir=None):
+    """Build augmented train/validation iterators.
+
+    files: optional [(path, class_name), ...] (e.g. from dataset_manifest.load_file_list)
+    used instead of scanning <data_dir>/train.
+    shard_dir: optional shard_dataset.py output; <shard_dir>/train is memory-mapped
+    instead of decoding JPEGs.
+    """
     train_dir = Path(data_dir) / "train"
-    if not train_dir.exists():
+    if files is None and shard_dir is None and not train_dir.exists():
         raise FileNotFoundError("train directory not found: " + str(train_dir))
     train_datagen = ImageDataGenerator(
         rescale=1./255,
@@ -43,6 +65,31 @@ def prepare_generators(data_dir, batch_size=16, validation_split=0.2):
         zoom_range=0.1,
         validation_split=validation_split
     )
+    if shard_dir is not None:
+        from shard_dataset import ShardSequence
+        split_dir = Path(shard_dir) / "train"
+        train_flow = ShardSequence(split_dir, train_datagen, batch_size=batch_size, subset='training', shuffle=True)
+        val_flow = ShardSequence(split_dir, train_datagen, batch_size=batch_size, subset='validation', shuffle=True)
+        return train_flow, val_flow
+    if files is not None:
+        # flow_from_dataframe's subset= takes the first rows of the whole list
+        # (one class for a sorted list), so split per class like flow_from_directory
+        from dataset_manifest import split_validation
+        classes = sorted({c for _, c in files})
+        # Paths come pre-validated from the manifest, so skip the per-file existence check
+        flows = [
+            train_datagen.flow_from_dataframe(
+                files_dataframe(subset_files),
+                classes=classes,
+                target_size=IMG_SIZE,
+                batch_size=batch_size,
+                class_mode='binary',
+                shuffle=True,
+                validate_filenames=False
+            )
+            for subset_files in split_validation(files, validation_split)
+        ]
+        return flows[0], flows[1]
     train_flow = train_datagen.flow_from_directory(
         directory=str(train_dir),
         target_size=IMG_SIZE,
@@ -61,14 +108,15 @@ def prepare_generators(data_dir, batch_size=16, validation_split=0.2):
     )
     return train_flow, val_flow
 
-def build_model(img_size=(224,224,3), base_trainable=False, lr=1e-4):
-    base = MobileNetV2(weights='imagenet', include_top=False, input_shape=img_size)
+def build_model(img_size=(224,224,3), base_trainable=False, lr=1e-4, weights='imagenet',
+                dense_units=128, dropout=0.3, dense_dropout=0.2, alpha=1.0):
+    base = MobileNetV2(weights=weights, include_top=False, input_shape=img_size, alpha=alpha)
     base.trainable = base_trainable
     x = base.output
     x = GlobalAveragePooling2D()(x)
-    x = Dropout(0.3)(x)
-    x = Dense(128, activation='relu')(x)
-    x = Dropout(0.2)(x)
+    x = Dropout(dropout)(x)
+    x = Dense(dense_units, activation='relu')(x)
+    x = Dropout(dense_dropout)(x)
     outputs = Dense(1, activation='sigmoid')(x)
     model = Model(inputs=base.input, outputs=outputs)
     model.compile(optimizer=Adam(lr), loss='binary_crossentropy', metrics=['accuracy'])
@@ -80,9 +128,30 @@ def main():
     parser.add_argument("--epochs", type=int, default=10)
     parser.add_argument("--batch_size", type=int, default=16)
     parser.add_argument("--unfreeze_after", type=int, default=0, help="If >0, unfreeze base and fine-tune after this many epochs")
+    parser.add_argument("--manifest", default=None, help="dataset_manifest.py output to read the train file list from")
+    parser.add_argument("--file_list", default=None, help="CSV of filename,class to train on (e.g. dedup_images.py --out_list)")
+    parser.add_argument("--shard_dir", default=None, help="shard_dataset.py output to memory-map instead of reading JPEGs")
+    parser.add_argument("--profile", action="store_true", help="Record data-wait vs compute per step and report input/compute-bound")
+    parser.add_argument("--profile_trace_steps", default=None, help="START,STOP global steps to capture a TensorFlow profiler trace")
+    parser.add_argument("--profile_dir", default="profile_logs", help="Where the profiler trace is written")
+    parser.add_argument("--finetune_blocks", type=int, default=0, help="If >0, fine-tune only the top K MobileNetV2 blocks on cached activations")
+    parser.add_argument("--finetune_epochs", type=int, default=5)
+    parser.add_argument("--finetune_aug_passes", type=int, default=2, help="Augmented copies of the train set to cache for --finetune_blocks")
+    parser.add_argument("--finetune_cache_dir", default="finetune_cache")
+    parser.add_argument("--checkpoint_dir", default="training_state", help="Where full training-state checkpoints are written")
+    parser.add_argument("--checkpoint_steps", type=int, default=0, help="Also checkpoint every N steps inside an epoch (0 = off)")
+    parser.add_argument("--checkpoint_seconds", type=float, default=600, help="Also checkpoint every T seconds inside an epoch (0 = off)")
+    parser.add_argument("--resume", action="store_true", help="Continue from the latest checkpoint in --checkpoint_dir")
     args = parser.parse_args()
 
-    train_flow, val_flow = prepare_generators(args.data_dir, batch_size=args.batch_size)
+    files = None
+    if args.file_list:
+        from dataset_manifest import read_file_list
+        files = read_file_list(args.file_list)
+    elif args.manifest:
+        from dataset_manifest import load_file_list
+        files = load_file_list(args.manifest, "train")
+    train_flow, val_flow = prepare_generators(args.data_dir, batch_size=args.batch_size, files=files, shard_dir=args.shard_dir)
     print("Classes:", train_flow.class_indices)
     model = build_model(img_size=(IMG_SIZE[0], IMG_SIZE[1], 3), base_trainable=False)
     callbacks = [
@@ -90,21 +159,41 @@ def main():
         EarlyStopping(monitor='val_loss', patience=6, restore_best_weights=True, verbose=1),
         ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=3, verbose=1)
     ]
+    if args.profile:
+        from training_profiler import StepProfiler
+        trace_steps = tuple(int(x) for x in args.profile_trace_steps.split(",")) if args.profile_trace_steps else None
+        callbacks.append(StepProfiler(trace_dir=args.profile_dir, trace_steps=trace_steps))
     steps_per_epoch = max(1, train_flow.samples // train_flow.batch_size)
     validation_steps = max(1, val_flow.samples // val_flow.batch_size)
-    history = model.fit(
-        train_flow,
+    from training_state import TrainingState, fit_resumable
+    state = TrainingState(args.checkpoint_dir, train_flow, callbacks=callbacks,
+                          every_steps=args.checkpoint_steps, every_seconds=args.checkpoint_seconds)
+    history = fit_resumable(
+        model, train_flow, val_flow,
         epochs=args.epochs,
         steps_per_epoch=steps_per_epoch,
-        validation_data=val_flow,
         validation_steps=validation_steps,
-        callbacks=callbacks
+        callbacks=callbacks,
+        state=state,
+        resume=args.resume
     )
     # Optionally fine-tune
-    if args.unfreeze_after and args.unfreeze_after < args.epochs:
+    if args.finetune_blocks:
+        from finetune_cache import finetune_top_blocks, save_report
+        _, report = finetune_top_blocks(
+            model, train_flow, val_flow,
+            top_blocks=args.finetune_blocks,
+            epochs=args.finetune_epochs,
+            cache_dir=args.finetune_cache_dir,
+            aug_passes=args.finetune_aug_passes,
+            batch_size=args.batch_size
+        )
+        save_report(report)
+    elif args.unfreeze_after and args.unfreeze_after < args.epochs:
         print("[INFO] Fine-tuning: unfreezing base model")
-        base = model.layers[0]
-        base.trainable = True
+        # The backbone layers live directly in this model (layers[0] is the InputLayer)
+        from model_utils import set_backbone_trainable
+        set_backbone_trainable(model)
         # recompile with lower LR
         model.compile(optimizer=Adam(1e-5), loss='binary_crossentropy', metrics=['accuracy'])
         model.fit(train_flow, epochs=5, validation_data=val_flow)
@@ -112,7 +201,7 @@ def main():
     model.save("final_model.h5")
     # save history
     with open("training_history.json", "w") as f:
-        json.dump({k: [float(x) for x in v] for k, v in history.history.items()}, f)
+        json.dump(history, f)
     print("Training finished. Saved best_model.h5 and final_model.h5")
 
 if __name__ == "__main__":
@@ -0,0 +1,184 @@
+"""
+training_profiler.py
+--------------------
+Profiling mode for train_model.py: tells whether a run is input-bound
+(ImageDataGenerator augmentation / disk reads) or compute-bound (the model step).
+
+Usage:
+    python train_model.py --profile --epochs 2
+    python train_model.py --profile --profile_trace_steps 5,10 --profile_dir profile_logs
+
+StepProfiler is a Keras callback. It wraps the model's train_step so that two
+in-graph tf.timestamp() ops mark when the batch arrived from the input pipeline
+and when the optimizer update finished. Per step:
+ - data wait = batch arrival - on_train_batch_begin (time blocked on input)
+ - compute   = update finished - batch arrival
+It also records images/sec per epoch, can capture a TensorFlow profiler trace
+for a step range, and writes a JSON summary with the verdict and (when a trace
+was captured) the slowest ops.
+"""
+import collections
+import glob
+import json
+import os
+import time
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+def top_ops_from_trace(logdir, top_k=10):
+    """Aggregate op durations from the newest .xplane.pb under logdir -> [(op, total_ms, calls), ...]."""
+    runs = sorted(glob.glob(os.path.join(logdir, "plugins", "profile", "*", "*.xplane.pb")), key=os.path.getmtime)
+    if not runs:
+        return []
+    try:
+        from tsl.profiler.protobuf import xplane_pb2
+    except ImportError:
+        from tensorflow.tsl.profiler.protobuf import xplane_pb2
+    space = xplane_pb2.XSpace()
+    with open(runs[-1], "rb") as f:
+        space.ParseFromString(f.read())
+    total = collections.Counter()
+    calls = collections.Counter()
+    for plane in space.planes:
+        for line in plane.lines:
+            # Executor threads on CPU ("tf_Compute/...") or device op lines on GPU
+            if not (line.name.startswith("tf_Compute") or line.name in ("TensorFlow Ops", "XLA Ops")):
+                continue
+            for event in line.events:
+                name = plane.event_metadata[event.metadata_id].name
+                if ":" not in name or "::" in name:  # executor bookkeeping, not an op
+                    continue
+                total[name] += event.duration_ps
+                calls[name] += 1
+    return [(name, ps / 1e9, calls[name]) for name, ps in total.most_common(top_k)]
+
+class StepProfiler(keras.callbacks.Callback):
+    """Records data-wait vs compute time per step and images/sec per epoch.
+
+    trace_steps: optional (start, stop) global step range to capture with the
+    TensorFlow profiler into trace_dir. input_bound_threshold: fraction of step
+    time spent waiting on input above which the run is reported input-bound.
+    """
+
+    def __init__(self, summary_path="profile_summary.json", trace_dir="profile_logs", trace_steps=None,
+                 input_bound_threshold=0.25, skip_steps=1):
+        super().__init__()
+        self.summary_path = summary_path
+        self.trace_dir = trace_dir
+        self.trace_steps = trace_steps
+        self.input_bound_threshold = input_bound_threshold
+        self.skip_steps = skip_steps  # first step includes tf.function tracing
+        self.t_start = tf.Variable(0.0, dtype=tf.float64, trainable=False)
+        self.t_end = tf.Variable(0.0, dtype=tf.float64, trainable=False)
+        self.batch_size = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.global_step = 0
+        self.tracing = False
+        self.steps = []   # (epoch, data_wait_s, compute_s, overhead_s, images)
+        self.epochs = []
+
+    def set_model(self, model):
+        super().set_model(model)
+        if getattr(model, "_step_profiler", None) is self:
+            return
+        original = model.train_step
+
+        def train_step(data):
+            with tf.control_dependencies(tf.nest.flatten(data)):
+                start = tf.timestamp()
+            with tf.control_dependencies([self.t_start.assign(start)]):
+                data = tf.nest.map_structure(tf.identity, data)
+            self.batch_size.assign(tf.cast(tf.shape(tf.nest.flatten(data)[0])[0], tf.int64))
+            logs = original(data)
+            with tf.control_dependencies(tf.nest.flatten(logs)):
+                self.t_end.assign(tf.timestamp())
+            return logs
+
+        model.train_step = train_step
+        model._step_profiler = self
+        model.train_function = None  # force a retrace with the instrumented step
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.current_epoch = epoch
+        self.epoch_start = time.time()
+        self.epoch_images = 0
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.trace_steps and self.global_step == self.trace_steps[0] and not self.tracing:
+            tf.profiler.experimental.start(self.trace_dir)
+            self.tracing = True
+        self.batch_begin = time.time()
+
+    def on_train_batch_end(self, batch, logs=None):
+        now = time.time()
+        start, end = float(self.t_start.numpy()), float(self.t_end.numpy())
+        images = int(self.batch_size.numpy())
+        self.epoch_images += images
+        if self.global_step >= self.skip_steps:
+            wait = max(0.0, start - self.batch_begin)
+            compute = max(0.0, end - start)
+            self.steps.append((self.current_epoch, wait, compute, max(0.0, now - end), images))
+        self.global_step += 1
+        if self.tracing and self.global_step >= self.trace_steps[1]:
+            tf.profiler.experimental.stop()
+            self.tracing = False
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.time() - self.epoch_start
+        self.epochs.append({
+            "epoch": epoch,
+            "seconds": elapsed,
+            "images": self.epoch_images,
+            "images_per_sec": self.epoch_images / max(elapsed, 1e-9),
+        })
+        print(f"[PROFILE] epoch {epoch}: {self.epoch_images / max(elapsed, 1e-9):.1f} images/sec")
+
+    def on_train_end(self, logs=None):
+        if self.tracing:
+            tf.profiler.experimental.stop()
+            self.tracing = False
+        summary = self.summary()
+        with open(self.summary_path, "w") as f:
+            json.dump(summary, f, indent=2)
+        self.print_summary(summary)
+
+    def summary(self):
+        steps = np.array([s[1:4] for s in self.steps]) if self.steps else np.zeros((0, 3))
+        wait, compute, overhead = (steps.sum(axis=0) if len(steps) else (0.0, 0.0, 0.0))
+        step_total = wait + compute + overhead
+        wait_fraction = wait / step_total if step_total else 0.0
+        summary = {
+            "steps_measured": len(steps),
+            "mean_step_ms": 1e3 * step_total / max(len(steps), 1),
+            "mean_data_wait_ms": 1e3 * wait / max(len(steps), 1),
+            "mean_compute_ms": 1e3 * compute / max(len(steps), 1),
+            "mean_overhead_ms": 1e3 * overhead / max(len(steps), 1),
+            "p90_data_wait_ms": float(1e3 * np.percentile(steps[:, 0], 90)) if len(steps) else 0.0,
+            "data_wait_fraction": wait_fraction,
+            "verdict": "input-bound" if wait_fraction > self.input_bound_threshold else "compute-bound",
+            "epochs": self.epochs,
+            "top_ops": [],
+        }
+        if self.trace_steps:
+            try:
+                summary["top_ops"] = [{"op": n, "total_ms": ms, "calls": c} for n, ms, c in top_ops_from_trace(self.trace_dir)]
+            except Exception as e:
+                print("[WARN] could not read profiler trace:", e)
+        return summary
+
+    def print_summary(self, s):
+        print("\n" + "=" * 60)
+        print("TRAINING PROFILE")
+        print("=" * 60)
+        print(f"Steps measured:   {s['steps_measured']}")
+        print(f"Mean step:        {s['mean_step_ms']:.1f} ms")
+        print(f"  data wait:      {s['mean_data_wait_ms']:.1f} ms (p90 {s['p90_data_wait_ms']:.1f} ms)")
+        print(f"  compute:        {s['mean_compute_ms']:.1f} ms")
+        print(f"  overhead:       {s['mean_overhead_ms']:.1f} ms")
+        print(f"Verdict:          {s['verdict'].upper()} ({s['data_wait_fraction']*100:.0f}% of step time waiting on input)")
+        if s["top_ops"]:
+            print("Slowest ops in traced steps:")
+            for op in s["top_ops"]:
+                print(f"  {op['total_ms']:9.2f} ms  x{op['calls']:<4d} {op['op']}")
+        print(f"Summary written to {self.summary_path}")
+        print("=" * 60)
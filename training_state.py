@@ -0,0 +1,215 @@
+"""
+training_state.py
+-----------------
+Full training-state checkpoints for train_model.py. A killed run restarts
+with --resume where it stopped instead of from epoch 0.
+
+Usage:
+    python train_model.py --epochs 30 --checkpoint_seconds 300
+    python train_model.py --epochs 30 --resume          # after a crash / preemption
+
+A checkpoint in <state_dir>/ holds:
+ - model weights and optimizer state (Adam slots, iteration count, learning rate)
+ - epoch and batch position plus the shuffled sample order of the current
+   epoch, so an interrupted epoch continues with the batches it had not seen yet
+ - numpy's global RNG state (ImageDataGenerator augmentation and the
+   per-epoch reshuffle draw from it)
+ - ModelCheckpoint / EarlyStopping / ReduceLROnPlateau state (best value,
+   wait and cooldown counters, EarlyStopping's best weights)
+ - the history of the completed epochs
+
+Checkpoints are written at the end of every epoch and, inside an epoch, every
+N steps and/or T seconds. state.json is replaced atomically after the weights
+are on disk, so a kill during a save leaves the previous checkpoint usable.
+The train metrics of a resumed epoch only cover the batches run after the resume.
+"""
+import json
+import os
+import time
+from pathlib import Path
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+STATE_FILE = "state.json"
+CALLBACK_ATTRS = ("best", "wait", "stopped_epoch", "best_epoch", "cooldown_counter")
+# DirectoryIterator / DataFrameIterator keep their epoch order in index_array, ShardSequence in order
+ORDER_ATTRS = ("index_array", "order")
+
+def _order_attr(flow):
+    return next((a for a in ORDER_ATTRS if hasattr(flow, a)), None)
+
+def _jsonable(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+class _SkipBatches(keras.utils.Sequence):
+    """flow without its first `skip` batches, to finish an interrupted epoch."""
+
+    def __init__(self, flow, skip):
+        super().__init__()
+        self.flow, self.skip = flow, skip
+
+    def __len__(self):
+        return len(self.flow) - self.skip
+
+    def __getitem__(self, idx):
+        return self.flow[idx + self.skip]
+
+    def on_epoch_end(self):
+        self.flow.on_epoch_end()
+
+class TrainingState(keras.callbacks.Callback):
+    """Writes and restores full training state. Must be the last callback, so its
+    on_train_begin runs after the others reset their counters and its on_epoch_end
+    sees their updated state."""
+
+    def __init__(self, state_dir="training_state", train_flow=None, callbacks=(), every_steps=0,
+                 every_seconds=600, max_to_keep=2):
+        super().__init__()
+        self.state_dir = Path(state_dir)
+        self.train_flow = train_flow
+        self.tracked = list(callbacks)
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.max_to_keep = max_to_keep
+        self.epoch, self.batch, self.global_step = 0, 0, 0
+        self.history = {}
+        self.stopped = False
+        self._manager = None
+        self._pending = None
+        self._last_save = time.monotonic()
+
+    def _checkpoint_manager(self):
+        if self._manager is None:
+            ckpt = tf.train.Checkpoint(model=self.model, optimizer=self.model.optimizer)
+            self._manager = tf.train.CheckpointManager(ckpt, str(self.state_dir / "ckpt"), max_to_keep=self.max_to_keep)
+        return self._manager
+
+    def save(self):
+        manager = self._checkpoint_manager()
+        path = manager.save(checkpoint_number=self.global_step)
+        arrays = {}
+        attr = _order_attr(self.train_flow)
+        if self.batch and attr and getattr(self.train_flow, attr) is not None:
+            arrays["order"] = np.asarray(getattr(self.train_flow, attr))
+        _, keys, pos, has_gauss, cached = np.random.get_state()
+        arrays["np_random_keys"] = keys
+        callbacks = self._callback_state()
+        for i, cb_state in enumerate(callbacks):
+            for j, w in enumerate(cb_state.pop("best_weights", None) or []):
+                arrays[f"cb{i}_w{j:04d}"] = w
+        np.savez(path + ".npz", **arrays)
+        state = {
+            "epoch": self.epoch,
+            "batch": self.batch,
+            "global_step": self.global_step,
+            "stopped": bool(self.model.stop_training),
+            "checkpoint": os.path.basename(path),
+            "lr": float(keras.backend.get_value(self.model.optimizer.learning_rate)),
+            "np_random": [int(pos), int(has_gauss), float(cached)],
+            "callbacks": callbacks,
+            "history": self.history,
+            "saved_at": time.time(),
+        }
+        tmp = self.state_dir / (STATE_FILE + ".tmp")
+        tmp.write_text(json.dumps(state, indent=2))
+        os.replace(tmp, self.state_dir / STATE_FILE)
+        keep = {os.path.basename(p) + ".npz" for p in manager.checkpoints}
+        for f in (self.state_dir / "ckpt").glob("*.npz"):
+            if f.name not in keep:
+                f.unlink()
+        self._last_save = time.monotonic()
+
+    def _callback_state(self):
+        return [{"class": type(cb).__name__, "best_weights": getattr(cb, "best_weights", None),
+                 **{a: _jsonable(getattr(cb, a)) for a in CALLBACK_ATTRS if hasattr(cb, a)}}
+                for cb in self.tracked]
+
+    def restore(self, model):
+        """Load the latest checkpoint into model (compiled, same architecture).
+        Returns (initial_epoch, batches_done_in_that_epoch), or None without a checkpoint."""
+        state_path = self.state_dir / STATE_FILE
+        if not state_path.exists():
+            return None
+        state = json.loads(state_path.read_text())
+        self.set_model(model)
+        # Create the optimizer slots up front so the restore can fill them
+        model.optimizer.build(model.trainable_variables)
+        ckpt_path = str(self.state_dir / "ckpt" / state["checkpoint"])
+        self._checkpoint_manager().checkpoint.restore(ckpt_path).assert_existing_objects_matched()
+        keras.backend.set_value(model.optimizer.learning_rate, state["lr"])
+        with np.load(ckpt_path + ".npz") as arrays:
+            pos, has_gauss, cached = state["np_random"]
+            np.random.set_state(("MT19937", arrays["np_random_keys"], pos, has_gauss, cached))
+            if "order" in arrays:
+                setattr(self.train_flow, _order_attr(self.train_flow), arrays["order"])
+            for i, cb_state in enumerate(state["callbacks"]):
+                weights = [arrays[k] for k in sorted(arrays.files) if k.startswith(f"cb{i}_w")]
+                if weights:
+                    cb_state["best_weights"] = weights
+        self._pending = state["callbacks"]
+        self.epoch, self.batch, self.global_step = state["epoch"], state["batch"], state["global_step"]
+        self.history, self.stopped = state["history"], state["stopped"]
+        return self.epoch, self.batch
+
+    def on_train_begin(self, logs=None):
+        # Runs after the other callbacks reset themselves, on every fit: the
+        # restored state on resume, the previous fit's state on the fit that
+        # follows a resumed partial epoch
+        if self._pending:
+            for cb, cb_state in zip(self.tracked, self._pending):
+                for k, v in cb_state.items():
+                    if k != "class" and (k != "best_weights" or v is not None):
+                        setattr(cb, k, v)
+            self._pending = None
+        self._last_save = time.monotonic()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        if epoch != self.epoch:
+            self.epoch, self.batch = epoch, 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.batch += 1
+        self.global_step += 1
+        if (self.every_steps and self.global_step % self.every_steps == 0) or \
+                (self.every_seconds and time.monotonic() - self._last_save >= self.every_seconds):
+            self.save()
+
+    def on_epoch_end(self, epoch, logs=None):
+        for k, v in (logs or {}).items():
+            self.history.setdefault(k, []).append(float(v))
+        self.epoch, self.batch = epoch + 1, 0
+        self.save()
+
+    def on_train_end(self, logs=None):
+        # EarlyStopping may have just restored its best weights
+        if self.model.stop_training:
+            self.save()
+        self._pending = self._callback_state()
+
+def fit_resumable(model, train_flow, val_flow, epochs, steps_per_epoch, validation_steps, callbacks, state, resume=False):
+    """model.fit with `state` appended as the last callback; with resume, continues
+    from state's latest checkpoint. Returns the history dict over all epochs."""
+    callbacks = list(callbacks) + [state]
+    initial_epoch, skip = 0, 0
+    if resume:
+        restored = state.restore(model)
+        if restored is None:
+            print(f"[INFO] No training state in {state.state_dir}, starting from scratch")
+        else:
+            initial_epoch, skip = restored
+            print(f"[INFO] Resuming at epoch {initial_epoch + 1}, batch {skip} (global step {state.global_step})")
+    if state.stopped:
+        print("[INFO] Training had already stopped early; nothing to resume")
+        return state.history
+    # The flows reshuffle their own sample order every epoch; Keras' extra batch-order
+    # shuffle would make the position inside an epoch unrecoverable
+    fit_kwargs = dict(validation_data=val_flow, validation_steps=validation_steps, callbacks=callbacks, shuffle=False)
+    if skip and initial_epoch < epochs:
+        skip = min(skip, steps_per_epoch - 1)
+        model.fit(_SkipBatches(train_flow, skip), initial_epoch=initial_epoch, epochs=initial_epoch + 1,
+                  steps_per_epoch=steps_per_epoch - skip, **fit_kwargs)
+        initial_epoch += 1
+    if initial_epoch < epochs and not model.stop_training:
+        model.fit(train_flow, initial_epoch=initial_epoch, epochs=epochs, steps_per_epoch=steps_per_epoch, **fit_kwargs)
+    return state.history
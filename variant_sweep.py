@@ -0,0 +1,236 @@
+"""
+variant_sweep.py
+----------------
+Input-resolution x width-multiplier (alpha) sweep of the MobileNetV2 classifier,
+with a test accuracy vs CPU latency Pareto report.
+
+Usage:
+    python variant_sweep.py --data_dir "data/water images"
+    python variant_sweep.py --sizes 96,128,160 --alphas 0.35,0.5 --tolerance 0.03 --export serving_model.h5
+    python variant_sweep.py --max_latency_ms 15     # pick the most accurate variant under 15 ms
+
+This script:
+ - For every (size, alpha) variant, builds build_model(alpha=...) at size x size,
+   computes the backbone embeddings of the train and test split once
+   (embeddings.py, cached) and trains the Dense head on them in NumPy
+ - Saves every variant to <sweep_dir>/variants/ and measures it in a fresh
+   process that only loads the .h5, as a serving process would: single-image
+   and batched inference latency with --threads CPU threads (1 matches
+   api_server.py), peak RSS, parameter count and file size
+ - Marks the Pareto frontier (no other variant is both faster and at least as
+   accurate), writes pareto_report.json/.csv and pareto.png, and copies the
+   chosen variant to --export. The choice is the fastest frontier variant
+   within --tolerance of the best accuracy, or the most accurate one under
+   --max_latency_ms
+
+api_server.py and predict_image.py read the input size from the loaded model,
+so the exported file can be served as is (MODEL_PATH=serving_model.h5).
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+
+SIZES = (96, 128, 160, 192, 224)
+ALPHAS = (0.35, 0.5, 0.75, 1.0)
+
+def variant_name(size, alpha):
+    return f"mnv2_{size}_a{alpha:g}"
+
+def train_variant(size, alpha, train_files, test_files, out_path, weights="imagenet", head_epochs=150, seed=0):
+    """Build one variant, fit its head on cached embeddings and save it. Returns accuracy info."""
+    from embeddings import compute_embeddings, feature_extractor, fit_head, predict_head, set_head_weights
+    from train_model import build_model
+
+    start = time.perf_counter()
+    model = build_model(img_size=(size, size, 3), weights=weights, alpha=alpha)
+    extractor, _ = feature_extractor(model)
+    X_train, y_train, class_names = compute_embeddings(extractor, train_files)
+    X_test, y_test, _ = compute_embeddings(extractor, test_files)
+    head = fit_head(X_train, y_train, epochs=head_epochs, seed=seed)
+    set_head_weights(model, head)
+    prob = predict_head(head, X_test)
+    model.save(out_path)
+    return {
+        "variant": variant_name(size, alpha),
+        "size": size,
+        "alpha": alpha,
+        "test_accuracy": float(((prob >= 0.5) == y_test).mean()),
+        "classes": class_names,
+        "params": int(model.count_params()),
+        "file_mb": os.path.getsize(out_path) / 2 ** 20,
+        "train_seconds": time.perf_counter() - start,
+        "path": str(out_path),
+    }
+
+def peak_rss_mb():
+    """Peak RSS of this process. VmHWM is reset by exec, unlike ru_maxrss, which a
+    spawned child inherits from its parent."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def measure_variant(path, images, runs=50, batch_size=32):
+    """Latency (ms) and peak RSS (MB) of a saved model on images already at its input
+    size, measured in the calling process."""
+    import tensorflow as tf
+    from tensorflow.keras.models import load_model
+    model = load_model(path, compile=False)
+    # A traced call measures the network rather than Keras' per-call predict overhead,
+    # which is the same for every variant
+    infer = tf.function(lambda x: model(x, training=False))
+    single = tf.constant(images[:1])
+    batch = tf.constant(np.resize(images, (batch_size,) + images.shape[1:]))
+    infer(single).numpy()  # trace + warm up
+    infer(batch).numpy()
+
+    def timed(x, n):
+        times = []
+        for _ in range(n):
+            t = time.perf_counter()
+            infer(x).numpy()
+            times.append((time.perf_counter() - t) * 1000)
+        return np.array(times)
+
+    one = timed(single, runs)
+    many = timed(batch, max(5, runs // 5))
+    return {
+        "single_ms_p50": float(np.percentile(one, 50)),
+        "single_ms_p95": float(np.percentile(one, 95)),
+        "batch_ms_p50": float(np.percentile(many, 50)),
+        "batch_per_image_ms": float(np.percentile(many, 50) / batch_size),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def pareto_front(results, cost="single_ms_p50", gain="test_accuracy"):
+    """Mark r['pareto'] for results not dominated on (lower cost, higher gain)."""
+    for r in results:
+        r["pareto"] = not any(
+            o is not r and o[cost] <= r[cost] and o[gain] >= r[gain] and (o[cost] < r[cost] or o[gain] > r[gain])
+            for o in results)
+    return [r for r in results if r["pareto"]]
+
+def choose(front, tolerance=0.02, max_latency_ms=None):
+    if max_latency_ms is not None:
+        fits = [r for r in front if r["single_ms_p50"] <= max_latency_ms]
+        if fits:
+            return max(fits, key=lambda r: (r["test_accuracy"], -r["single_ms_p50"]))
+        print(f"[WARN] No variant under {max_latency_ms} ms; falling back to --tolerance")
+    best = max(r["test_accuracy"] for r in front)
+    return min((r for r in front if r["test_accuracy"] >= best - tolerance), key=lambda r: r["single_ms_p50"])
+
+def save_plot(results, chosen, path):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(8, 5))
+    for alpha in sorted({r["alpha"] for r in results}):
+        rs = sorted((r for r in results if r["alpha"] == alpha), key=lambda r: r["size"])
+        ax.plot([r["single_ms_p50"] for r in rs], [r["test_accuracy"] for r in rs], "o-", label=f"alpha {alpha:g}")
+        for r in rs:
+            ax.annotate(str(r["size"]), (r["single_ms_p50"], r["test_accuracy"]), fontsize=7,
+                        xytext=(3, 3), textcoords="offset points")
+    front = sorted((r for r in results if r["pareto"]), key=lambda r: r["single_ms_p50"])
+    ax.step([r["single_ms_p50"] for r in front], [r["test_accuracy"] for r in front], "k--", where="post",
+            label="Pareto frontier")
+    ax.scatter([chosen["single_ms_p50"]], [chosen["test_accuracy"]], s=200, facecolors="none", edgecolors="r",
+               label="chosen")
+    ax.set_xlabel("single-image latency p50 (ms)")
+    ax.set_ylabel("test accuracy")
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+    plt.close(fig)
+
+def write_report(results, chosen, sweep_dir):
+    with open(sweep_dir / "pareto_report.json", "w") as f:
+        json.dump({"chosen": chosen["variant"], "variants": results}, f, indent=2)
+    keys = ["variant", "size", "alpha", "test_accuracy", "single_ms_p50", "single_ms_p95", "batch_ms_p50",
+            "batch_per_image_ms", "peak_rss_mb", "params", "file_mb", "pareto"]
+    with open(sweep_dir / "pareto_report.csv", "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(keys)
+        for r in results:
+            w.writerow([r[k] for k in keys])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_dir", default="data/water images")
+    parser.add_argument("--manifest", default=None, help="dataset_manifest.py output to read the file lists from")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)))
+    parser.add_argument("--alphas", default=",".join(f"{a:g}" for a in ALPHAS))
+    parser.add_argument("--head_epochs", type=int, default=150)
+    parser.add_argument("--parallel", type=int, default=max(1, (os.cpu_count() or 1) // 4), help="Variants trained concurrently")
+    parser.add_argument("--threads", type=int, default=1, help="CPU threads for the latency measurement")
+    parser.add_argument("--runs", type=int, default=50, help="Timed single-image predictions per variant")
+    parser.add_argument("--batch_size", type=int, default=32, help="Batch size for the batched latency")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="Accuracy you will give up for speed")
+    parser.add_argument("--max_latency_ms", type=float, default=None, help="Latency budget; overrides --tolerance")
+    parser.add_argument("--sweep_dir", default="variant_sweep")
+    parser.add_argument("--export", default="serving_model.h5")
+    parser.add_argument("--weights", default="imagenet", help="'imagenet' or 'none'")
+    args = parser.parse_args()
+    if args.weights == "none":
+        args.weights = None
+
+    from hparam_sweep import _init_worker
+    from shard_dataset import collect_split_files
+    train_files = collect_split_files("train", args.data_dir, args.manifest)
+    test_files = collect_split_files("test", args.data_dir, args.manifest)
+    sweep_dir = Path(args.sweep_dir)
+    (sweep_dir / "variants").mkdir(parents=True, exist_ok=True)
+    variants = [(int(s), float(a)) for s in args.sizes.split(",") for a in args.alphas.split(",")]
+    ctx = multiprocessing.get_context("spawn")
+
+    print(f"[INFO] Training heads for {len(variants)} variants, {args.parallel} at a time")
+    threads = max(1, (os.cpu_count() or 1) // args.parallel)
+    with ProcessPoolExecutor(max_workers=args.parallel, mp_context=ctx, initializer=_init_worker, initargs=(threads,)) as pool:
+        futures = [pool.submit(train_variant, s, a, train_files, test_files,
+                               str(sweep_dir / "variants" / f"{variant_name(s, a)}.h5"), args.weights, args.head_epochs)
+                   for s, a in variants]
+        results = []
+        for f in futures:
+            results.append(f.result())
+            print(f"[INFO] {results[-1]['variant']}: test acc {results[-1]['test_accuracy']:.3f}")
+
+    # One fresh process per variant, one at a time, so latency and RSS are not
+    # skewed by training memory or by other variants running alongside
+    from embeddings import load_images
+    print(f"[INFO] Measuring latency with {args.threads} thread(s)")
+    for r in results:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx, initializer=_init_worker, initargs=(args.threads,)) as pool:
+            images = load_images([p for p, _ in test_files[:args.batch_size]], (r["size"], r["size"]))
+            r.update(pool.submit(measure_variant, r["path"], images, args.runs, args.batch_size).result())
+
+    front = pareto_front(results)
+    chosen = choose(front, args.tolerance, args.max_latency_ms)
+    results.sort(key=lambda r: r["single_ms_p50"])
+    write_report(results, chosen, sweep_dir)
+    save_plot(results, chosen, sweep_dir / "pareto.png")
+    shutil.copyfile(chosen["path"], args.export)
+
+    print("\n" + "=" * 92)
+    print(f"{'variant':<16} {'acc':>6} {'1-img p50':>10} {'p95':>7} {'batch/img':>10} {'RSS MB':>8} {'params':>9} {'MB':>6}")
+    print("=" * 92)
+    for r in results:
+        mark = " <- chosen" if r is chosen else (" *" if r["pareto"] else "")
+        print(f"{r['variant']:<16} {r['test_accuracy']:>6.3f} {r['single_ms_p50']:>8.1f}ms {r['single_ms_p95']:>5.1f}ms "
+              f"{r['batch_per_image_ms']:>8.2f}ms {r['peak_rss_mb']:>8.0f} {r['params']:>9,} {r['file_mb']:>6.1f}{mark}")
+    print("=" * 92)
+    print("* = Pareto frontier (test accuracy vs single-image latency)")
+    print(f"Exported {chosen['variant']} to {args.export}; report in {sweep_dir}/pareto_report.json")
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,7 @@ import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 os.environ['OMP_NUM_THREADS'] = '1'
 
-from flask import Flask, render_template_string, request, jsonify
+from flask import Flask, Response, render_template_string, request, jsonify
 import numpy as np
 from PIL import Image
 from tensorflow.keras.models import load_model
@@ -22,6 +22,10 @@ print("Loading model...")
 model = load_model("best_model.h5", compile=False)
 print("Model loaded successfully!")
 
+# Grad-CAM graph is built and traced once, not per request
+from grad_cam import GradCAM, overlay, to_png
+explainer = GradCAM(model)
+
 IMG_SIZE = (224, 224)
 
 HTML_TEMPLATE = """
@@ -134,6 +138,17 @@ HTML_TEMPLATE = """
             color: #667eea;
             font-size: 18px;
         }
+        .heatmap-toggle {
+            text-align: center;
+            margin-bottom: 15px;
+            color: #666;
+        }
+        .heatmap {
+            max-width: 100%;
+            margin: 20px auto 0;
+            display: none;
+            border-radius: 10px;
+        }
         .stats {
             display: grid;
             grid-template-columns: 1fr 1fr;
@@ -170,6 +185,10 @@ HTML_TEMPLATE = """
         
         <img id="preview" class="preview">
         
+        <div class="heatmap-toggle">
+            <label><input type="checkbox" id="heatmapToggle"> Show heatmap (Grad-CAM)</label>
+        </div>
+        
         <button class="btn" id="predictBtn" onclick="predictImage()" disabled>
             Analyze Water Quality
         </button>
@@ -182,6 +201,7 @@ HTML_TEMPLATE = """
             <h2 id="resultLabel"></h2>
             <div class="confidence" id="confidence"></div>
             <div class="message" id="message"></div>
+            <img id="heatmap" class="heatmap">
         </div>
         
         <div class="stats">
@@ -226,12 +246,14 @@ HTML_TEMPLATE = """
             formData.append('image', selectedFile);
 
             try {
-                const response = await fetch('/predict', {
+                const explain = document.getElementById('heatmapToggle').checked;
+                const response = await fetch(explain ? '/explain' : '/predict', {
                     method: 'POST',
                     body: formData
                 });
 
-                const data = await response.json();
+                let data = await response.json();
+                if (explain) data = data.results[0];
 
                 document.getElementById('loading').style.display = 'none';
                 
@@ -244,6 +266,9 @@ HTML_TEMPLATE = """
                 document.getElementById('confidence').textContent = 
                     'Confidence: ' + data.confidence.toFixed(1) + '%';
                 document.getElementById('message').textContent = data.message;
+                const heatmap = document.getElementById('heatmap');
+                heatmap.src = explain ? data.heatmap : '';
+                heatmap.style.display = explain ? 'block' : 'none';
                 
                 document.getElementById('predictBtn').disabled = false;
             } catch (error) {
@@ -290,6 +315,36 @@ def predict():
         'message': message
     })
 
+@app.route('/explain', methods=['POST'])
+def explain():
+    """Grad-CAM for one or more images (all sent as 'image'), run as one batch.
+    JSON with a base64 PNG overlay per image, or ?format=png for a single image."""
+    files = [f for f in request.files.getlist('image') if f.filename != '']
+    if not files:
+        return jsonify({'error': 'No image uploaded'}), 400
+    
+    images = [Image.open(f.stream).convert('RGB') for f in files]
+    heatmaps, probs = explainer.explain(images)
+    
+    if request.args.get('format') == 'png':
+        if len(images) != 1:
+            return jsonify({'error': 'format=png takes exactly one image'}), 400
+        return Response(to_png(overlay(images[0], heatmaps[0])), mimetype='image/png')
+    
+    results = []
+    for img, heatmap, prob in zip(images, heatmaps, probs):
+        prob = float(prob)
+        label = "Dirty" if prob >= 0.5 else "Clean"
+        results.append({
+            'label': label,
+            'confidence': prob * 100 if prob >= 0.5 else (1 - prob) * 100,
+            'probability': prob,
+            'message': "✗ Water appears NOT SAFE to drink (according to model)" if label == "Dirty"
+                       else "✓ Water appears SAFE to drink (according to model)",
+            'heatmap': 'data:image/png;base64,' + base64.b64encode(to_png(overlay(img, heatmap))).decode('ascii')
+        })
+    return jsonify({'results': results})
+
 if __name__ == '__main__':
     print("\n" + "="*70)
     print("💧 WATER QUALITY PREDICTION SYSTEM")
@@ -0,0 +1,138 @@
+"""
+zip_dataset.py
+--------------
+Reads a dataset zip (root/train/<class>/..., optional root/test/<class>/...)
+member by member through the zip central directory, without extracting it.
+
+Usage:
+    python zip_dataset.py --zip dataset.zip
+    python zip_dataset.py --zip dataset.zip --cache_dir .dataset_cache
+
+prepare_zip_dataset() fingerprints the archive from its central directory
+(member names, CRC-32s and sizes), decodes the JPEG members straight into
+shard_dataset.py shards under <cache_dir>/<fingerprint>/, and returns that
+directory. A re-upload of the same zip finds the existing shards and skips
+decoding entirely.
+"""
+import argparse
+import hashlib
+import io
+import shutil
+import zipfile
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from dataset_manifest import IMAGE_EXTENSIONS
+from shard_dataset import IMG_SIZE, INDEX_FILE, pack_split
+
+DEFAULT_CACHE_DIR = ".dataset_cache"
+
+def archive_fingerprint(zf):
+    """sha256 over (name, crc, size) of every member; reads only the central directory."""
+    h = hashlib.sha256()
+    for info in sorted(zf.infolist(), key=lambda i: i.filename):
+        h.update(f"{info.filename}\0{info.CRC}\0{info.file_size}\n".encode())
+    return h.hexdigest()[:16]
+
+class ZipImageDataset:
+    """Random access to the images in a dataset zip, grouped by split and class.
+
+    source may be a path or a seekable file object (e.g. io.BytesIO over an
+    upload buffer). The dataset root is the shallowest directory that contains
+    train/, so both "train/..." and "my_dataset/train/..." layouts work.
+    """
+
+    def __init__(self, source):
+        self.zf = zipfile.ZipFile(source, "r")
+        self.fingerprint = archive_fingerprint(self.zf)
+        self.members = {}  # split -> [(member_name, class_name), ...]
+        self.root = self._find_root()
+        if self.root is None:
+            raise FileNotFoundError("Could not find train/ folder inside zip")
+        for info in self.zf.infolist():
+            if info.is_dir() or not info.filename.startswith(self.root):
+                continue
+            parts = info.filename[len(self.root):].split("/")
+            if len(parts) < 3 or parts[0] not in ("train", "test"):
+                continue
+            if Path(parts[-1]).suffix.lower() not in IMAGE_EXTENSIONS or parts[-1].startswith("._"):
+                continue
+            self.members.setdefault(parts[0], []).append((info.filename, parts[1]))
+        for split in self.members:
+            self.members[split].sort()
+
+    def _find_root(self):
+        roots = set()
+        for name in self.zf.namelist():
+            parts = name.split("/")
+            if "train" in parts[:-1] and "__MACOSX" not in parts:
+                roots.add("/".join(parts[:parts.index("train")]))
+        if not roots:
+            return None
+        root = min(roots, key=lambda r: (r.count("/"), len(r)))
+        return root + "/" if root else ""
+
+    def files(self, split):
+        """[(member_name, class_name), ...] for a split, sorted by member name."""
+        return list(self.members.get(split, []))
+
+    def read_bytes(self, member):
+        return self.zf.read(member)
+
+    def decode_resized(self, member, img_size=IMG_SIZE):
+        """Decode one member into uint8 [H, W, 3], resized like flow_from_directory."""
+        with Image.open(io.BytesIO(self.read_bytes(member))) as img:
+            return np.asarray(img.convert("RGB").resize(img_size, Image.NEAREST), dtype=np.uint8)
+
+    def close(self):
+        self.zf.close()
+
+def _evict_old_entries(cache_dir, keep):
+    entries = sorted((p for p in Path(cache_dir).iterdir() if p.is_dir()),
+                     key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in entries[keep:]:
+        shutil.rmtree(old, ignore_errors=True)
+
+def prepare_zip_dataset(source, cache_dir=DEFAULT_CACHE_DIR, keep=3, workers=None):
+    """Decode a dataset zip into shards once per distinct archive.
+
+    Returns (shard_dir, reused). shard_dir can be passed as shard_dir to
+    train_model.prepare_generators / evaluate_model.test_generator. Only the
+    `keep` most recently used archives are kept in cache_dir.
+    """
+    dataset = ZipImageDataset(source)
+    try:
+        shard_dir = Path(cache_dir) / dataset.fingerprint
+        if (shard_dir / "train" / INDEX_FILE).exists():
+            shard_dir.touch()
+            return shard_dir, True
+        tmp_dir = Path(cache_dir) / (dataset.fingerprint + ".partial")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        for split in ("train", "test"):
+            files = dataset.files(split)
+            if files:
+                pack_split(files, tmp_dir / split, workers=workers, decode=dataset.decode_resized)
+        # Publish atomically so an interrupted run never looks like a finished cache entry
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        tmp_dir.rename(shard_dir)
+    finally:
+        dataset.close()
+    _evict_old_entries(cache_dir, keep)
+    return shard_dir, False
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--zip", required=True, help="Dataset zip with train/<class>/ (and optional test/<class>/)")
+    parser.add_argument("--cache_dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--keep", type=int, default=3, help="Number of prepared archives to keep in cache_dir")
+    args = parser.parse_args()
+
+    shard_dir, reused = prepare_zip_dataset(args.zip, cache_dir=args.cache_dir, keep=args.keep)
+    print(("Reused" if reused else "Prepared") + " shards:", shard_dir)
+    splits = [s for s in ("train", "test") if (shard_dir / s / INDEX_FILE).exists()]
+    print("  splits:", ", ".join(splits))
+    print(f"  train/evaluate with --shard_dir {shard_dir}")
+
+if __name__ == "__main__":
+    main()